@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+
+from multiprocessing.pool import ThreadPool
+
+import archiveindex
+
+logging.basicConfig(level=logging.INFO)
+
+# name of the resume journal in the destination directory
+JOURNAL = ".archive.journal"
+
+BUFSIZE = 8 * 1024 * 1024   # bytes per read while copying
+
+
+def read_journal( filename ):
+    """Completed copies in a journal, as a dictionary of file name: entry.
+    A truncated last line, from an interrupted job, is ignored"""
+    done = {}
+    if not os.path.isfile( filename ):
+        return done
+    for line in open( filename, 'r' ):
+        try:
+            entry = json.loads( line )
+        except ValueError:
+            continue
+        done[entry['name']] = entry
+    return done
+
+def completed( entry, source, target ):
+    """True if a journal entry shows the file was copied before: the target exists with the recorded size,
+    and the source is gone or unchanged"""
+    if entry is None or not os.path.isfile( target ) or os.path.getsize( target ) != entry['size']:
+        return False
+    if not os.path.isfile( source ):
+        return True
+    st = os.stat( source )
+    return st.st_size == entry['size'] and int( st.st_mtime ) == entry['mtime']
+
+def checksum( filename ):
+    """md5 checksum of a file, read in blocks"""
+    md5 = hashlib.md5()
+    f = open( filename, 'rb' )
+    while True:
+        data = f.read( BUFSIZE )
+        if not data:
+            break
+        md5.update( data )
+    f.close()
+    return md5.hexdigest()
+
+def copy( source, target, verify=False ):
+    """Copy a file to a temporary name next to the target, and rename it when complete.
+    The md5 checksum is computed from the data as it is copied, so the file is read only once;
+    with verify, the written copy is read back and compared before the rename.
+    Returns the size and checksum"""
+
+    working = "{}.{}.working".format( target, os.getpid() )
+    md5 = hashlib.md5()
+    size = 0
+
+    src = open( source, 'rb' )
+    dst = open( working, 'wb' )
+    try:
+        while True:
+            data = src.read( BUFSIZE )
+            if not data:
+                break
+            md5.update( data )
+            dst.write( data )
+            size += len( data )
+        dst.flush()
+        os.fsync( dst.fileno() )
+    except:
+        dst.close()
+        os.remove( working )
+        raise
+    finally:
+        src.close()
+    dst.close()
+
+    # the file may have changed while copying, WRF or a zip step still writing it
+    if size != os.path.getsize( source ) or size != os.path.getsize( working ):
+        os.remove( working )
+        raise IOError( "Size of {} changed while copying".format( source ) )
+
+    if verify and checksum( working ) != md5.hexdigest():
+        os.remove( working )
+        raise IOError( "Checksum of the copy of {} does not match".format( source ) )
+
+    os.rename( working, target )
+    return size, md5.hexdigest()
+
+class Archiver( object ):
+    """Copy files to an archive directory, recording completed files in a resume journal"""
+
+    def __init__( self, dest, remove=True, verify=False ):
+        self.dest = dest
+        self.remove = remove
+        self.verify = verify
+        self.journal = os.path.join( dest, JOURNAL )
+        self.done = read_journal( self.journal )
+        self.lock = threading.Lock()
+
+    def record( self, entry ):
+        """Append an entry to the journal; lines are written whole, so a crash leaves at most one bad line"""
+        with self.lock:
+            f = open( self.journal, 'a' )
+            f.write( json.dumps( entry ) + "\n" )
+            f.flush()
+            os.fsync( f.fileno() )
+            f.close()
+            self.done[entry['name']] = entry
+
+    def archive( self, source ):
+        """Copy one file, unless the journal shows it was copied before, and remove the source.
+        Returns the journal entry, or None if the source does not exist"""
+
+        name = os.path.basename( source )
+        target = os.path.join( self.dest, name )
+
+        if completed( self.done.get( name ), source, target ):
+            logging.info( "%s was archived before", name )
+            entry = self.done[name]
+        elif not os.path.isfile( source ):
+            logging.warn( "%s not found", source )
+            return None
+        else:
+            mtime = int( os.path.getmtime( source ) )
+            size, checksum = copy( source, target, self.verify )
+            entry = { 'name': name, 'size': size, 'mtime': mtime, 'md5': checksum }
+            self.record( entry )
+            logging.info( "%s archived, %i bytes, md5 %s", name, size, checksum )
+
+        if self.remove and os.path.isfile( source ):
+            os.remove( source )
+        return entry
+
+def main():
+    parser = argparse.ArgumentParser(description="Copy files to an archive directory with several concurrent streams, verified with checksums and resumable")
+    parser.add_argument('dest', type=str, help="Archive directory, created if needed")
+    parser.add_argument('files', metavar='file', type=str, nargs='+', help="Files to archive; files missing and not archived before are an error")
+    parser.add_argument('-n', '--streams', type=int, help="Number of concurrent copies, default is 4", default=4)
+    parser.add_argument('-k', '--keep', action='store_true', help="Keep the source files, default is to remove them after copying")
+    parser.add_argument('--verify', action='store_true', help="Read each copy back and compare its checksum, before removing the source")
+    parser.add_argument('-i', '--index', type=str, help="Add the archived files to this archive index, see archiveindex.py")
+    args = parser.parse_args()
+
+    if not os.path.isdir( args.dest ):
+        os.makedirs( args.dest )
+
+    archiver = Archiver( args.dest, remove=not args.keep, verify=args.verify )
+
+    pool = ThreadPool( min( args.streams, len(args.files) ) )
+    entries = pool.map( archiver.archive, args.files )
+    pool.close()
+    pool.join()
+
+    found = [ e for e in entries if e is not None ]
+    logging.info( "%i files, %i bytes in %s", len(found), sum( [ e['size'] for e in found ] ), args.dest )
+
+    if args.index:
+        targets = [ os.path.abspath( os.path.join( args.dest, e['name'] ) ) for e in found ]
+        archiveindex.add_files( args.index, targets, dict( zip( targets, [ e['md5'] for e in found ] ) ) )
+
+    # as the cp it replaces, fail on missing files
+    if len(found) != len(entries):
+        sys.exit( 1 )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+"""Index of the archived runs in a local SQLite database.
+
+Records the files of each run with their size, checksum, domain, variables, time range and stations,
+so that lookups do not have to walk the archive directories and open files:
+
+    archiveindex.py scan                               index all runs in ARCDIR, only new or changed files are opened
+    archiveindex.py add FILE ..                        index files, as done by archive.py and the TS conversion
+    archiveindex.py cycle 2015-06-03 3                 archived wrfout of domain 3 of the run of 2015-06-03
+    archiveindex.py find --date 2015-06-04_12:00:00 --domain 3 --station s2194
+"""
+
+import netCDF4 as cdf
+import numpy as np
+import datetime
+import argparse
+import logging
+import os
+import re
+import sqlite3
+import sys
+
+logging.basicConfig(level=logging.INFO)
+
+ARCDIR = os.environ.get( 'ARCDIR', '/projects/0/sitc/archive2' )
+
+# the index is kept on a local disk, SQLite does not work well on the parallel file system
+INDEXDB = os.path.expanduser( os.environ.get( 'ARCHIVEDB', '~/.forecast_archive.sqlite' ) )
+
+DATEFORMAT = '%Y-%m-%d_%H:%M:%S'
+
+ARCHIVEREGEX = re.compile( r"(\d{4})/(\d{2})/(\d{2})/[^/]*$" )
+DATEREGEX    = re.compile( r"(\d{4})-(\d{2})-(\d{2})" )
+DOMAINREGEX  = re.compile( r"[._]d(\d{2})[._]" )
+TSZIPREGEX   = re.compile( r"^(.*)\.d(\d{2})\.zip$" )
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path    TEXT PRIMARY KEY,
+    run     TEXT,
+    name    TEXT,
+    kind    TEXT,
+    domain  INTEGER,
+    size    INTEGER,
+    mtime   INTEGER,
+    md5     TEXT,
+    start   TEXT,
+    end     TEXT,
+    ntimes  INTEGER
+);
+CREATE TABLE IF NOT EXISTS variables ( path TEXT, variable TEXT );
+CREATE TABLE IF NOT EXISTS stations ( path TEXT, station TEXT );
+CREATE INDEX IF NOT EXISTS files_run ON files ( run, domain );
+CREATE INDEX IF NOT EXISTS files_time ON files ( start, end );
+CREATE INDEX IF NOT EXISTS variables_path ON variables ( path );
+CREATE INDEX IF NOT EXISTS variables_variable ON variables ( variable );
+CREATE INDEX IF NOT EXISTS stations_path ON stations ( path );
+CREATE INDEX IF NOT EXISTS stations_station ON stations ( station );
+"""
+
+
+def connect( dbfile=INDEXDB ):
+    """Open the index, and create the tables if needed"""
+    db = sqlite3.connect( dbfile, timeout=60 )
+    db.executescript( SCHEMA )
+    return db
+
+def rundate( path ):
+    """Start date of the run of a file, from an archive directory like 2015/06/03,
+    or a date in the file or run directory name like wrfout_d01_2015-06-03_00:00:00"""
+    m = ARCHIVEREGEX.search( path )
+    if m:
+        return "-".join( m.groups() )
+    m = DATEREGEX.search( os.path.basename( path ) ) or DATEREGEX.search( os.path.basename( os.path.dirname( os.path.abspath( path ) ) ) )
+    if m:
+        return "-".join( m.groups() )
+    return None
+
+def describe( path, run ):
+    """Kind, domain, variables, time range, number of time steps and stations of a file.
+    Only the header and the time variables of netCDF files are read"""
+
+    name = os.path.basename( path )
+    info = { 'kind': 'other', 'domain': None, 'variables': [], 'start': None, 'end': None, 'ntimes': None, 'stations': [] }
+
+    m = DOMAINREGEX.search( name )
+    if m:
+        info['domain'] = int( m.group(1) )
+
+    m = TSZIPREGEX.match( name )
+    if m:
+        info['kind'] = 'tszip'
+        info['stations'] = [ m.group(1) ]
+        return info
+    if name.startswith( 'logs_' ):
+        info['kind'] = 'logs'
+        return info
+
+    try:
+        ncfile = cdf.Dataset( path, 'r' )
+    except (IOError, RuntimeError):
+        return info
+
+    info['variables'] = [ str( v ) for v in ncfile.variables.keys() ]
+    if 'GRID_ID' in ncfile.ncattrs():
+        info['domain'] = int( ncfile.getncattr( 'GRID_ID' ) )
+
+    if 'Times' in ncfile.variables:
+        info['kind'] = 'wrfout'
+        times = cdf.chartostring( ncfile.variables['Times'][:] )
+        info['ntimes'] = len( times )
+        if len( times ):
+            info['start'], info['end'] = str( times[0] ), str( times[-1] )
+    elif 'prefix' in ncfile.variables and 'time' in ncfile.variables:
+        # TS file made with ts_make_ncs.sh; times are hours since the start of the run
+        info['kind'] = 'ts'
+        info['stations'] = [ str( p ) for p in cdf.chartostring( ncfile.variables['prefix'][:] ) if str( p ) ]
+        hours = np.ma.compressed( ncfile.variables['time'][:] )
+        info['ntimes'] = len( hours )
+        if len( hours ) and run:
+            start = datetime.datetime.strptime( run, '%Y-%m-%d' )
+            info['start'] = ( start + datetime.timedelta( hours=float( hours.min() ) ) ).strftime( DATEFORMAT )
+            info['end']   = ( start + datetime.timedelta( hours=float( hours.max() ) ) ).strftime( DATEFORMAT )
+    else:
+        info['kind'] = 'netcdf'
+
+    ncfile.close()
+    return info
+
+def add( db, path, md5=None, run=None, domain=None ):
+    """Add or update a file in the index; files with the same size and mtime as indexed are not opened again.
+    The run and domain are taken from the file and its path, unless given.
+    Returns True if the file was (re)indexed"""
+
+    path = os.path.abspath( path )
+    st = os.stat( path )
+    old = db.execute( "SELECT size, mtime, md5 FROM files WHERE path = ?", ( path, ) ).fetchone()
+    if old and old[0] == st.st_size and old[1] == int( st.st_mtime ):
+        if md5 and old[2] != md5:
+            db.execute( "UPDATE files SET md5 = ? WHERE path = ?", ( md5, path ) )
+        return False
+
+    run = run or rundate( path )
+    info = describe( path, run )
+    info['domain'] = domain or info['domain']
+
+    remove( db, path )
+    db.execute( "INSERT INTO files VALUES ( ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ? )",
+                ( path, run, os.path.basename( path ), info['kind'], info['domain'], st.st_size, int( st.st_mtime ),
+                  md5, info['start'], info['end'], info['ntimes'] ) )
+    db.executemany( "INSERT INTO variables VALUES ( ?, ? )", [ ( path, v ) for v in info['variables'] ] )
+    db.executemany( "INSERT INTO stations VALUES ( ?, ? )", [ ( path, s ) for s in info['stations'] ] )
+    return True
+
+def remove( db, path ):
+    """Remove a file from the index"""
+    for table in [ 'files', 'variables', 'stations' ]:
+        db.execute( "DELETE FROM {} WHERE path = ?".format( table ), ( path, ) )
+
+def add_files( dbfile, paths, checksums={}, run=None, domain=None ):
+    """Index a list of files in one transaction; checksums is an optional dictionary of path: md5.
+    Returns the number of files (re)indexed"""
+    db = connect( dbfile )
+    with db:
+        count = sum( [ add( db, p, checksums.get( p ), run, domain ) for p in paths ] )
+    db.close()
+    return count
+
+def scan( dbfile, top=ARCDIR ):
+    """Index all files in the archive directories YYYY/MM/DD below top, and forget files that are gone.
+    Returns the number of files (re)indexed"""
+    db = connect( dbfile )
+    count = 0
+    with db:
+        for path, dirs, files in os.walk( top ):
+            dirs.sort()
+            for name in sorted( files ):
+                filename = os.path.join( path, name )
+                if ARCHIVEREGEX.search( filename ) and not name.startswith( '.' ) and not name.endswith( '.working' ):
+                    count += add( db, filename )
+
+        gone = [ p for p, in db.execute( "SELECT path FROM files WHERE path LIKE ?", ( os.path.abspath( top ) + '/%', ) )
+                 if not os.path.isfile( p ) ]
+        for p in gone:
+            remove( db, p )
+    db.close()
+    return count
+
+def cycle( dbfile, run, domain ):
+    """Archived wrfout file of a domain of a run, or None"""
+    db = connect( dbfile )
+    row = db.execute( "SELECT path FROM files WHERE run = ? AND domain = ? AND kind = 'wrfout' ORDER BY name",
+                      ( run, domain ) ).fetchone()
+    db.close()
+    return row[0] if row else None
+
+def find( dbfile, date=None, domain=None, variable=None, station=None, kind=None ):
+    """Files covering a date (YYYY-MM-DD_HH:MM:SS), of a domain, with a variable or a station.
+    Returns a list of (path, run, domain, start, end), the latest run first"""
+
+    query = "SELECT path, run, domain, start, end FROM files WHERE 1"
+    values = []
+    if date is not None:
+        query += " AND start <= ? AND end >= ?"
+        values += [ date, date ]
+    if domain is not None:
+        query += " AND domain = ?"
+        values.append( domain )
+    if kind is not None:
+        query += " AND kind = ?"
+        values.append( kind )
+    if variable is not None:
+        query += " AND path IN ( SELECT path FROM variables WHERE variable = ? )"
+        values.append( variable )
+    if station is not None:
+        query += " AND path IN ( SELECT path FROM stations WHERE station = ? )"
+        values.append( station )
+    query += " ORDER BY run DESC, domain, name"
+
+    db = connect( dbfile )
+    rows = db.execute( query, values ).fetchall()
+    db.close()
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description="Index of the archived runs in a SQLite database")
+    parser.add_argument('-d', '--db', type=str, help="Index database, default is " + INDEXDB, default=INDEXDB)
+    commands = parser.add_subparsers(dest='command')
+
+    p = commands.add_parser('add', help="Index files")
+    p.add_argument('files', metavar='file', type=str, nargs='+')
+    p.add_argument('-r', '--run', type=str, help="Run date YYYY-MM-DD, default is taken from the path")
+    p.add_argument('--domain', type=int, help="Domain, default is taken from the file")
+
+    p = commands.add_parser('scan', help="Index all runs in the archive")
+    p.add_argument('top', type=str, nargs='?', help="Archive directory, default is " + ARCDIR, default=ARCDIR)
+
+    p = commands.add_parser('cycle', help="Print the archived wrfout file of a run and domain")
+    p.add_argument('run', type=str, help="Run date YYYY-MM-DD")
+    p.add_argument('domain', type=int)
+
+    p = commands.add_parser('find', help="Print the files matching all conditions")
+    p.add_argument('--date', type=str, help="Date in the file, YYYY-MM-DD_HH:MM:SS")
+    p.add_argument('--domain', type=int)
+    p.add_argument('--variable', type=str)
+    p.add_argument('--station', type=str, help="Station prefix, as in the tslist")
+    p.add_argument('--kind', type=str, choices=[ 'wrfout', 'ts', 'tszip', 'logs', 'netcdf', 'other' ])
+
+    args = parser.parse_args()
+
+    if args.command == 'add':
+        logging.info( "%i files indexed", add_files( args.db, args.files, run=args.run, domain=args.domain ) )
+    elif args.command == 'scan':
+        logging.info( "%i files indexed", scan( args.db, args.top ) )
+    elif args.command == 'cycle':
+        path = cycle( args.db, args.run, args.domain )
+        if path is None:
+            sys.exit( 1 )
+        print path
+    elif args.command == 'find':
+        for path, run, domain, start, end in find( args.db, args.date, args.domain, args.variable, args.station, args.kind ):
+            print "{} {} d{:02} {} {}".format( run, path, domain or 0, start or '-', end or '-' )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+import netCDF4 as cdf
+import argparse
+import json
+import os
+import re
+
+from multiprocessing import Pool
+
+# Top level dirs, runs are in subdirectories like 2015-06-03 and 2015/06/03
+TOP = os.path.expanduser( os.environ.get( 'WRFDIR', '~/WRF/WRFV3' ) )
+ARCDIR = os.environ.get( 'ARCDIR', '/projects/0/sitc/archive2' )
+
+# location of the cache
+CACHE = os.path.expanduser( '~/.forecast_catalog.json' )
+
+RUNREGEX     = re.compile( r"^(\d{4})-(\d{2})-(\d{2})$" )
+WRFOUTREGEX  = re.compile( r"^wrfout_d(\d{2})_\d{4}-\d{2}-\d{2}_\d{2}:\d{2}:\d{2}(\.nc)?$" )
+INPUTREGEX   = re.compile( r"^wrf(input|bdy)_d(\d{2})$" )
+METEMREGEX   = re.compile( r"^met_em\.d(\d{2})\..*\.nc$" )
+TSREGEX      = re.compile( r"^.*\.d(\d{2})\.(TS|zip)$" )
+NEEDLE       = "SUCCESS COMPLETE WRF"
+
+
+def timesteps( filename ):
+    """Number of time steps in a netCDF file, only reads the header"""
+    try:
+        ncfile = cdf.Dataset( filename, 'r' )
+        steps = len( ncfile.dimensions['Time'] )
+        ncfile.close()
+    except (IOError, RuntimeError, KeyError):
+        steps = -1
+    return steps
+
+def finished( filename ):
+    """Check the last few kB of an rsl.out file for the success message"""
+    f = open( filename, 'r' )
+    f.seek( 0, os.SEEK_END )
+    f.seek( max( 0, f.tell() - 4096 ) )
+    tail = f.read()
+    f.close()
+    return NEEDLE in tail
+
+def scan( path, cached ):
+    """Scan a run or archive directory.
+    Only files that changed since the cached scan (by mtime and size) are opened.
+    Returns a dictionary with the status of the run, and the stat of the files for the cache"""
+
+    files = {}
+    run = { 'path': path, 'wrfout': {}, 'input': {}, 'bdy': {}, 'met_em': {}, 'ts': {}, 'wrf': False, 'logs': False, 'cycle': 0 }
+
+    for name in sorted( os.listdir( path ) ):
+        filename = os.path.join( path, name )
+
+        m = WRFOUTREGEX.match( name )
+        if m:
+            st = os.stat( filename )
+            old = cached.get( 'files', {} ).get( name )
+            if old and old[0] == st.st_mtime and old[1] == st.st_size:
+                steps = old[2]
+            else:
+                steps = timesteps( filename )
+            files[name] = [ st.st_mtime, st.st_size, steps ]
+            run['wrfout'][m.group(1)] = steps
+            continue
+
+        m = INPUTREGEX.match( name )
+        if m:
+            run[ 'input' if m.group(1) == 'input' else 'bdy' ][m.group(2)] = True
+            continue
+
+        m = METEMREGEX.match( name )
+        if m:
+            run['met_em'][m.group(1)] = run['met_em'].get( m.group(1), 0 ) + 1
+            continue
+
+        m = TSREGEX.match( name )
+        if m:
+            run['ts'][m.group(1)] = run['ts'].get( m.group(1), 0 ) + 1
+            continue
+
+        if name in [ 'rsl.out.0000', 'rsl.out' ]:
+            run['wrf'] = finished( filename )
+        elif name.startswith( 'logs_' ) and name.endswith( '.zip' ):
+            run['logs'] = True
+        elif name.startswith( 'wrfcycle_' ):
+            run['cycle'] += 1
+
+    return { 'mtime': os.stat( path ).st_mtime, 'files': files, 'run': run }
+
+def scan_star( args ):
+    """Helper for Pool.map, which only passes a single argument"""
+    return scan( *args )
+
+def rundirs( top, archive ):
+    """List the run directories (top/YYYY-MM-DD) and archive directories (archive/YYYY/MM/DD)
+    Returns a list of (date, location, path)"""
+    dirs = []
+    if os.path.isdir( top ):
+        for name in os.listdir( top ):
+            if RUNREGEX.match( name ) and os.path.isdir( os.path.join( top, name ) ):
+                dirs.append( ( name, 'run', os.path.join( top, name ) ) )
+
+    if os.path.isdir( archive ):
+        for year in os.listdir( archive ):
+            if not re.match( r"^\d{4}$", year ):
+                continue
+            for month in os.listdir( os.path.join( archive, year ) ):
+                for day in os.listdir( os.path.join( archive, year, month ) ):
+                    path = os.path.join( archive, year, month, day )
+                    if os.path.isdir( path ):
+                        dirs.append( ( "{}-{}-{}".format( year, month, day ), 'archive', path ) )
+    return sorted( dirs )
+
+def catalog( top=TOP, archive=ARCDIR, cachefile=CACHE, processes=8 ):
+    """Scan all run and archive directories in parallel, using and updating the cache.
+    Returns a list of (date, location, run status)"""
+
+    cache = {}
+    if cachefile and os.path.isfile( cachefile ):
+        try:
+            cache = json.load( open( cachefile, 'r' ) )
+        except ValueError:
+            cache = {}
+
+    dirs = rundirs( top, archive )
+
+    # archived runs are copied as whole files, so they are unchanged if the directory is unchanged;
+    # files in a run directory can grow in place, so those are always checked
+    results = {}
+    jobs = []
+    for date, location, path in dirs:
+        cached = cache.get( path, {} )
+        if location == 'archive' and cached.get( 'mtime' ) == os.stat( path ).st_mtime:
+            results[path] = cached
+        else:
+            jobs.append( ( path, cached ) )
+
+    if jobs:
+        pool = Pool( min( processes, len(jobs) ) )
+        for entry in pool.map( scan_star, jobs ):
+            results[ entry['run']['path'] ] = entry
+        pool.close()
+        pool.join()
+
+    if cachefile:
+        working = cachefile + ".working"
+        json.dump( results, open( working, 'w' ) )
+        os.rename( working, cachefile )
+
+    return [ ( date, location, results[path]['run'] ) for date, location, path in dirs ]
+
+def printcatalog( runs ):
+    """Print a table of all runs"""
+
+    ndoms = max( [ len( r['wrfout'] ) for d, l, r in runs ] + [ len( r['input'] ) for d, l, r in runs ] + [1] )
+    doms = [ "{:02}".format( d ) for d in range( 1, ndoms + 1 ) ]
+
+    print "{:<10} {:<8} ".format( "Date", "Where" ) + " ".join( [ "d{:<5}".format( d ) for d in doms ] ) + \
+          "  input  bdy  met_em  TS    WRF   logs cycle"
+    for date, location, r in runs:
+        steps = " ".join( [ "{:<6}".format( r['wrfout'].get( d, '.' ) ) for d in doms ] )
+        print "{:<10} {:<8} {}  {:<6} {:<4} {:<7} {:<5} {:<5} {:<4} {}".format(
+            date, location, steps,
+            len( r['input'] ) or '.', len( r['bdy'] ) or '.', sum( r['met_em'].values() ) or '.',
+            sum( r['ts'].values() ) or '.', 'done' if r['wrf'] else '.', 'done' if r['logs'] else '.', r['cycle'] or '.' )
+
+def main():
+    parser = argparse.ArgumentParser(description="List the status of all forecast runs and archived runs")
+    parser.add_argument('-t', '--top', type=str, help="Directory containing the YYYY-MM-DD run directories, default is " + TOP, default=TOP)
+    parser.add_argument('-a', '--archive', type=str, help="Archive directory, default is " + ARCDIR, default=ARCDIR)
+    parser.add_argument('-c', '--cache', type=str, help="Cache file, default is " + CACHE, default=CACHE)
+    parser.add_argument('-d', '--date', type=str, help="Only show runs for this date (YYYY-MM-DD)")
+    parser.add_argument('-j', '--json', action='store_true', help="Print the catalog as JSON")
+    parser.add_argument('-n', '--processes', type=int, help="Number of directories to scan concurrently, default is 8", default=8)
+    args = parser.parse_args()
+
+    runs = catalog( args.top, args.archive, args.cache, args.processes )
+    if args.date:
+        runs = [ r for r in runs if r[0] == args.date ]
+
+    if args.json:
+        print json.dumps( runs, indent=1 )
+    else:
+        printcatalog( runs )
+
+if __name__ == "__main__":
+    main()
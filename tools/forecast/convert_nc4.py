@@ -0,0 +1,399 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+import netCDF4 as cdf
+import numpy as np
+import argparse
+import hashlib
+import itertools
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from multiprocessing import Pool
+
+import catalog
+import wrfstatic
+
+logging.basicConfig(level=logging.INFO)
+
+# default compression, as nc3tonc4
+DEFLATE = 4
+SHUFFLE = True
+
+# attribute of a file being followed with the number of complete time steps
+COMPLETED = 'completed_frames'
+
+# per variable compression profile
+PROFILE = os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), 'wrfout.profile' )
+
+
+def read_profile( filename ):
+    """Read a compression profile, see wrfout.profile.
+    Returns a dictionary of variable: (least_significant_digit or None, deflate, shuffle)"""
+    profile = { 'default': ( None, DEFLATE, SHUFFLE ) }
+    if filename is None:
+        return profile
+
+    for line in open( filename, 'r' ):
+        line = line.strip()
+        if not line or line.startswith( '#' ):
+            continue
+        name, digits, deflate, shuffle = line.split()
+        profile[name] = ( None if digits == '-' else int( digits ), int( deflate ), shuffle == '1' )
+    return profile
+
+def settings( profile, name, dtype ):
+    """Compression settings for a variable; only floating point variables are quantized"""
+    digits, deflate, shuffle = profile.get( name, profile['default'] )
+    if np.dtype( dtype ).kind != 'f':
+        digits = None
+    return digits, deflate, shuffle
+
+def createargs( profile, name, v ):
+    """Keyword arguments for createVariable, following the profile"""
+    digits, deflate, shuffle = settings( profile, name, v.dtype )
+    return { 'zlib': deflate > 0, 'complevel': deflate, 'shuffle': shuffle,
+             'least_significant_digit': digits, 'chunksizes': chunksizes( v ) }
+
+def chunksizes( v ):
+    """Chunk shape for typical access: one time step of a full 2-D field.
+    The field is spanned by the last two dimensions other than Time, all others get 1"""
+    if len( v.shape ) < 2:
+        return None
+    field = [ i for i, d in enumerate( v.dimensions ) if d != 'Time' ][-2:]
+    return [ max( n, 1 ) if i in field else 1 for i, n in enumerate( v.shape ) ]
+
+def create( src, filename, profile, skip=[] ):
+    """Create a netCDF4 file with the same dimensions, attributes and variables as the netCDF3 file src,
+    compressed according to the profile, leaving out the variables in skip. Returns the new dataset"""
+    dst = cdf.Dataset( filename, 'w', format='NETCDF4_CLASSIC' )
+    dst.setncatts( dict( [ (a, src.getncattr(a)) for a in src.ncattrs() if a != COMPLETED ] ) )
+
+    for name, dim in src.dimensions.items():
+        dst.createDimension( name, None if dim.isunlimited() else len(dim) )
+
+    for name, v in src.variables.items():
+        if name in skip:
+            continue
+        n = dst.createVariable( name, v.dtype, v.dimensions, **createargs( profile, name, v ) )
+        n.setncatts( dict( [ (a, v.getncattr(a)) for a in v.ncattrs() ] ) )
+
+    return dst
+
+def isrecord( v ):
+    """True for variables with the unlimited Time dimension"""
+    return len( v.dimensions ) > 0 and v.dimensions[0] == 'Time'
+
+def copy_frames( src, dst, start, stop, completed=False ):
+    """Copy time steps start up to stop of all record variables in dst.
+    Each time step is written for all variables before the next; with completed,
+    the number of complete time steps is stored in the COMPLETED attribute after each"""
+    names = [ name for name, v in src.variables.items() if isrecord( v ) and name in dst.variables ]
+    for t in range( start, stop ):
+        for name in names:
+            dst.variables[name][t] = src.variables[name][t]
+        if completed:
+            dst.setncattr( COMPLETED, t + 1 )
+            dst.sync()
+
+def convert( source, target, profile, staticdir=None, working=None ):
+    """Convert a WRF netCDF3 file to compressed netCDF4, one time step at a time.
+    With a staticdir, time invariant fields are moved to the static file of the domain, see wrfstatic.py.
+    The file is written under a temporary name, by default <target>.working, and renamed when complete."""
+
+    src = cdf.Dataset( source, 'r' )
+    src.set_auto_maskandscale( False )
+
+    static = []
+    if staticdir:
+        staticfile, static = wrfstatic.update( src, staticdir, lambda name, v: createargs( profile, name, v ) )
+
+    working = working or target + ".working"
+    dst = create( src, working, profile, [ name for name, checksum in static ] )
+    dst.set_auto_maskandscale( False )
+
+    if static:
+        dst.setncattr( 'static_file', os.path.basename( staticfile ) )
+        dst.setncattr( 'static_variables', ",".join( [ name for name, checksum in static ] ) )
+        dst.setncattr( 'static_checksums', ",".join( [ checksum for name, checksum in static ] ) )
+
+    for name, v in src.variables.items():
+        if not isrecord( v ):
+            dst.variables[name][:] = v[:]
+    copy_frames( src, dst, 0, len( src.dimensions['Time'] ) )
+
+    dst.close()
+    src.close()
+
+    os.rename( working, target )
+
+def reopen( src, working, profile ):
+    """Open the working file of follow() to append to. A file that can not be opened or read,
+    for instance after the job was killed while writing, or that has an incomplete time step
+    (COMPLETED differs from the Time dimension), is rebuilt from the source. Returns the dataset"""
+
+    if os.path.isfile( working ):
+        dst = None
+        try:
+            dst = cdf.Dataset( working, 'a' )
+            dst.set_auto_maskandscale( False )
+            completed = int( getattr( dst, COMPLETED, 0 ) )
+            if completed != len( dst.dimensions['Time'] ):
+                raise ValueError( "{} of {} time steps complete".format( completed, len( dst.dimensions['Time'] ) ) )
+            # the last complete step can be read back
+            if completed > 0:
+                for name, v in dst.variables.items():
+                    if isrecord( v ):
+                        v[completed - 1]
+            return dst
+        except Exception as e:
+            logging.warn( "Rebuilding %s: %s", working, e )
+            if dst is not None:
+                try:
+                    dst.close()
+                except Exception:
+                    pass
+            os.remove( working )
+
+    dst = create( src, working, profile )
+    dst.set_auto_maskandscale( False )
+    for name, v in src.variables.items():
+        if not isrecord( v ):
+            dst.variables[name][:] = v[:]
+    return dst
+
+def follow( source, target, profile, rsl, interval=60, timeout=3600, staticdir=None ):
+    """Convert a WRF netCDF3 file while the model is still writing it.
+    Every interval seconds the number of time steps in the source is checked, and complete time steps
+    are appended to the target. The last time step is only complete when the model has finished,
+    as shown by the rsl file. The target is written under a temporary name, which is reused when
+    following is restarted, or rebuilt if it is damaged, and renamed when complete.
+    With a staticdir, the complete file is rewritten without its time invariant fields, as by convert().
+    Raises IOError when nothing changed for timeout seconds, counted from when the source appears."""
+
+    working = target + ".working"
+    last = None
+    while True:
+        done = os.path.isfile( rsl ) and catalog.finished( rsl )
+
+        if os.path.isfile( source ):
+            if last is None:
+                last = time.time()
+            src = cdf.Dataset( source, 'r' )
+            src.set_auto_maskandscale( False )
+
+            dst = reopen( src, working, profile )
+            start = int( getattr( dst, COMPLETED, 0 ) )
+            stop = len( src.dimensions['Time'] ) if done else len( src.dimensions['Time'] ) - 1
+            if stop > start:
+                copy_frames( src, dst, start, stop, completed=True )
+                logging.info( "Converted %s steps %i-%i", source, start, stop - 1 )
+                last = time.time()
+
+            if done and not staticdir and COMPLETED in dst.ncattrs():
+                dst.delncattr( COMPLETED )
+            dst.close()
+            src.close()
+
+            if done:
+                if staticdir:
+                    # the working file stays complete, so this is redone if interrupted
+                    convert( working, target, profile, staticdir, target + ".static.working" )
+                    os.remove( working )
+                else:
+                    os.rename( working, target )
+                return target
+        elif done:
+            raise IOError( "Run finished without writing {}".format( source ) )
+
+        if last is not None and time.time() - last > timeout:
+            raise IOError( "No new time steps in {} for {} seconds".format( source, timeout ) )
+        time.sleep( interval )
+
+def convert_star( args ):
+    """Helper for Pool.map, which only passes a single argument"""
+    source, target, profile, staticdir = args
+    if os.path.isfile( target ):
+        logging.info( "%s exists, only verifying", target )
+    else:
+        convert( source, target, profile, staticdir )
+        logging.info( "Converted %s to %s", source, target )
+    return target
+
+def follow_star( args ):
+    """Helper for Pool.map, which only passes a single argument"""
+    source, target, profile, rsl, interval, timeout, staticdir = args
+    if os.path.isfile( target ):
+        logging.info( "%s exists, only verifying", target )
+    else:
+        follow( source, target, profile, rsl, interval, timeout, staticdir )
+        logging.info( "Converted %s to %s", source, target )
+    return target
+
+def checksum( filename, varname, staticdir=None ):
+    """Checksum of the data of a variable, computed one time step at a time"""
+    h = hashlib.md5()
+    for frame in wrfstatic.frames( filename, varname, staticdir ):
+        h.update( str( frame.shape ) )
+        h.update( np.ascontiguousarray( frame ).tostring() )
+    return h.hexdigest()
+
+def maxerror( source, target, varname, staticdir=None ):
+    """Largest absolute difference of a variable in two files, computed one time step at a time"""
+    error = 0.0
+    s = wrfstatic.frames( source, varname )
+    d = wrfstatic.frames( target, varname, staticdir )
+    for a, b in itertools.izip_longest( s, d ):
+        if a is None or b is None or a.shape != b.shape:
+            return np.inf
+        if a.size > 0:
+            error = max( error, np.abs( a.astype( np.float64 ) - b ).max() )
+    return error
+
+def verify_star( args ):
+    """Compare a variable in two files, helper for Pool.map.
+    Lossless variables should have the same checksum,
+    quantized variables should be within the precision of their least significant digit"""
+    source, target, varname, digits, staticdir = args
+    if digits is None:
+        return source, varname, checksum( source, varname ) == checksum( target, varname, staticdir )
+    return source, varname, maxerror( source, target, varname, staticdir ) <= 10.0 ** -digits
+
+def variables( filename ):
+    """List of (name, type) of the variables in a file"""
+    ncfile = cdf.Dataset( filename, 'r' )
+    names = [ ( name, v.dtype ) for name, v in ncfile.variables.items() ]
+    ncfile.close()
+    return names
+
+def benchmark( filename, profile ):
+    """Compress each variable of a sample file on its own, lossless and with the profile.
+    Returns a list of (variable, MB, lossless ratio, profile ratio, encode MB/s, decode MB/s)"""
+
+    src = cdf.Dataset( filename, 'r' )
+    src.set_auto_maskandscale( False )
+    tmpdir = tempfile.mkdtemp( prefix='convert_nc4' )
+
+    def write( v, data, digits, deflate, shuffle ):
+        """Write a single variable to a new file, returns the file name and the time needed"""
+        name = os.path.join( tmpdir, "{}.nc".format( v.name ) )
+        dst = cdf.Dataset( name, 'w', format='NETCDF4_CLASSIC' )
+        for dim in v.dimensions:
+            dst.createDimension( dim, None if dim == 'Time' else len( src.dimensions[dim] ) )
+        start = time.time()
+        n = dst.createVariable( v.name, v.dtype, v.dimensions, zlib=( deflate > 0 ), complevel=deflate, shuffle=shuffle,
+                                least_significant_digit=digits, chunksizes=chunksizes( v ) )
+        n.set_auto_maskandscale( False )
+        if isrecord( v ):
+            for t in range( v.shape[0] ):
+                n[t] = data[t]
+        else:
+            n[:] = data
+        dst.close()
+        return name, time.time() - start
+
+    # size of a file without data
+    empty = os.path.join( tmpdir, "empty.nc" )
+    cdf.Dataset( empty, 'w', format='NETCDF4_CLASSIC' ).close()
+    overhead = os.path.getsize( empty )
+
+    results = []
+    for name, v in src.variables.items():
+        if v.size == 0:
+            continue
+        data = v[:]
+        mb = data.nbytes / 1.0e6
+        digits, deflate, shuffle = settings( profile, name, v.dtype )
+
+        lossless, dummy = write( v, data, None, *profile['default'][1:] )
+        lossless = data.nbytes / float( max( 1, os.path.getsize( lossless ) - overhead ) )
+
+        compressed, encode = write( v, data, digits, deflate, shuffle )
+        ratio = data.nbytes / float( max( 1, os.path.getsize( compressed ) - overhead ) )
+
+        start = time.time()
+        ncfile = cdf.Dataset( compressed, 'r' )
+        ncfile.variables[name][:]
+        ncfile.close()
+        decode = time.time() - start
+
+        results.append( ( name, mb, lossless, ratio, mb / max( encode, 1e-6 ), mb / max( decode, 1e-6 ) ) )
+
+    src.close()
+    shutil.rmtree( tmpdir )
+    return results
+
+def printbenchmark( results, profile ):
+    """Print the benchmark results per variable, and the total"""
+    print "{:<12} {:>6} {:>8} {:>8} {:>8} {:>10} {:>10}".format( "Variable", "digits", "MB", "lossless", "ratio", "enc MB/s", "dec MB/s" )
+    for name, mb, lossless, ratio, encode, decode in results:
+        digits = profile.get( name, profile['default'] )[0]
+        print "{:<12} {:>6} {:>8.2f} {:>8.2f} {:>8.2f} {:>10.1f} {:>10.1f}".format(
+            name, '-' if digits is None else digits, mb, lossless, ratio, encode, decode )
+
+    total = sum( [ r[1] for r in results ] )
+    print "Total {:.1f} MB, {:.1f} MB lossless, {:.1f} MB with profile".format(
+        total, sum( [ r[1] / r[2] for r in results ] ), sum( [ r[1] / r[3] for r in results ] ) )
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert WRF netCDF3 output to compressed netCDF4, and verify the result")
+    parser.add_argument('files', metavar="wrfout", type=str, nargs='+', help="wrfout files to convert, to <wrfout>.nc")
+    parser.add_argument('-n', '--processes', type=int, help="Number of processes, default is 4", default=4)
+    parser.add_argument('-r', '--remove', action='store_true', help="Remove the netCDF3 file after successful verification")
+    parser.add_argument('-p', '--profile', type=str, help="Compression profile, default is " + PROFILE, default=PROFILE)
+    parser.add_argument('-l', '--lossless', action='store_true', help="Ignore the profile, use lossless compression for all variables")
+    parser.add_argument('-b', '--benchmark', action='store_true', help="Report compression ratio and speed per variable for a sample file, nothing is converted")
+    parser.add_argument('-f', '--follow', action='store_true', help="Convert time steps while WRF is still writing the files, until the run has finished")
+    parser.add_argument('--rsl', type=str, help="rsl file showing the run has finished, default is rsl.out.0000 next to the first file")
+    parser.add_argument('--interval', type=int, help="Seconds between checks for new time steps, default is 60", default=60)
+    parser.add_argument('-s', '--static', type=str, help="Move time invariant fields to per domain static files in this directory")
+    parser.add_argument('--timeout', type=int, help="Give up following after this many seconds without new time steps, default is 3600", default=3600)
+    args = parser.parse_args()
+
+    profile = read_profile( None if args.lossless else args.profile )
+
+    if args.benchmark:
+        for f in args.files:
+            print f
+            printbenchmark( benchmark( f, profile ), profile )
+        return
+
+    # convert the domains in parallel
+    if args.follow:
+        # every domain is followed by its own process
+        pool = Pool( max( args.processes, len(args.files) ) )
+        rsl = args.rsl or os.path.join( os.path.dirname( args.files[0] ), 'rsl.out.0000' )
+        jobs = [ (f, f + ".nc", profile, rsl, args.interval, args.timeout, args.static) for f in args.files ]
+        try:
+            pool.map( follow_star, jobs )
+        except IOError as e:
+            logging.error( e )
+            sys.exit(1)
+    else:
+        pool = Pool( args.processes )
+        jobs = [ (f, f + ".nc", profile, args.static) for f in args.files ]
+        pool.map( convert_star, jobs )
+
+    # verify all variables of all files in parallel
+    jobs = [ (f, f + ".nc", name, settings( profile, name, dtype )[0], args.static) for f in args.files for name, dtype in variables( f ) ]
+    failed = [ (f, v) for f, v, ok in pool.map( verify_star, jobs ) if not ok ]
+
+    pool.close()
+    pool.join()
+
+    for f, v in failed:
+        logging.error( "Error in converting %s: %s differs", f, v )
+    if failed:
+        sys.exit(1)
+
+    for f in args.files:
+        logging.info( "%s verified", f )
+        if args.remove:
+            os.remove( f )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+import netCDF4 as cdf
+import numpy as np
+import datetime
+import argparse
+import logging
+
+import sst
+
+logging.basicConfig(level=logging.INFO)
+
+
+def copy_sst( filename, field ):
+    """Set the SST in a wrfinput file, and use it as skin temperature over water.
+    The file is opened once and modified in place; TSK over land (LANDMASK = 1) is kept."""
+
+    ncfile = cdf.Dataset( filename, 'r+' )
+
+    landmask = ncfile.variables['LANDMASK'][0]
+    tsk = ncfile.variables['TSK'][0]
+
+    ncfile.variables['SST'][0] = field
+    ncfile.variables['TSK'][0] = np.where( landmask > 0, tsk, field )
+
+    ncfile.close()
+
+def read_sst( filename ):
+    """Read the SST field from a netCDF file as written by sst.py or prepare_sst.sh"""
+    ncfile = cdf.Dataset( filename, 'r' )
+    field = ncfile.variables['temperature'][0]
+    ncfile.close()
+    return field
+
+def main():
+    parser = argparse.ArgumentParser(description="Copy the SST from Rijkswaterstaat observations to wrfinput files")
+    parser.add_argument('wrfinput', type=str, nargs='+', help="wrfinput_d?? files")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('-d', '--date', type=str, help="Interpolate the observations for this date (YYYY-MM-DD) to the grid")
+    group.add_argument('-s', '--sst', type=str, help="File containing the 'temperature' variable on the same grid, as made by sst.py")
+    parser.add_argument('-o', '--obs', type=str, help="Observations file, default is " + sst.WATERTEMP, default=sst.WATERTEMP)
+    args = parser.parse_args()
+
+    for f in args.wrfinput:
+        if args.sst:
+            field = read_sst( args.sst )
+        else:
+            date = datetime.datetime.strptime( args.date, '%Y-%m-%d' )
+            glats, glons = sst.read_grid( f )
+            try:
+                field = sst.sst( date, glats, glons, args.obs )
+            except ValueError as e:
+                logging.error( "%s, keeping the SST of %s", e, f )
+                continue
+
+        logging.info( "Setting SST of %s: %.2f - %.2f K", f, field.min(), field.max() )
+        copy_sst( f, field )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+import netCDF4 as cdf
+import argparse
+import logging
+import os
+import sys
+
+from multiprocessing import Pool
+
+import catalog
+
+logging.basicConfig(level=logging.INFO)
+
+# fields to cycle from previous run
+URBANFIELDS = "TC_URB,TR_URB,TB_URB,TG_URB,TS_URB,TRL_URB,TBL_URB,TGL_URB"
+CYCLEFIELDS = "TSLB,SMOIS,SH2O,SMCREL,CANWAT,TSK"
+
+
+def find_time( ncfile, when ):
+    """Find the index of time 'when' (as YYYY-MM-DD_HH:MM:SS) in the Times variable of a WRF file.
+    The times are sorted, so use bisection and only read a few time stamps from the file.
+    Returns the index, or None if the time is not in the file"""
+
+    times = ncfile.variables['Times']
+    lo = 0
+    hi = times.shape[0]
+    while lo < hi:
+        mid = ( lo + hi ) // 2
+        if str( cdf.chartostring( times[mid] ) ) < when:
+            lo = mid + 1
+        else:
+            hi = mid
+
+    if lo < times.shape[0] and str( cdf.chartostring( times[lo] ) ) == when:
+        return lo
+    return None
+
+def copy_cycle( source, target, when, fields ):
+    """Copy the fields at time 'when' from the source (wrfout) into the first time of the target (wrfinput).
+    The source is opened once, only the hyperslabs at the cycle time are read,
+    and the target is updated in place."""
+
+    src = cdf.Dataset( source, 'r' )
+    index = find_time( src, when )
+    if index is None:
+        src.close()
+        raise ValueError( "Time {} not found in {}".format( when, source ) )
+
+    dst = cdf.Dataset( target, 'r+' )
+    for f in fields:
+        if f not in dst.variables:
+            # add the variable, like ncks -A does
+            v = src.variables[f]
+            logging.info( "Adding %s to %s", f, target )
+            n = dst.createVariable( f, v.dtype, v.dimensions )
+            n.setncatts( dict( [ (a, v.getncattr(a)) for a in v.ncattrs() ] ) )
+        dst.variables[f][0] = src.variables[f][index]
+
+    dst.close()
+    src.close()
+
+    return index
+
+def complete( source, rsl=None ):
+    """True if all records of a WRF file are written: converted files (.nc) are only renamed when complete,
+    a wrfout is complete when the rsl file, by default rsl.out.0000 next to it, shows the run has finished"""
+    if source.endswith( '.nc' ):
+        return True
+    rsl = rsl or os.path.join( os.path.dirname( source ), 'rsl.out.0000' )
+    return os.path.isfile( rsl ) and catalog.finished( rsl )
+
+def extract_cycle( source, target, when, fields, rsl=None ):
+    """Write the fields at time 'when' from the source (wrfout) to a small cycle state file,
+    which can be used instead of the wrfout as source for copy_cycle.
+    WRF writes Times before the fields, so the last record of a running model is not used.
+    The file is written under a temporary name and renamed when complete."""
+
+    src = cdf.Dataset( source, 'r' )
+    index = find_time( src, when )
+    if index is None:
+        src.close()
+        raise ValueError( "Time {} not found in {}".format( when, source ) )
+    if index == len( src.dimensions['Time'] ) - 1 and not complete( source, rsl ):
+        src.close()
+        raise ValueError( "Time {} is the last record of {} and the run has not finished".format( when, source ) )
+
+    working = target + ".working"
+    dst = cdf.Dataset( working, 'w', format='NETCDF4_CLASSIC' )
+    dst.setncatts( dict( [ (a, src.getncattr(a)) for a in src.ncattrs() ] ) )
+
+    for f in ['Times'] + fields:
+        v = src.variables[f]
+        for dim in v.dimensions:
+            if dim not in dst.dimensions:
+                dst.createDimension( dim, None if dim == 'Time' else len( src.dimensions[dim] ) )
+        n = dst.createVariable( f, v.dtype, v.dimensions, zlib=True )
+        n.setncatts( dict( [ (a, v.getncattr(a)) for a in v.ncattrs() ] ) )
+        n[0] = v[index]
+
+    dst.close()
+    src.close()
+
+    os.rename( working, target )
+    return index
+
+def extract_cycle_star( args ):
+    """Helper for Pool.map, which only passes a single argument"""
+    source, target, when, fields, rsl = args
+    index = extract_cycle( source, target, when, fields, rsl )
+    logging.info( "Extracted cycle state %s from %s step %i", target, source, index )
+    return index
+
+def copy_cycle_star( args ):
+    """Helper for Pool.map, which only passes a single argument"""
+    source, target, when, fields, rsl = args
+    index = copy_cycle( source, target, when, fields )
+    logging.info( "Cycled %s from %s step %i", target, source, index )
+    return index
+
+def main():
+    parser = argparse.ArgumentParser(description="Copy cycle fields from a previous run into wrfinput files")
+    parser.add_argument('files', metavar="source target", type=str, nargs='+',
+                        help="Pairs of source (wrfout or cycle state) and target (wrfinput, or cycle state with --extract) files")
+    parser.add_argument('-x', '--extract', action='store_true', help="Extract the cycle fields to a new cycle state file instead")
+    parser.add_argument('-t', '--time', type=str, required=True, help="Time to cycle from, as YYYY-MM-DD_HH:MM:SS")
+    parser.add_argument('-v', '--variables', type=str, help="Comma separated list of fields to cycle", default=URBANFIELDS + "," + CYCLEFIELDS)
+    parser.add_argument('--rsl', type=str, help="rsl file showing the run has finished, default is rsl.out.0000 next to the source")
+    args = parser.parse_args()
+
+    if len(args.files) % 2 != 0:
+        parser.error( "Files should be given as source target pairs" )
+
+    fields = [ f for f in args.variables.split(',') if f ]
+    jobs = [ (args.files[i], args.files[i + 1], args.time, fields, args.rsl) for i in range( 0, len(args.files), 2 ) ]
+
+    # one process per domain
+    pool = Pool( len(jobs) )
+    try:
+        pool.map( extract_cycle_star if args.extract else copy_cycle_star, jobs )
+    except ValueError as e:
+        logging.error( e )
+        sys.exit(1)
+    finally:
+        pool.close()
+        pool.join()
+
+if __name__ == "__main__":
+    main()
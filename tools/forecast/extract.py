@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+import netCDF4 as cdf
+import numpy as np
+import datetime
+import argparse
+import logging
+
+from multiprocessing import Pool
+
+import archiveindex
+import f90nml
+import nestwrf
+import tslist
+import wrfdiag
+
+logging.basicConfig(level=logging.INFO)
+
+# TS file variable: wrfout variable or wrfdiag diagnostic, and level or component
+FIELDS = {
+    'T2m':    ( 'T2',       None ),
+    'Q2m':    ( 'Q2',       None ),
+    'U10m':   ( 'uvmet10',  0 ),
+    'V10m':   ( 'uvmet10',  1 ),
+    'psfc':   ( 'PSFC',     None ),
+    'glw':    ( 'GLW',      None ),
+    'gsw':    ( 'GSW',      None ),
+    'hfx':    ( 'HFX',      None ),
+    'lh':     ( 'LH',       None ),
+    'tsk':    ( 'TSK',      None ),
+    'tslb1':  ( 'TSLB',     0 ),
+    'rainc':  ( 'RAINC',    None ),
+    'rainnc': ( 'RAINNC',   None ),
+    'tc2m':   ( 'TC2M_URB', None ),
+    'tp2m':   ( 'TP2M_URB', None ),
+}
+
+BLOCK = 24   # time steps read at once
+
+
+def weights( namelist, domain, lats, lons ):
+    """Bilinear interpolation of the mass points of a domain to the stations.
+    Returns the lower left grid indices i, j (0-based), the weights wi, wj of the next point,
+    a boolean array of the stations inside the domain, and the fractional grid indices fi, fj (1-based)"""
+
+    fi, fj, nx, ny = nestwrf.latlon_to_ij( namelist, lats, lons )
+    fi, fj = fi[domain - 1], fj[domain - 1]
+    nx, ny = nx[domain - 1, 0], ny[domain - 1, 0]
+
+    inside = ( fi >= 1 ) & ( fi <= nx ) & ( fj >= 1 ) & ( fj <= ny )
+
+    i = np.clip( np.floor( fi ).astype( int ) - 1, 0, nx - 2 )
+    j = np.clip( np.floor( fj ).astype( int ) - 1, 0, ny - 2 )
+    wi = np.clip( fi - 1 - i, 0.0, 1.0 )
+    wj = np.clip( fj - 1 - j, 0.0, 1.0 )
+
+    return i, j, wi, wj, inside, fi, fj
+
+def interpolate( field, i, j, wi, wj ):
+    """Bilinear interpolation of fields (..., south_north, west_east) to the points"""
+    return ( ( 1 - wj ) * ( ( 1 - wi ) * field[..., j, i]     + wi * field[..., j, i + 1] ) +
+                   wj   * ( ( 1 - wi ) * field[..., j + 1, i] + wi * field[..., j + 1, i + 1] ) )
+
+def hours( ncfile ):
+    """Time of all time steps of a wrfout file in hours since the start of the run"""
+    times = [ datetime.datetime.strptime( str( t ), '%Y-%m-%d_%H:%M:%S' ) for t in cdf.chartostring( ncfile.variables['Times'][:] ) ]
+    if 'SIMULATION_START_DATE' in ncfile.ncattrs():
+        start = datetime.datetime.strptime( ncfile.getncattr( 'SIMULATION_START_DATE' ), '%Y-%m-%d_%H:%M:%S' )
+    else:
+        start = times[0]
+    return np.array( [ ( t - start ).total_seconds() / 3600.0 for t in times ] )
+
+def extract( wrfout, tsfile, stations, namelist, variables, staticdir=None ):
+    """Interpolate variables of a wrfout file to the stations, and write them to a TS file made with ts_make_ncs.sh.
+    The interpolation weights are computed once, and each variable is read in blocks of BLOCK time steps,
+    only the hyperslab of the grid around the stations"""
+
+    names, prefixes, lats, lons = stations
+
+    ncfile = cdf.Dataset( wrfout, 'r' )
+    domain = int( ncfile.getncattr( 'GRID_ID' ) )
+    ntimes = len( ncfile.dimensions['Time'] )
+    time = hours( ncfile )
+    ncfile.close()
+
+    i, j, wi, wj, inside, fi, fj = weights( namelist, domain, lats, lons )
+    if not inside.any():
+        logging.warn( "No stations in domain %i of %s", domain, wrfout )
+        return 0
+    for n in np.where( ~ inside )[0]:
+        logging.info( "Station %s is outside domain %i", prefixes[n], domain )
+
+    # window around the stations
+    i0, i1 = int( i[inside].min() ), int( i[inside].max() ) + 2
+    j0, j1 = int( j[inside].min() ), int( j[inside].max() ) + 2
+    window = ( j0, j1, i0, i1 )
+    li, lj = i[inside] - i0, j[inside] - j0
+    wi, wj = wi[inside], wj[inside]
+
+    ts = cdf.Dataset( tsfile, 'r+' )
+    strln = len( ts.dimensions['strln'] )
+    if len( ts.dimensions['station'] ) != len( names ):
+        ts.close()
+        raise ValueError( "{} has {} stations, the tslist {}".format( tsfile, len( ts.dimensions['station'] ), len( names ) ) )
+
+    # station metadata, as ts_copy_ascii.py
+    for n in range( len( names ) ):
+        ts.variables['station'][n] = n
+        ts.variables['name'][n]    = cdf.stringtoarr( names[n], strln )
+        ts.variables['prefix'][n]  = cdf.stringtoarr( prefixes[n], strln )
+    ts.variables['lat'][:] = lats
+    ts.variables['lon'][:] = lons
+
+    columns = np.where( inside )[0]
+    static = lambda name: interpolate( wrfdiag.getdiag( wrfout, name, [0], staticdir, window )[0], li, lj, wi, wj )
+    ts.variables['gi'][columns]        = fi[inside]
+    ts.variables['gj'][columns]        = fj[inside]
+    ts.variables['gridi'][columns]     = np.round( fi[inside] ).astype( int )
+    ts.variables['gridj'][columns]     = np.round( fj[inside] ).astype( int )
+    ts.variables['glat'][columns]      = static( 'XLAT' )
+    ts.variables['glon'][columns]      = static( 'XLONG' )
+    ts.variables['elevation'][columns] = static( 'HGT' )
+    ts.variables['time'][0:ntimes]     = time
+
+    for varname in variables:
+        source, index = FIELDS[varname]
+        for start in range( 0, ntimes, BLOCK ):
+            steps = range( start, min( start + BLOCK, ntimes ) )
+            field = wrfdiag.getdiag( wrfout, source, steps, staticdir, window )
+            if index is not None:
+                field = field[:, index]
+            values = interpolate( field, li, lj, wi, wj )
+
+            if 'add_offset' in ts.variables[varname].ncattrs():
+                # as ts_copy_ascii.py
+                values = values - ts.variables[varname].add_offset
+            ts.variables[varname][steps[0]:steps[-1] + 1, columns] = values
+
+        logging.info( "%s: %s done", tsfile, varname )
+
+    ts.close()
+    return len( columns )
+
+def extract_star( args ):
+    """Helper for Pool.map, which only passes a single argument"""
+    return extract( *args )
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract time series at the stations of a tslist from wrfout files, into TS files made with ts_make_ncs.sh")
+    parser.add_argument('files', metavar="wrfout tsfile", type=str, nargs='+',
+                        help="Pairs of wrfout file and TS netCDF file, create the TS file first with ts_make_ncs.sh")
+    parser.add_argument('-t', '--tslist', type=str, help="Station list in tslist format, default is tslist", default="tslist")
+    parser.add_argument('-w', '--wps', type=str, help="namelist.wps of the domains, default is namelist.wps", default="namelist.wps")
+    parser.add_argument('-v', '--variables', type=str, help="Comma separated list of TS variables, default is all: " + ",".join( sorted( FIELDS.keys() ) ),
+                        default=",".join( sorted( FIELDS.keys() ) ))
+    parser.add_argument('-n', '--processes', type=int, help="Number of files to process concurrently, default is 4", default=4)
+    parser.add_argument('--static', type=str, help="Directory with static files of deduplicated wrfout files")
+    parser.add_argument('-i', '--index', type=str, help="Add the TS files to this archive index, see archiveindex.py")
+    args = parser.parse_args()
+
+    if len(args.files) % 2 != 0:
+        parser.error( "Files should be given as wrfout tsfile pairs" )
+
+    variables = [ v for v in args.variables.split(',') if v ]
+    for v in variables:
+        if v not in FIELDS:
+            parser.error( "Unknown variable {}".format( v ) )
+
+    stations = tslist.read_tslist( args.tslist )
+    namelist = f90nml.read( args.wps )
+    namelist['geogrid'] = nestwrf.fixgeogrid( namelist['geogrid'] )
+    namelist['share']   = nestwrf.fixshare( namelist['share'] )
+
+    jobs = [ (args.files[i], args.files[i + 1], stations, namelist, variables, args.static) for i in range( 0, len(args.files), 2 ) ]
+
+    pool = Pool( min( args.processes, len(jobs) ) )
+    counts = pool.map( extract_star, jobs )
+    pool.close()
+    pool.join()
+
+    for job, count in zip( jobs, counts ):
+        logging.info( "%s: %i stations from %s", job[1], count, job[0] )
+
+        if args.index:
+            ncfile = cdf.Dataset( job[0], 'r' )
+            start = ncfile.getncattr( 'SIMULATION_START_DATE' ) if 'SIMULATION_START_DATE' in ncfile.ncattrs() else None
+            domain = int( ncfile.getncattr( 'GRID_ID' ) )
+            ncfile.close()
+            archiveindex.add_files( args.index, [ job[1] ], run=start and start[:10], domain=domain )
+
+if __name__ == "__main__":
+    main()
@@ -24,24 +24,38 @@ YYYY=`date -d $DATESTART +%Y`
 MM=`date -d $DATESTART +%m`
 DD=`date -d $DATESTART +%d`
 
-# Check location..
-if [ -f "$ARCDIR/${YYYY}/${MM}/${DD}/wrfout_d01_${YYYY}-${MM}-${DD}_00:00:00.nc" ]; then
-    # .. in archive
-    NCFILE="$ARCDIR/${YYYY}/${MM}/${DD}/wrfout_d01_${YYYY}-${MM}-${DD}_00:00:00.nc"
-    echo "Found in archive: $NCFILE"
-elif [ -f "$RUNDIR/wrfout_d01_${YYYY}-${MM}-${DD}_00:00:00" ]; then
-    # .. in rundir
-    NCFILE="$RUNDIR/wrfout_d01_${YYYY}-${MM}-${DD}_00:00:00"
-    echo "Found in rundir: $NCFILE"
-else
-    # not found!
-    echo "Cannot find matching netcdf file"
+CYCLETIME=`date -d "$DATESTART 24 hours" +%F_%T`
+
+# Extract the cycle state for each domain once the cycle time is in the netcdf file,
+# so the next run does not need the full wrfout, wherever it is by then
+READY="yes"
+for NCFILE in $RUNDIR/wrfout_d??_${YYYY}-${MM}-${DD}_00:00:00 $ARCDIR/${YYYY}/${MM}/${DD}/wrfout_d??_${YYYY}-${MM}-${DD}_00:00:00.nc; do
+    if [ ! -f "$NCFILE" ]; then
+        continue
+    fi
+    D=`basename "$NCFILE" | cut -c 8-10`
+    STATE="$RUNDIR/wrfcycle_${D}_${CYCLETIME}.nc"
+    if [ -f "$STATE" ]; then
+        continue
+    fi
+    echo "Found: $NCFILE"
+    $TOP/tools/forecast/cycle.py --extract --time "$CYCLETIME" "$NCFILE" "$STATE" || READY="no"
+done
+
+# the next run needs the state of every domain
+NDOMS=`$TOP/tools/forecast/namelist.py --get domains:max_dom "$RUNDIR/namelist.input"`
+if [ -z "$NDOMS" ]; then
+    echo "Cannot read max_dom from $RUNDIR/namelist.input"
     exit
 fi
+for D in `seq -f 'd%02g' 1 $NDOMS`; do
+    if [ ! -f "$RUNDIR/wrfcycle_${D}_${CYCLETIME}.nc" ]; then
+        echo "Cannot find cycle state of $D for $CYCLETIME"
+        exit
+    fi
+done
 
-STEP=`ncdump -h "$NCFILE" | grep UNLIMITED | tr -d "[a-zA-Z=;()/]"`
-echo "at step $STEP"
-if (( $STEP > 8 )); then
+if [ "$READY" = "yes" ]; then
     NEWRUN=`date -d "$DATESTART 24 hours"  +%F`
     echo "Ready for the next cycle, next STARTDATE is $NEWRUN"
 
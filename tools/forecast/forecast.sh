@@ -30,12 +30,9 @@ CYCLESTEP=24        # time between two forecast runs in hours
 CYCLELEN=48         # length of a forecast run in hours
 BOUNDARYINTERVAL=6  # time between boundaries, in hours
 
-# Index in netCDF file to use for copy_cycle:
+# Time in the previous run to use for copy_cycle, in hours since its start:
 # at midnight, 24 hours in the run:
-CYCLEINDEX[01]=8
-CYCLEINDEX[02]=24
-CYCLEINDEX[03]=24
-CYCLEINDEX[04]=24
+CYCLEOFFSET=24
 
 # fields to cycle from previous run
 URBANFIELDS="TC_URB,TR_URB,TB_URB,TG_URB,TS_URB,TRL_URB,TBL_URB,TGL_URB"
@@ -55,22 +52,45 @@ FORECASTLOG=${FORECASTLOG-$HOME/forecast.config}
 
 # Top level dirs, runs will be added in subdirectories like 2015/06/03
 DATDIR=${DATDIR-/projects/0/sitc/GFS}
+
+# GFS boundaries are downloaded to a store on the home disk, with a quota;
+# least recently used cycles are moved to DATDIR, see gfs_store.py
+GFSHOT=${GFSHOT-$HOME/GFS}
+GFSQUOTA=${GFSQUOTA-100G}
 ARCDIR=${ARCDIR-/projects/0/sitc/archive2}
 
+# index of the archived runs, on a local disk; see archiveindex.py
+export ARCHIVEDB=${ARCHIVEDB-$HOME/.forecast_archive.sqlite}
+
 # clean RUNDIR to use as startingpoint for a run
 FORECASTTEMPLATE=${FORECASTTEMPLATE-$WRFDIR/run}
 
+# timing of the runs from the rsl files, see rsl_timing.py
+RSLHISTORY=${RSLHISTORY-$HOME/.forecast_rsl_timing.jsonl}
+
+# timing and I/O of the forecast tools, a file per run date; see metrics.py
+METRICSDIR=${METRICSDIR-$HOME/.forecast_metrics}
+
+# convert the output to netCDF4 while WRF is running (see 'zip follow'), yes or no
+ZIPFOLLOW=${ZIPFOLLOW-no}
+
 # location of forecast scripts
 FORECASTTOOLS=${FORECASTTOOLS-$WRFDIR/tools/forecast}
 
 # location of external tools
 NAMELIST=$FORECASTTOOLS/namelist.py
-COPYSST=$FORECASTTOOLS/copy_sst_init.sh
-PREPSST=$FORECASTTOOLS/prepare_sst.sh
-
-# Use these tools from your default path
-NCDUMP=${NCDUMP-`which ncdump`}
-NC3TONC4=${NC3TONC4-`which nc3tonc4`}
+COPYSST=$FORECASTTOOLS/copy_sst_init.py
+CYCLE=$FORECASTTOOLS/cycle.py
+CATALOG=$FORECASTTOOLS/catalog.py
+IOBUDGET=$FORECASTTOOLS/iobudget.py
+CONVERTNC4=$FORECASTTOOLS/convert_nc4.py
+PLOTSURFACE=$FORECASTTOOLS/plot_surface.py
+ARCHIVE=$FORECASTTOOLS/archive.py
+ARCHIVEINDEX=$FORECASTTOOLS/archiveindex.py
+GFSDOWNLOAD=$FORECASTTOOLS/gfs_download.py
+RSLTIMING=$FORECASTTOOLS/rsl_timing.py
+METRICS=$FORECASTTOOLS/metrics.py
+GFSSTORE="$FORECASTTOOLS/gfs_store.py --hot $GFSHOT --archive $DATDIR --quota $GFSQUOTA"
 
 
 ################################################################################
@@ -103,6 +123,7 @@ zip:
   all 
   ts           Zip TS files
   netcdf       Convert netCDF output to netCDF-4 format with compression
+  follow       Convert netCDF output while WRF is running, until the run has finished
   log          Zip WRF log files
 
 archive:
@@ -120,6 +141,7 @@ plot:
   surface <date> Make surface plots using script number one.
 
 status         Print forecast status
+catalog <date> Print the status of all runs in WRFDIR and ARCDIR, or only for date
 "
 
 # -=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-
@@ -227,6 +249,16 @@ function boundary_list_ecmwf_opan {
     eval "$out='${LIST}'"
 }
 
+######################################################################
+# Sets FORECAST_METRICS, the metrics file of the run at DATESTART
+# Required env:
+#    METRICSDIR, DATESTART
+######################################################################
+function metricsinit {
+    mkdir -p "$METRICSDIR"
+    export FORECAST_METRICS="$METRICSDIR/$DATESTART.jsonl"
+}
+
 ######################################################################
 # Initialize the forecast script
 # Parses the namelist file and sets NDOMS, DATESTART, and STATIONS
@@ -245,6 +277,7 @@ function forecastinit {
     START_M=`$NAMELIST --get time_control:start_month:0 "$RUNDIR/namelist.input"`
     START_D=`$NAMELIST --get time_control:start_day:0   "$RUNDIR/namelist.input"`
     DATESTART=`printf '%4i-%02i-%02i' ${START_Y} ${START_M} ${START_D}`
+    metricsinit
 
     if [ -f $RUNDIR/tslist ]; then
         STATIONS=`cat $RUNDIR/tslist | awk '{print $2}'`
@@ -514,16 +547,20 @@ function archive_ts {
     # Get the archive directory for this run
     archivedir $DATESTART DEST
 
+    FILES=""
     for d in `seq -f '%02.0f' 1 $NDOMS`; do
         for s in $STATIONS; do
 
             ZIPPED=${s}.d${d}.zip
             if [ -f $RUNDIR/$ZIPPED ]; then
-                cp $RUNDIR/$ZIPPED $DEST
-                rm -f $RUNDIR/$ZIPPED
+                FILES="$FILES $RUNDIR/$ZIPPED"
             fi
         done
     done
+
+    if [ -n "$FILES" ]; then
+        $ARCHIVE --index "$ARCHIVEDB" "$DEST" $FILES
+    fi
 }
 
 ######################################################################
@@ -541,11 +578,13 @@ function archive_netcdf {
     # Get the archive directory for this run
     archivedir $DATESTART DEST
 
+    FILES=""
     for d in `seq -f '%02.0f' 1 $NDOMS`; do
-        NCDF4="wrfout_d${d}_${DATESTART}_00:00:00.nc" 
-        cp $RUNDIR/$NCDF4 $DEST
-        rm -f $RUNDIR/$NCDF4
+        FILES="$FILES $RUNDIR/wrfout_d${d}_${DATESTART}_00:00:00.nc"
     done
+
+    # the files are copied concurrently, and a restarted job skips files copied before
+    $ARCHIVE --index "$ARCHIVEDB" "$DEST" $FILES
 }
 
 ######################################################################
@@ -566,8 +605,7 @@ function archive_log {
     LOGS="logs_${DATESTART}.zip"
 
     if [ -f $RUNDIR/$LOGS ]; then
-        cp $RUNDIR/$LOGS $DEST
-        rm -f $RUNDIR/$LOGS
+        $ARCHIVE --index "$ARCHIVEDB" "$DEST" $RUNDIR/$LOGS
     else
         printf "$0 [$LINENO]: Cannot archive logs. Aborting\n"
         exit -1
@@ -663,6 +701,7 @@ function prepare_date {
     else
         DATESTART=$1
     fi
+    metricsinit
 
     # namelist.input 
     # namelist.wps   (Format: 2006-08-16_12:00:00)
@@ -704,8 +743,13 @@ function download_gfs {
         when="$1"
     fi
     BDATE=`date -d "$when" +'%Y%m%d00'`
-    mkdir -p $DATDIR/$BDATE
-    $FORECASTTOOLS/get_gfs.pl data ${BDATE} 0 48 6 all all $DATDIR/$BDATE
+    mkdir -p $GFSHOT/$BDATE
+
+    # concurrent and resumable, only the fields used by ungrib; fails if a forecast hour is missing
+    $GFSDOWNLOAD --first 0 --last $CYCLELEN --step $BOUNDARYINTERVAL ${BDATE} $GFSHOT/$BDATE
+
+    # register the cycle, older cycles are moved to $DATDIR when over the quota
+    $GFSSTORE add ${BDATE}
 }
 
 ######################################################################
@@ -734,11 +778,15 @@ function prepare_boundaries {
 
     # starting from today's run hours 00 to 48:
     BDATE=`date -d "today $DATESTART" +'%Y%m%d00'`
+
+    # local path of the cycle, recalled from $DATDIR if it was evicted from the home store
+    GFSPATH=`$GFSSTORE get $BDATE` || GFSPATH=$DATDIR/$BDATE
+
     FILES="gfs.t00z.pgrb2.0p25.f000 gfs.t00z.pgrb2.0p25.f006 gfs.t00z.pgrb2.0p25.f012 gfs.t00z.pgrb2.0p25.f018 gfs.t00z.pgrb2.0p25.f024 gfs.t00z.pgrb2.0p25.f030 gfs.t00z.pgrb2.0p25.f036 gfs.t00z.pgrb2.0p25.f042 gfs.t00z.pgrb2.0p25.f048"
 
     ALL_PRESENT="Yes"
     for f in $FILES; do
-        if [ ! -f $DATDIR/$BDATE/$f ]; then
+        if [ ! -f $GFSPATH/$f ]; then
             echo "Missing: $f"
             ALL_PRESENT="No"
         fi
@@ -750,7 +798,7 @@ function prepare_boundaries {
 
     # convert to WRF input
     cd "$WPSDIR"
-    $WPSDIR/link_grib.csh $DATDIR/$BDATE/  2>&1 >> $RUNDIR/prepare_boundaries.log
+    $WPSDIR/link_grib.csh $GFSPATH/  2>&1 >> $RUNDIR/prepare_boundaries.log
     $WPSDIR/ungrib.exe               2>&1 >> $RUNDIR/prepare_boundaries.log
     $WPSDIR/metgrid.exe             2>&1 >> $RUNDIR/prepare_boundaries.log
 
@@ -792,10 +840,7 @@ function prepare_cycle {
         CYCLEDATE=`date --date "$DATESTART $DOUBLE hours ago" +%F`
 
         ## at midnight, at 48 hours in the run:
-        CYCLEINDEX[01]=16
-        CYCLEINDEX[02]=48
-        CYCLEINDEX[03]=48
-        CYCLEINDEX[04]=48
+        CYCLEOFFSET=$DOUBLE
     elif [ "recover" == "$1" ]; then
         DOUBLE=$(( 2 * CYCLESTEP ))
         CYCLEDATE=`date --date "$DATESTART $DOUBLE hours ago" +%F`
@@ -803,30 +848,49 @@ function prepare_cycle {
         CYCLEDATE=$1
     fi
 
+    CYCLETIME=`date --date "$CYCLEDATE $CYCLEOFFSET hours" +%F_%T`
+
+    PAIRS=""
     for d in `seq -f '%02.0f' 1 $NDOMS`; do
 
-       # 1) Look into archive
+       # 0) Use the cycle state extracted by fc_spawn.sh
+       CYCLEFILE="${RUNDIR}/../${CYCLEDATE}/wrfcycle_d${d}_${CYCLETIME}.nc"
+       if [ -f "${CYCLEFILE}" ]; then
+          log "Cycling from file: $CYCLEFILE time ${CYCLETIME}"
+          PAIRS="$PAIRS ${CYCLEFILE} ${RUNDIR}/wrfinput_d${d}"
+          continue
+       fi
+
+       # 1) Look into archive, using the archive index if the run is in it
+       CYCLEFILE=`$ARCHIVEINDEX cycle $CYCLEDATE $d 2>/dev/null || true`
+       if [ -n "${CYCLEFILE}" ] && [ -f "${CYCLEFILE}" ]; then
+          log "Cycling from file: $CYCLEFILE time ${CYCLETIME}"
+          PAIRS="$PAIRS ${CYCLEFILE} ${RUNDIR}/wrfinput_d${d}"
+          continue
+       fi
+
        archivedir $CYCLEDATE CYCLEDIR
        CYCLEFILE="${CYCLEDIR}/wrfout_d${d}_${CYCLEDATE}_00:00:00.nc"
        if [ -f "${CYCLEFILE}" ]; then
-          log "Cycling from file: $CYCLEFILE step ${CYCLEINDEX[$d]}"
-          ncks -C -A -o "${RUNDIR}/wrfinput_d${d}" -v ${URBANFIELDS} -d Time,${CYCLEINDEX[$d]} "${CYCLEFILE}"
-          ncks -C -A -o "${RUNDIR}/wrfinput_d${d}" -v ${CYCLEFIELDS} -d Time,${CYCLEINDEX[$d]} "${CYCLEFILE}"
+          log "Cycling from file: $CYCLEFILE time ${CYCLETIME}"
+          PAIRS="$PAIRS ${CYCLEFILE} ${RUNDIR}/wrfinput_d${d}"
           continue
        fi
 
        # 2) Try from a rundir
        CYCLEFILE="${RUNDIR}/../${CYCLEDATE}/wrfout_d${d}_${CYCLEDATE}_00:00:00"
        if [ -f "${CYCLEFILE}" ]; then
-          log "Cycling from file: $CYCLEFILE step ${CYCLEINDEX[$d]}"
-          ncks -C -A -o "${RUNDIR}/wrfinput_d${d}" -v ${URBANFIELDS} -d Time,${CYCLEINDEX[$d]} "${CYCLEFILE}"
-          ncks -C -A -o "${RUNDIR}/wrfinput_d${d}" -v ${CYCLEFIELDS} -d Time,${CYCLEINDEX[$d]} "${CYCLEFILE}"
+          log "Cycling from file: $CYCLEFILE time ${CYCLETIME}"
+          PAIRS="$PAIRS ${CYCLEFILE} ${RUNDIR}/wrfinput_d${d}"
           continue
        fi
 
        log "Cannot find cycle file for date: $CYCLEDATE"
        exit -1
     done
+
+    # copy the fields for all domains in parallel
+    $CYCLE --time "$CYCLETIME" --variables "${URBANFIELDS},${CYCLEFIELDS}" $PAIRS
     $NAMELIST --set physics:sf_urban_init_from_file .true. $RUNDIR/namelist.input
 }
 
@@ -850,9 +914,7 @@ function prepare_sst {
 
     for d in 03 04; do
         log "Domain $d: SSTDATE is $SSTDATE" >> prepare_boundaries.log
-        $PREPSST "$SSTDATE" ~/SST/domain_d${d}.grid $RUNDIR/sst_d${d}.nc
-        $COPYSST $RUNDIR/sst_d${d}.nc wrfinput_d${d}
-        rm sst_d${d}.nc
+        $COPYSST --date "$SSTDATE" $RUNDIR/wrfinput_d${d}
     done
 }
 
@@ -883,7 +945,21 @@ function run_wrf {
         exit -1
     fi
     cd $RUNDIR 
-    sbatch job.wrf
+
+    # check the expected output fits on disk
+    $IOBUDGET --check "$RUNDIR" --tslist "$RUNDIR/tslist" --wps "$WPSDIR/namelist.wps" "$RUNDIR/namelist.input" || {
+        log "Not enough disk space for the WRF output"
+        exit 1
+    }
+
+    WRFJOB=`sbatch --parsable job.wrf`
+    WRFJOB=${WRFJOB%%;*}
+
+    # convert the output to netCDF4 while WRF runs, starting when WRF starts
+    if [ "$ZIPFOLLOW" = "yes" ]; then
+        cat $FORECASTTOOLS/follow.template | sed "s=%RUNDIR%=$RUNDIR=" | sed "s=%WRFJOB%=$WRFJOB=" > follow.job
+        sbatch --dependency=after:$WRFJOB follow.job
+    fi
 }
 
 
@@ -966,6 +1042,24 @@ function zip_log {
     FILES="$RSL $RSLE $FILES"
     CLEANUP="$RSL $RSLE $CLEANUP"
 
+    # timing of all ranks, kept with the logs and added to the history of runs (see 'rsl_timing.py --trend')
+    if [ ! -f "logs_${DATESTART}.zip" ]; then
+        if $RSLTIMING --history "$RSLHISTORY" --run "$DATESTART" > rsl_timing.txt; then
+            FILES="$FILES rsl_timing.txt"
+            CLEANUP="$CLEANUP rsl_timing.txt"
+        fi
+    fi
+
+    # timing of the forecast tools, compared to the previous week (see metrics.py)
+    if [ ! -f "logs_${DATESTART}.zip" ]; then
+        if $METRICS summary > metrics.txt; then
+            FILES="$FILES metrics.txt"
+            CLEANUP="$CLEANUP metrics.txt"
+        else
+            rm -f metrics.txt
+        fi
+    fi
+
     # check if the log files exist
     for f in $FILES; do
         if [ ! -f $f ]; then
@@ -1014,37 +1108,57 @@ function zip_netcdf {
         exit 1;
     fi
 
+    FILES=""
     for d in `seq -f '%02.0f' 1 $NDOMS`; do
         NCDF3="wrfout_d${d}_${DATESTART}_00:00:00"
-        TMPFL="wrfout_d${d}_${DATESTART}.working"
-        NCDF4="wrfout_d${d}_${DATESTART}_00:00:00.nc" 
 
         # if the output file exists
         if [ -f "${NCDF3}" ]; then
+            FILES="$FILES $NCDF3"
+        fi
+    done
 
-            # .. but the netCDF4 version does not exist
-            if [ ! -f "${NCDF4}" ]; then
-
-                # convert the file from netCDF3 to netCDF4
-                $NC3TONC4 -o "${NCDF3}" "${TMPFL}" && mv -f "${TMPFL}" "${NCDF4}" > /dev/null
-            fi
+    # convert all domains to netCDF4 and verify the result, the netCDF3 files are removed if all went ok;
+    # time invariant fields are stored once per domain in the static files in the archive
+    if [ -n "$FILES" ]; then
+        $CONVERTNC4 --remove --static "$ARCDIR/static" $FILES || {
+            printf "$0 [$LINENO]: Error in converting $FILES\n"
+            exit 1
+        }
+    fi
+}
 
-            # test if all went ok
-            $NCDUMP -h "${NCDF3}" > "${NCDF3}.dump" 
-            $NCDUMP -h "${NCDF4}" > "${NCDF4}.dump" 
-            cmp "${NCDF3}.dump" "${NCDF4}.dump" || (
-                printf "$0 [$LINENO]: Error in converting ${NCDF3}"
-                exit 1 
-            )
+######################################################################
+# Zip WRF netCDF output while WRF is running:
+# complete time steps are converted as they are written,
+# until rsl.out.0000 shows the run has finished
+#
+#      wrfout* -> wrfout*.nc
+#
+# Assumes:
+#    CWD is the wrf 'run' directory
+# Required env:
+#    NDOMS, DATESTART
+######################################################################
+function zip_follow {
+    if [[ -z "$NDOMS" || -z "$DATESTART" ]]; then
+        printf "$0 [$LINENO]: NDOMS or DATESTART not set, aborting\n"
+        exit 1;
+    fi
 
-            # clean up
-            rm -f "${NCDF3}" "${NCDF3}.dump" "${NCDF4}.dump" "${TMPFL}"
-        fi
+    FILES=""
+    for d in `seq -f '%02.0f' 1 $NDOMS`; do
+        FILES="$FILES wrfout_d${d}_${DATESTART}_00:00:00"
     done
+
+    $CONVERTNC4 --follow --remove --rsl rsl.out.0000 --static "$ARCDIR/static" $FILES || {
+        printf "$0 [$LINENO]: Error in converting $FILES\n"
+        exit 1
+    }
 }
 
 ######################################################################
-# Make plots using NCL
+# Make surface plots with plot_surface.py (as wrf_Surface3.ncl)
 # Plots are made from the archived NetCDF4 files,
 # and placed in the archive directory
 ######################################################################
@@ -1058,10 +1172,13 @@ function plot_surface {
     # Check archive status
     archivedir $when ARCHIVE
 
+    # all domains and time steps are plotted concurrently
+    PAIRS=""
     for d in `seq -f '%02.0f' 1 $NDOMS`; do
         NCDF4="wrfout_d${d}_${when}_00:00:00.nc" 
-        ncl $FORECASTTOOLS/wrf_Surface3.ncl inputfile=\"$ARCHIVE/$NCDF4\" outputfile=\"$ARCHIVE/surface_$d.png\"
+        PAIRS="$PAIRS $ARCHIVE/$NCDF4 $ARCHIVE/surface_$d.png"
     done
+    $PLOTSURFACE --style 3 --static "$ARCDIR/static" $PAIRS
 }
 
 
@@ -1077,6 +1194,14 @@ case "$1" in
         download_gfs "$2"
         exit 0
         ;;
+    catalog)
+        if [ x$2 == "x" ]; then
+            $CATALOG --top "$WRFDIR" --archive "$ARCDIR"
+        else
+            $CATALOG --top "$WRFDIR" --archive "$ARCDIR" --date "$2"
+        fi
+        exit 0
+        ;;
     help | -h | -? )
         help
         exit 0
@@ -1120,6 +1245,7 @@ case "$1" in
         case "$2" in
             "all")     zip_netcdf ; zip_ts ; zip_log ;;
             "netcdf")  zip_netcdf ;;
+            "follow")  zip_follow ;;
             "ts")      zip_ts ;;
             "log")     zip_log ;;
             *)         echo "Internal error!" ; exit 1 ;;
@@ -0,0 +1,293 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+"""Download GFS boundaries from NCEP, only the fields used by ungrib.exe.
+
+The .idx inventory of each forecast file lists the byte offset of every GRIB message;
+only the messages of the fields in FIELDS are requested, with HTTP Range requests.
+Forecast hours are downloaded concurrently, into a .working file that is resumed
+when the download is restarted, and renamed when all messages are complete.
+
+For testing, --serve runs a local stand-in server with Range support for a directory
+of sample GRIB files and their .idx inventories:
+
+    gfs_download.py --serve ~/GFS/samples --port 8000 &
+    gfs_download.py --url 'http://localhost:8000/gfs.t{date:%H}z.pgrb2.0p25.f{hour:03}' 2015060300 /tmp/gfs
+"""
+
+import argparse
+import datetime
+import logging
+import os
+import re
+import struct
+import sys
+import time
+import urllib2
+
+from multiprocessing.pool import ThreadPool
+
+logging.basicConfig(level=logging.INFO)
+
+# location of the forecast files; date is the cycle, hour the forecast hour
+URL = "https://nomads.ncep.noaa.gov/pub/data/nccf/com/gfs/prod/gfs.{date:%Y%m%d}/{date:%H}/atmos/gfs.t{date:%H}z.pgrb2.0p25.f{hour:03}"
+
+# local file names, as expected by prepare_boundaries
+FILENAME = "gfs.t{date:%H}z.pgrb2.0p25.f{hour:03}"
+
+# fields and levels of Vtable.GFS, as regular expressions on the .idx variable and level
+FIELDS = [
+    ( r"HGT|TMP|RH|UGRD|VGRD",        r"\d+(\.\d+)? mb" ),
+    ( r"TMP|RH|SPFH",                 r"2 m above ground" ),
+    ( r"UGRD|VGRD",                   r"10 m above ground" ),
+    ( r"PRES|HGT|TMP|LAND|ICEC|WEASD|SNOD", r"surface" ),
+    ( r"PRMSL|MSLET",                 r"mean sea level" ),
+    ( r"TSOIL|SOILW",                 r"[\d.]+-[\d.]+ m below ground" ),
+]
+
+RETRIES = 5       # attempts per request
+TIMEOUT = 120     # seconds without data before a request fails
+BUFSIZE = 1024 * 1024
+
+
+def inventory( text ):
+    """Parse a .idx inventory, lines like '1:0:d=2015060300:PRMSL:mean sea level:anl:'.
+    Returns a list of (offset, end, variable, level); end is None for the last message"""
+    records = []
+    for line in text.splitlines():
+        fields = line.split( ':' )
+        if len( fields ) >= 5:
+            records.append( [ int( fields[1] ), None, fields[3], fields[4] ] )
+    for n in range( len( records ) - 1 ):
+        records[n][1] = records[n + 1][0]
+    return [ tuple( r ) for r in records ]
+
+def select( records, fields=FIELDS ):
+    """Byte ranges (start, end) of the messages of the wanted fields; adjacent messages are merged.
+    End is exclusive, or None up to the end of the file. Returns the ranges and the number of messages"""
+    patterns = [ ( re.compile( "^(" + v + ")$" ), re.compile( "^(" + l + ")$" ) ) for v, l in fields ]
+    ranges = []
+    count = 0
+    for start, end, variable, level in records:
+        if not any( [ v.match( variable ) and l.match( level ) for v, l in patterns ] ):
+            continue
+        count += 1
+        if ranges and ranges[-1][1] == start:
+            ranges[-1] = ( ranges[-1][0], end )
+        else:
+            ranges.append( ( start, end ) )
+    return ranges, count
+
+def messages( filename ):
+    """Number of complete GRIB messages in a file; raises ValueError if the file is not a sequence of GRIB messages"""
+    count = 0
+    f = open( filename, 'rb' )
+    size = os.fstat( f.fileno() ).st_size
+    while f.tell() < size:
+        header = f.read( 16 )
+        if len( header ) < 16 or header[:4] != 'GRIB':
+            f.close()
+            raise ValueError( "{} is not a complete GRIB file".format( filename ) )
+        # edition 1 has a 3 byte length, edition 2 an 8 byte length
+        if ord( header[7] ) == 2:
+            length = struct.unpack( '>Q', header[8:16] )[0]
+        else:
+            length = struct.unpack( '>I', '\0' + header[4:7] )[0]
+        f.seek( f.tell() - 16 + length )
+        count += 1
+    if f.tell() != size:
+        f.close()
+        raise ValueError( "{} ends with an incomplete message".format( filename ) )
+    f.close()
+    return count
+
+def fetch( url, dst, start=0, end=None ):
+    """Append bytes start..end (exclusive, or up to the end if None) of url to an open file.
+    Retries with increasing waits, and continues after the bytes already received.
+    Returns the number of bytes"""
+
+    received = 0
+    for attempt in range( RETRIES ):
+        if end is not None and start + received >= end:
+            break
+        request = urllib2.Request( url )
+        first = start + received
+        ranged = first > 0 or end is not None
+        if ranged:
+            request.add_header( 'Range', "bytes={}-{}".format( first, "" if end is None else end - 1 ) )
+        try:
+            response = urllib2.urlopen( request, timeout=TIMEOUT )
+            if ranged and response.getcode() != 206:
+                response.close()
+                raise ValueError( "{} does not support Range requests".format( url ) )
+            while True:
+                data = response.read( BUFSIZE )
+                if not data:
+                    break
+                dst.write( data )
+                received += len( data )
+            response.close()
+            if end is None or start + received >= end:
+                return received
+        except urllib2.HTTPError as e:
+            if e.code == 416 and end is None:
+                # the end of the file was reached before
+                return received
+            if e.code == 404:
+                raise
+            logging.warn( "%s: %s, attempt %i", url, e, attempt + 1 )
+        except (urllib2.URLError, IOError) as e:
+            logging.warn( "%s: %s, attempt %i", url, e, attempt + 1 )
+        time.sleep( 2 ** attempt )
+
+    if end is not None and start + received < end:
+        raise IOError( "Failed to download {} bytes {}-{}".format( url, start, end ) )
+    return received
+
+def download( url, filename, fields=FIELDS ):
+    """Download the messages of the wanted fields of one forecast file, or the whole file if fields is None.
+    A partial download in <filename>.working is resumed, if the inventory did not change.
+    Returns the number of bytes of the file"""
+
+    if os.path.isfile( filename ):
+        logging.info( "%s exists", filename )
+        return os.path.getsize( filename )
+
+    working = filename + ".working"
+    saved = working + ".idx"
+
+    if fields is None:
+        ranges = [ ( 0, None ) ]
+        expected = None
+    else:
+        text = urllib2.urlopen( url + ".idx", timeout=TIMEOUT ).read()
+        ranges, expected = select( inventory( text ), fields )
+
+        # a partial download of an older inventory can not be resumed
+        if not os.path.isfile( saved ) or open( saved, 'r' ).read() != text:
+            if os.path.isfile( working ):
+                os.remove( working )
+            f = open( saved, 'w' )
+            f.write( text )
+            f.close()
+
+    done = os.path.getsize( working ) if os.path.isfile( working ) else 0
+    if done:
+        logging.info( "%s: resuming after %i bytes", filename, done )
+
+    dst = open( working, 'ab' )
+    position = 0
+    for start, end in ranges:
+        size = None if end is None else end - start
+        if size is not None and position + size <= done:
+            position += size
+            continue
+        skip = max( 0, done - position )
+        n = fetch( url, dst, start + skip, end )
+        dst.flush()
+        position += skip + n
+    dst.close()
+
+    count = messages( working )
+    if expected is not None and count != expected:
+        raise IOError( "{}: {} GRIB messages, expected {}".format( filename, count, expected ) )
+
+    os.rename( working, filename )
+    if os.path.isfile( saved ):
+        os.remove( saved )
+    logging.info( "%s: %i messages, %i bytes", filename, count, os.path.getsize( filename ) )
+    return os.path.getsize( filename )
+
+def download_star( args ):
+    """Helper for Pool.map, which only passes a single argument; returns an error message instead of raising"""
+    try:
+        download( *args )
+        return None
+    except Exception as e:
+        logging.error( "%s: %s", args[1], e )
+        return "{}: {}".format( args[1], e )
+
+def serve( directory, port ):
+    """Stand-in for the NCEP server: serve the files in a directory over HTTP, with support for Range requests"""
+    import SimpleHTTPServer
+    import SocketServer
+
+    class RangeHandler( SimpleHTTPServer.SimpleHTTPRequestHandler ):
+        def send_head( self ):
+            match = re.match( r"bytes=(\d+)-(\d*)$", self.headers.get( 'Range', '' ) )
+            path = self.translate_path( self.path )
+            if not match or not os.path.isfile( path ):
+                return SimpleHTTPServer.SimpleHTTPRequestHandler.send_head( self )
+
+            size = os.path.getsize( path )
+            first = int( match.group(1) )
+            last = min( int( match.group(2) ), size - 1 ) if match.group(2) else size - 1
+            if first >= size:
+                self.send_error( 416, "Requested range not satisfiable" )
+                return None
+
+            f = open( path, 'rb' )
+            f.seek( first )
+            self.send_response( 206 )
+            self.send_header( "Content-type", "application/octet-stream" )
+            self.send_header( "Content-Range", "bytes {}-{}/{}".format( first, last, size ) )
+            self.send_header( "Content-Length", str( last - first + 1 ) )
+            self.end_headers()
+            self.remaining = last - first + 1
+            return f
+
+        def copyfile( self, source, outputfile ):
+            if not hasattr( self, 'remaining' ):
+                return SimpleHTTPServer.SimpleHTTPRequestHandler.copyfile( self, source, outputfile )
+            while self.remaining > 0:
+                data = source.read( min( BUFSIZE, self.remaining ) )
+                if not data:
+                    break
+                outputfile.write( data )
+                self.remaining -= len( data )
+
+    os.chdir( directory )
+    SocketServer.ThreadingTCPServer.allow_reuse_address = True
+    server = SocketServer.ThreadingTCPServer( ( '', port ), RangeHandler )
+    logging.info( "Serving %s on port %i", directory, port )
+    server.serve_forever()
+
+def main():
+    parser = argparse.ArgumentParser(description="Download GFS boundaries concurrently, only the fields used by ungrib.exe")
+    parser.add_argument('date', type=str, nargs='?', help="Cycle as YYYYMMDDHH, like 2015060300")
+    parser.add_argument('directory', type=str, nargs='?', help="Output directory, created if needed")
+    parser.add_argument('-f', '--first', type=int, help="First forecast hour, default is 0", default=0)
+    parser.add_argument('-l', '--last', type=int, help="Last forecast hour, default is 48", default=48)
+    parser.add_argument('-s', '--step', type=int, help="Hours between forecasts, default is 6", default=6)
+    parser.add_argument('-n', '--processes', type=int, help="Number of concurrent downloads, default is 4", default=4)
+    parser.add_argument('-u', '--url', type=str, help="URL of the forecast files, with {date} the cycle and {hour} the forecast hour; default is " + URL, default=URL)
+    parser.add_argument('--full', action='store_true', help="Download the whole files, not only the fields used by ungrib.exe")
+    parser.add_argument('--serve', type=str, metavar='DIR', help="Serve the GRIB files in DIR with Range support, as a stand-in for NCEP")
+    parser.add_argument('--port', type=int, help="Port for --serve, default is 8000", default=8000)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve( args.serve, args.port )
+        return
+
+    if not args.date or not args.directory:
+        parser.error( "Give the cycle date and output directory" )
+
+    date = datetime.datetime.strptime( args.date, '%Y%m%d%H' )
+    if not os.path.isdir( args.directory ):
+        os.makedirs( args.directory )
+
+    fields = None if args.full else FIELDS
+    hours = range( args.first, args.last + 1, args.step )
+    jobs = [ ( args.url.format( date=date, hour=h ), os.path.join( args.directory, FILENAME.format( date=date, hour=h ) ), fields ) for h in hours ]
+
+    pool = ThreadPool( min( args.processes, len(jobs) ) )
+    errors = [ e for e in pool.map( download_star, jobs ) if e ]
+    pool.close()
+    pool.join()
+
+    if errors:
+        logging.error( "%i of %i forecast hours failed, run again to resume", len(errors), len(jobs) )
+        sys.exit( 1 )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+"""Store of downloaded GFS cycles on a fast home disk, with a quota, backed by an archive tier.
+
+Cycles are directories named like 2015060300 in the home store and in the archive tier.
+The store keeps the size and last use of each cycle in a state file; when the home store
+is over its quota, the least recently used cycles are moved to the archive tier,
+or deleted if the archive tier already has an identical copy.
+
+    gfs_store.py add 2015060300        register a downloaded cycle, and enforce the quota
+    gfs_store.py get 2015060300        print the local path, recalled from the archive tier if needed
+    gfs_store.py evict                 enforce the quota
+    gfs_store.py status
+"""
+
+import argparse
+import contextlib
+import fcntl
+import json
+import logging
+import os
+import shutil
+import sys
+import time
+
+import archive
+
+logging.basicConfig(level=logging.INFO)
+
+HOTDIR     = os.path.expanduser( os.environ.get( 'GFSHOT', '~/GFS' ) )
+ARCHIVEDIR = os.environ.get( 'DATDIR', '/projects/0/sitc/GFS' )
+QUOTA      = os.environ.get( 'GFSQUOTA', '100G' )
+
+# state of the store, next to the cycles
+STATE = ".gfs_store.json"
+
+UNITS = { 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4 }
+
+
+def parse_size( size ):
+    """Size in bytes from a string like 500M or 100G"""
+    size = size.strip().upper()
+    if size[-1] in UNITS:
+        return int( float( size[:-1] ) * UNITS[size[-1]] )
+    return int( size )
+
+def files( path ):
+    """Dictionary of file name: size of a cycle directory; working files of downloads are left out"""
+    if not os.path.isdir( path ):
+        return {}
+    return dict( [ ( name, os.path.getsize( os.path.join( path, name ) ) ) for name in os.listdir( path )
+                   if os.path.isfile( os.path.join( path, name ) ) and '.working' not in name ] )
+
+@contextlib.contextmanager
+def locked( hotdir ):
+    """Lock the store, so concurrent jobs do not evict or recall the same cycle"""
+    if not os.path.isdir( hotdir ):
+        os.makedirs( hotdir )
+    f = open( os.path.join( hotdir, STATE + ".lock" ), 'a' )
+    fcntl.flock( f.fileno(), fcntl.LOCK_EX )
+    try:
+        yield
+    finally:
+        fcntl.flock( f.fileno(), fcntl.LOCK_UN )
+        f.close()
+
+class Store( object ):
+    """GFS cycles in the home store and the archive tier; use within locked()"""
+
+    def __init__( self, hotdir=HOTDIR, archivedir=ARCHIVEDIR, quota=QUOTA ):
+        self.hotdir = hotdir
+        self.archivedir = archivedir
+        self.quota = parse_size( quota )
+        self.statefile = os.path.join( hotdir, STATE )
+        self.state = {}
+        if os.path.isfile( self.statefile ):
+            self.state = json.load( open( self.statefile, 'r' ) )
+
+        # cycles put in the home store by hand, or downloaded before the store was used
+        for name in os.listdir( hotdir ):
+            if name not in self.state and name.isdigit() and os.path.isdir( os.path.join( hotdir, name ) ):
+                self.state[name] = { 'used': os.path.getmtime( os.path.join( hotdir, name ) ) }
+        for cycle in self.state.keys():
+            if not os.path.isdir( os.path.join( hotdir, cycle ) ):
+                del self.state[cycle]
+            else:
+                self.state[cycle]['size'] = sum( files( os.path.join( hotdir, cycle ) ).values() )
+
+    def save( self ):
+        """Write the state under a temporary name and rename it"""
+        working = self.statefile + ".working"
+        json.dump( self.state, open( working, 'w' ), indent=1, sort_keys=True )
+        os.rename( working, self.statefile )
+
+    def usage( self ):
+        """Bytes used by the home store"""
+        return sum( [ c['size'] for c in self.state.values() ] )
+
+    def archived( self, cycle ):
+        """True if the archive tier has all files of a cycle in the home store, with the same sizes"""
+        hot = files( os.path.join( self.hotdir, cycle ) )
+        cold = files( os.path.join( self.archivedir, cycle ) )
+        return all( [ cold.get( name ) == size for name, size in hot.items() ] )
+
+    def touch( self, cycle ):
+        """Mark a cycle in the home store as used now"""
+        self.state[cycle] = { 'used': time.time(), 'size': sum( files( os.path.join( self.hotdir, cycle ) ).values() ) }
+
+    def move( self, cycle, source, target ):
+        """Copy the files of a cycle between tiers, each to a temporary name and renamed, and remove the source"""
+        src = os.path.join( source, cycle )
+        dst = os.path.join( target, cycle )
+        if not os.path.isdir( dst ):
+            os.makedirs( dst )
+        have = files( dst )
+        for name, size in sorted( files( src ).items() ):
+            if have.get( name ) != size:
+                archive.copy( os.path.join( src, name ), os.path.join( dst, name ) )
+        shutil.rmtree( src )
+
+    def evict( self, keep=[] ):
+        """Move the least recently used cycles to the archive tier until the home store is within the quota.
+        Cycles in keep are not evicted. Returns the evicted cycles"""
+        evicted = []
+        for cycle in sorted( self.state.keys(), key=lambda c: self.state[c]['used'] ):
+            if self.usage() <= self.quota:
+                break
+            if cycle in keep:
+                continue
+            if self.archived( cycle ):
+                logging.info( "Evicting %s, already in %s", cycle, self.archivedir )
+                shutil.rmtree( os.path.join( self.hotdir, cycle ) )
+            else:
+                logging.info( "Evicting %s to %s", cycle, self.archivedir )
+                self.move( cycle, self.hotdir, self.archivedir )
+            del self.state[cycle]
+            evicted.append( cycle )
+
+        if self.usage() > self.quota:
+            logging.warn( "%s uses %i bytes, over the quota of %i", self.hotdir, self.usage(), self.quota )
+        return evicted
+
+    def add( self, cycle ):
+        """Register a cycle downloaded to the home store, and enforce the quota"""
+        if not os.path.isdir( os.path.join( self.hotdir, cycle ) ):
+            raise IOError( "Cycle {} is not in {}".format( cycle, self.hotdir ) )
+        self.touch( cycle )
+        self.evict( keep=[ cycle ] )
+
+    def get( self, cycle ):
+        """Local path of a cycle; a cycle only in the archive tier is copied back to the home store.
+        Returns the path, or None if the cycle is in neither tier"""
+        if not os.path.isdir( os.path.join( self.hotdir, cycle ) ):
+            if not os.path.isdir( os.path.join( self.archivedir, cycle ) ):
+                return None
+            logging.info( "Recalling %s from %s", cycle, self.archivedir )
+            src = os.path.join( self.archivedir, cycle )
+            dst = os.path.join( self.hotdir, cycle )
+            working = dst + ".working"
+            if os.path.isdir( working ):
+                shutil.rmtree( working )
+            os.makedirs( working )
+            for name in sorted( files( src ).keys() ):
+                archive.copy( os.path.join( src, name ), os.path.join( working, name ) )
+            os.rename( working, dst )
+        self.touch( cycle )
+        self.evict( keep=[ cycle ] )
+        return os.path.join( self.hotdir, cycle )
+
+def main():
+    parser = argparse.ArgumentParser(description="Store of GFS cycles on the home disk with a quota, backed by an archive tier")
+    parser.add_argument('command', choices=[ 'add', 'get', 'evict', 'status' ])
+    parser.add_argument('cycle', type=str, nargs='?', help="Cycle as YYYYMMDDHH, like 2015060300")
+    parser.add_argument('--hot', type=str, help="Home store, default is " + HOTDIR, default=HOTDIR)
+    parser.add_argument('--archive', type=str, help="Archive tier, default is " + ARCHIVEDIR, default=ARCHIVEDIR)
+    parser.add_argument('-q', '--quota', type=str, help="Quota of the home store, like 500M or 100G; default is " + QUOTA, default=QUOTA)
+    args = parser.parse_args()
+
+    if args.command in [ 'add', 'get' ] and not args.cycle:
+        parser.error( "Give the cycle" )
+
+    with locked( args.hot ):
+        store = Store( args.hot, args.archive, args.quota )
+        if args.command == 'add':
+            store.add( args.cycle )
+        elif args.command == 'get':
+            path = store.get( args.cycle )
+            if path is None:
+                store.save()
+                logging.error( "Cycle %s not found in %s or %s", args.cycle, args.hot, args.archive )
+                sys.exit( 1 )
+            print path
+        elif args.command == 'evict':
+            store.evict()
+        elif args.command == 'status':
+            for cycle in sorted( store.state.keys() ):
+                print "{} {:12d} {} {}".format( cycle, store.state[cycle]['size'],
+                                                time.strftime( '%Y-%m-%d %H:%M', time.localtime( store.state[cycle]['used'] ) ),
+                                                "archived" if store.archived( cycle ) else "" )
+            print "{} of {} bytes used".format( store.usage(), store.quota )
+        store.save()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+import f90nml
+import netCDF4 as cdf
+import numpy as np
+import datetime
+import argparse
+import math
+import os
+import sys
+
+from nestwrf import fixgeogrid, fixshare
+from tslist import read_tslist, locate
+
+# Typical number of fields in a wrfout file, per frame, used when no sample file is given:
+# 3-D fields on full model levels, 2-D surface fields, and 3-D soil fields
+NFIELDS3D   = 16
+NFIELDS2D   = 130
+NFIELDSSOIL = 5
+
+# Width of a line in the TS and profile files, in characters including the newline
+# TS:      id, ts_hour, id_tsloc, ix, iy (i2,f13.6,i5,i5,i5) followed by 16 values (f14.5)
+# profile: ts_hour (f13.6) followed by max_ts_level values (f14.5)
+TSLINE       = 30 + 16 * 14 + 1
+PROFILEVALUE = 14
+PROFILES     = ['UU', 'VV', 'TH', 'QV', 'PH']
+
+# Compressed size relative to the original, for netCDF4 with deflate and zipped ascii
+NC4RATIO = 0.45
+ZIPRATIO = 0.30
+
+MB = 1024.0 ** 2
+GB = 1024.0 ** 3
+
+
+def aslist( a, n ):
+    """Make sure a namelist variable is a list of at least n elements"""
+    if type(a) != type([]):
+        a = [ a ]
+    return a + [ a[-1] ] * ( n - len(a) )
+
+def runlength( namelist ):
+    """Length of the run in seconds per domain, from the start and end dates in the time_control section"""
+    tc = namelist['time_control']
+    ndoms = namelist['domains']['max_dom']
+
+    length = [0] * ndoms
+    for d in range( 0, ndoms ):
+        start = datetime.datetime( *[ aslist( tc['start_' + k], ndoms )[d] for k in ['year', 'month', 'day', 'hour', 'minute', 'second'] ] )
+        end   = datetime.datetime( *[ aslist( tc['end_' + k],   ndoms )[d] for k in ['year', 'month', 'day', 'hour', 'minute', 'second'] ] )
+        length[d] = ( end - start ).total_seconds()
+    return length
+
+def timesteps( namelist ):
+    """Model time step in seconds per domain"""
+    domains = namelist['domains']
+    ndoms = domains['max_dom']
+    parent_id = aslist( domains['parent_id'], ndoms )
+    ratio = aslist( domains['parent_time_step_ratio'], ndoms )
+
+    dt = [0] * ndoms
+    dt[0] = domains['time_step']
+    if domains.get( 'time_step_fract_num', 0 ):
+        dt[0] += domains['time_step_fract_num'] / float( domains['time_step_fract_den'] )
+    for d in range( 1, ndoms ):
+        dt[d] = dt[ parent_id[d] - 1 ] / float( ratio[d] )
+    return dt
+
+def calibrate( filename ):
+    """Count the number of 3-D, 2-D, and soil fields per frame in a sample wrfout file,
+    in units of full fields of 4 byte floats"""
+    ncfile = cdf.Dataset( filename, 'r' )
+
+    nx = len( ncfile.dimensions['west_east'] )
+    ny = len( ncfile.dimensions['south_north'] )
+    nz = len( ncfile.dimensions['bottom_top'] )
+    nsoil = len( ncfile.dimensions['soil_layers_stag'] ) if 'soil_layers_stag' in ncfile.dimensions else 1
+
+    n3d = n2d = nsoilf = 0.0
+    for v in ncfile.variables.values():
+        if len(v.dimensions) == 0 or v.dimensions[0] != 'Time':
+            continue
+        size = np.prod( v.shape[1:] ) * v.dtype.itemsize / 4.0
+        if 'bottom_top' in v.dimensions or 'bottom_top_stag' in v.dimensions:
+            n3d += size / ( nx * ny * nz )
+        elif 'soil_layers_stag' in v.dimensions:
+            nsoilf += size / ( nx * ny * nsoil )
+        else:
+            n2d += size / ( nx * ny )
+
+    ncfile.close()
+    return n3d, n2d, nsoilf
+
+def estimate( namelist, nstations, walltime, fields=(NFIELDS3D, NFIELDS2D, NFIELDSSOIL) ):
+    """Estimate the output of a WRF run per domain.
+    nstations is the number of time series stations per domain.
+    Returns a list of dictionaries per domain with sizes in bytes and bandwidth in bytes per second"""
+
+    tc = namelist['time_control']
+    domains = namelist['domains']
+    ndoms = domains['max_dom']
+    n3d, n2d, nsoil = fields
+
+    e_we = aslist( domains['e_we'], ndoms )
+    e_sn = aslist( domains['e_sn'], ndoms )
+    e_vert = aslist( domains['e_vert'], ndoms )
+    history_interval = aslist( tc['history_interval'], ndoms )
+    frames_per_outfile = aslist( tc.get( 'frames_per_outfile', 1 ), ndoms )
+    soil_layers = namelist['physics'].get( 'num_soil_layers', 4 ) if 'physics' in namelist else 4
+    max_ts_level = domains.get( 'max_ts_level', 15 )
+    ts_buf_size = domains.get( 'ts_buf_size', 200 )
+
+    length = runlength( namelist )
+    dt = timesteps( namelist )
+
+    result = []
+    for d in range( 0, ndoms ):
+        nx = e_we[d] - 1
+        ny = e_sn[d] - 1
+        nz = e_vert[d] - 1
+
+        frame = 4 * nx * ny * ( n3d * nz + n2d + nsoil * soil_layers )
+        frames = int( length[d] // ( history_interval[d] * 60 ) ) + 1
+        files = int( math.ceil( frames / float( frames_per_outfile[d] ) ) )
+
+        # time series are written every time step
+        steps = int( length[d] // dt[d] )
+        profileline = 13 + max_ts_level * PROFILEVALUE + 1
+        ts = nstations[d] * steps * TSLINE
+        profile = nstations[d] * steps * profileline * len(PROFILES)
+        flushes = int( math.ceil( steps / float( ts_buf_size ) ) ) if nstations[d] else 0
+
+        result.append( {
+            'frame':     frame,
+            'frames':    frames,
+            'files':     files,
+            'wrfout':    frame * frames,
+            'nc4':       frame * frames * NC4RATIO,
+            'ts':        ts,
+            'profile':   profile,
+            'zipped':    ( ts + profile ) * ZIPRATIO,
+            'flushes':   flushes,
+            'bandwidth': ( frame * frames + ts + profile ) / ( walltime * 3600.0 ),
+        } )
+
+    return result
+
+def printestimate( result, nstations ):
+    """Print the estimated output per domain and the totals"""
+    print
+    print "Domain  stations  frames files    frame MB   wrfout GB   netCDF4 GB    TS GB  profile GB  zipped GB  flushes  MB/s"
+    for d, r in enumerate( result ):
+        print "d{:02}   {:>9} {:>7} {:>5} {:>11.1f} {:>11.2f} {:>12.2f} {:>8.3f} {:>11.3f} {:>10.3f} {:>8} {:>5.2f}".format(
+            d + 1, nstations[d], r['frames'], r['files'], r['frame'] / MB, r['wrfout'] / GB, r['nc4'] / GB,
+            r['ts'] / GB, r['profile'] / GB, r['zipped'] / GB, r['flushes'], r['bandwidth'] / MB )
+
+    run = sum( [ r['wrfout'] + r['ts'] + r['profile'] for r in result ] )
+    archive = sum( [ r['nc4'] + r['zipped'] for r in result ] )
+    print
+    print "Run directory   {:>8.2f} GB".format( run / GB )
+    print "Archive         {:>8.2f} GB".format( archive / GB )
+
+    return run, archive
+
+def main():
+    parser = argparse.ArgumentParser(description="Estimate the output volume and I/O bandwidth of a WRF run")
+    parser.add_argument("-t", "--tslist", type=str, help="The tslist file, defaults to tslist in the current directory", default="tslist" )
+    parser.add_argument("-w", "--wps", type=str, help="namelist.wps to find the stations per domain, otherwise all stations are assumed to be in all domains" )
+    parser.add_argument("-s", "--sample", type=str, help="A wrfout file used to count the number of fields per frame" )
+    parser.add_argument("--walltime", type=float, help="Expected wall clock time of the run in hours, default is 12", default=12.0 )
+    parser.add_argument("--budget", type=float, help="Disk space available in GB for the run directory" )
+    parser.add_argument("--check", type=str, help="Use the free space on this directory as the budget" )
+    parser.add_argument('namelist', metavar="namelist",  type=str, nargs=1, help="WRF namelist.input")
+    args = parser.parse_args()
+
+    namelist = f90nml.read( args.namelist[0] )
+    ndoms = namelist['domains']['max_dom']
+
+    # WRF only reads the first max_ts_locs stations from the tslist
+    nstations = [0] * ndoms
+    if os.path.isfile( args.tslist ):
+        names, prefixes, lats, lons = read_tslist( args.tslist )
+        max_ts_locs = namelist['domains'].get( 'max_ts_locs', 5 )
+        if len(names) > max_ts_locs:
+            print "Warning: only {} of {} stations in {} will be used (max_ts_locs)".format( max_ts_locs, len(names), args.tslist )
+        lats = lats[0:max_ts_locs]
+        lons = lons[0:max_ts_locs]
+
+        if args.wps:
+            wps = f90nml.read( args.wps )
+            wps['geogrid'] = fixgeogrid( wps['geogrid'] )
+            wps['share']   = fixshare( wps['share'] )
+            inside, i, j, innermost = locate( wps, lats, lons )
+            nstations = list( inside.sum( axis=1 ) )
+        else:
+            nstations = [ len(lats) ] * ndoms
+
+    fields = (NFIELDS3D, NFIELDS2D, NFIELDSSOIL)
+    if args.sample:
+        fields = calibrate( args.sample )
+
+    io_form = aslist( namelist['time_control'].get( 'io_form_history', 2 ), 1 )[0]
+    if io_form not in [2, 11, 102]:
+        print "Warning: io_form_history = {} is not netCDF, sizes are a rough estimate".format( io_form )
+
+    result = estimate( namelist, nstations, args.walltime, fields )
+    run, archive = printestimate( result, nstations )
+
+    budget = args.budget
+    if args.check:
+        stat = os.statvfs( args.check )
+        budget = stat.f_bavail * stat.f_frsize / GB
+    if budget is not None:
+        print "Budget          {:>8.2f} GB".format( budget )
+        if run / GB > budget:
+            print "Not enough disk space for this run"
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+"""Timing and I/O metrics of the forecast tools, written as JSON lines to a metrics file per run.
+
+    import metrics
+    with metrics.phase( 'parse' ) as p:
+        ...
+        p.add( rows=len( lines ), read=metrics.filesize( filename ) )
+
+Each phase writes one line with the tool, phase, wallclock and cpu time, bytes read and written,
+rows parsed and the peak memory of the process. Metrics are only written when FORECAST_METRICS
+is set to a file name; forecast.sh sets it to a file per run date, like ~/.forecast_metrics/2015-06-10.jsonl
+
+    metrics.py summary ~/.forecast_metrics/2015-06-10.jsonl
+
+compares a run with the median of the runs of the previous week, in the files next to it.
+"""
+
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import resource
+import sys
+import time
+
+# metrics file of the current run, no metrics are written if not set
+METRICS = os.environ.get( 'FORECAST_METRICS' )
+
+# phases taking this much longer than the median are marked
+SLOWER = 1.5
+
+
+class Phase( object ):
+    """Counters of a phase"""
+
+    def __init__( self, name ):
+        self.name = name
+        self.read = 0
+        self.written = 0
+        self.rows = 0
+
+    def add( self, read=0, written=0, rows=0 ):
+        """Count bytes read, bytes written and rows parsed"""
+        self.read += read
+        self.written += written
+        self.rows += rows
+
+def filesize( filename ):
+    """Size of a file in bytes, 0 if it does not exist"""
+    try:
+        return os.path.getsize( filename )
+    except OSError:
+        return 0
+
+def emit( record, filename=None ):
+    """Append a record to the metrics file; a single short write, so concurrent tools do not mix lines"""
+    filename = filename or METRICS
+    if not filename:
+        return
+    f = open( filename, 'a' )
+    f.write( json.dumps( record, sort_keys=True ) + "\n" )
+    f.close()
+
+@contextlib.contextmanager
+def phase( name, tool=None ):
+    """Measure a phase of a tool; yields a Phase to count bytes and rows"""
+    p = Phase( name )
+    start = time.time()
+    cpu = time.clock()
+    try:
+        yield p
+    finally:
+        if METRICS:
+            emit( { 'time': datetime.datetime.now().strftime( '%Y-%m-%d_%H:%M:%S' ),
+                    'tool': tool or os.path.basename( sys.argv[0] ),
+                    'phase': name,
+                    'pid': os.getpid(),
+                    'wall': round( time.time() - start, 4 ),
+                    'cpu': round( time.clock() - cpu, 4 ),
+                    'read': p.read,
+                    'written': p.written,
+                    'rows': p.rows,
+                    'maxrss': resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss } )
+
+def median( values ):
+    """Median of a non-empty list"""
+    values = sorted( values )
+    middle = len( values ) // 2
+    if len( values ) % 2:
+        return values[middle]
+    return ( values[middle - 1] + values[middle] ) / 2.0
+
+def read( filename ):
+    """Totals per (tool, phase) of a metrics file: wall, cpu, read, written, rows summed, maxrss the maximum"""
+    totals = {}
+    if not os.path.isfile( filename ):
+        return totals
+    for line in open( filename, 'r' ):
+        try:
+            record = json.loads( line )
+        except ValueError:
+            continue
+        t = totals.setdefault( ( record['tool'], record['phase'] ), { 'wall': 0.0, 'cpu': 0.0, 'read': 0, 'written': 0, 'rows': 0, 'maxrss': 0 } )
+        for key in [ 'wall', 'cpu', 'read', 'written', 'rows' ]:
+            t[key] += record.get( key, 0 )
+        t['maxrss'] = max( t['maxrss'], record.get( 'maxrss', 0 ) )
+    return totals
+
+def previous( filename, days=7 ):
+    """Metrics files of the runs of the previous days, named like YYYY-MM-DD.jsonl next to the run"""
+    directory, name = os.path.split( os.path.abspath( filename ) )
+    base, extension = os.path.splitext( name )
+    try:
+        date = datetime.datetime.strptime( base, '%Y-%m-%d' )
+    except ValueError:
+        return []
+    names = [ os.path.join( directory, ( date - datetime.timedelta( days=d ) ).strftime( '%Y-%m-%d' ) + extension )
+              for d in range( 1, days + 1 ) ]
+    return [ n for n in names if os.path.isfile( n ) ]
+
+def summary( filename, history ):
+    """Print the totals of a run next to the median of the runs in history"""
+    current = read( filename )
+    past = [ read( h ) for h in history ]
+
+    print "{:<20} {:<12} {:>9} {:>9} {:>7} {:>10} {:>10} {:>10} {:>9}".format( 'tool', 'phase', 'wall (s)', 'median', 'ratio', 'read (MB)', 'write (MB)', 'rows', 'rss (MB)' )
+    for key in sorted( current.keys() ):
+        t = current[key]
+        walls = [ p[key]['wall'] for p in past if key in p ]
+        middle = median( walls ) if walls else None
+        ratio = t['wall'] / middle if middle else None
+        print "{:<20} {:<12} {:>9.2f} {:>9} {:>7} {:>10.1f} {:>10.1f} {:>10} {:>9.0f} {}".format(
+            key[0], key[1], t['wall'], "{:.2f}".format( middle ) if middle is not None else '-', "{:.2f}".format( ratio ) if ratio else '-',
+            t['read'] / 1e6, t['written'] / 1e6, t['rows'], t['maxrss'] / 1024.0, "SLOW" if ratio and ratio > SLOWER else "" )
+    print "{} runs in the history".format( len( history ) )
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize the metrics of a run, compared to the previous week")
+    parser.add_argument('command', choices=[ 'summary' ])
+    parser.add_argument('metrics', type=str, nargs='?', help="Metrics file of the run, default is FORECAST_METRICS", default=METRICS)
+    parser.add_argument('-d', '--days', type=int, help="Number of previous days to compare with, default is 7", default=7)
+    parser.add_argument('--history', type=str, nargs='+', help="Metrics files to compare with, default is those of the previous days next to the run")
+    args = parser.parse_args()
+
+    if not args.metrics:
+        parser.error( "Give the metrics file" )
+
+    summary( args.metrics, args.history or previous( args.metrics, args.days ) )
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,8 @@
 import f90nml
 import argparse
 
+import metrics
+
 def main(args):
     # check argparse arguments and call the appropriate function
     if args.get:
@@ -21,7 +23,9 @@ def namelist_get(filename, getvariable, verbose=False):
         getvariable: GROUP_NAME:VARIABLE_NAME to get from namelist
         verbose: optional boolean argument if results should be printed to screen
     '''
-    namelist = f90nml.read( filename )
+    with metrics.phase( 'parse' ) as p:
+        namelist = f90nml.read( filename )
+        p.add( read=metrics.filesize( filename ) )
     path = getvariable.split ( ':' )
     crumb = namelist
     while len(path) > 1:
@@ -45,7 +49,9 @@ def namelist_set(filename, setvariable, setvalue, verbose=False):
         setvalue: value to set setvariable to
         verbose: optional boolean argument if results should be printed to screen
     '''
-    namelist = f90nml.read( filename )
+    with metrics.phase( 'parse' ) as p:
+        namelist = f90nml.read( filename )
+        p.add( read=metrics.filesize( filename ) )
     path = setvariable.split ( ':' )
     crumb = namelist
     while len(path) > 1:
@@ -83,7 +89,9 @@ def namelist_set(filename, setvariable, setvalue, verbose=False):
     else:
         print "Unsupported type: ", t
     # write namelist variable
-    f90nml.write( namelist, filename, force=True )
+    with metrics.phase( 'write' ) as p:
+        f90nml.write( namelist, filename, force=True )
+        p.add( written=metrics.filesize( filename ) )
 
 
 if __name__ == "__main__":
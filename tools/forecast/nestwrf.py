@@ -3,9 +3,12 @@
 
 import f90nml
 import pyproj
+import numpy as np
 import argparse
 import sys
 
+import metrics
+
 #
 #      500m
 #  X . . . . X . . . . X . . . . X   e_we = 4
@@ -90,6 +93,35 @@ def parsenl( namelist ):
 
     return west, east, north, south, dx, dy, lambert
 
+def latlon_to_ij( namelist, lats, lons ):
+    """Find the WRF grid indices of the points (lats, lons) in degrees for all domains at once.
+    The points are projected in a single call, and the indices for all domains are computed by broadcasting,
+    so the lookup costs the same per point no matter how many domains or points there are.
+    Returns:
+    fractional mass point indices fi, fj (fortran style, starting at 1) as arrays of shape (ndoms, npoints),
+    and the number of mass points nx, ny per domain (ie. e_we - 1, e_sn - 1) as arrays of shape (ndoms, 1)"""
+
+    west, east, north, south, dx, dy, projection = parsenl( namelist )
+    geogrid = namelist['geogrid']
+    ndoms = namelist['share']['max_dom']
+
+    x, y = projection( np.atleast_1d( np.asarray( lons, dtype=float ) ),
+                       np.atleast_1d( np.asarray( lats, dtype=float ) ) )
+
+    west = np.asarray( west, dtype=float )[:,np.newaxis]
+    south = np.asarray( south, dtype=float )[:,np.newaxis]
+    dx = np.asarray( dx, dtype=float )[:,np.newaxis]
+    dy = np.asarray( dy, dtype=float )[:,np.newaxis]
+
+    # west, south are the outer (staggered) edges of the grid, mass point i is at west + (i - 0.5) * dx
+    fi = ( x[np.newaxis,:] - west ) / dx + 0.5
+    fj = ( y[np.newaxis,:] - south ) / dy + 0.5
+
+    nx = np.asarray( geogrid['e_we'][0:ndoms] )[:,np.newaxis] - 1
+    ny = np.asarray( geogrid['e_sn'][0:ndoms] )[:,np.newaxis] - 1
+
+    return fi, fj, nx, ny
+
 def printgrids(namelist):
     """Print the domains as defined in the WRF namelist, listing domain extend and center"""
     west, east, north, south, dx, dy, projection = parsenl( namelist )
@@ -227,12 +259,129 @@ def add_rectangular_nest( namelist, parent_id, parent_grid_ratio, newn, neww, ne
 
     addnest( namelist, parent_id, parent_grid_ratio, starti, startj, e_we, e_sn)
 
+def domaincost( namelist ):
+    """Estimate the relative compute cost per domain of a WRF namelist, as
+    grid points * levels * time steps per parent time step.
+    Uses e_vert and parent_time_step_ratio from the 'domains' section of a namelist.input;
+    for a namelist.wps all domains are assumed to have the same number of levels, and
+    parent_time_step_ratio is assumed to be equal to parent_grid_ratio.
+    Returns:
+    list of costs per domain, in units of d01 grid point updates"""
+
+    def aslist( a, n ):
+        """Make sure a namelist variable is a list of at least n elements"""
+        if type(a) != type([]):
+            a = [ a ]
+        return a + [ a[-1] ] * ( n - len(a) )
+
+    if 'domains' in namelist:
+        grid = namelist['domains']
+        ndoms = grid['max_dom']
+        e_vert = aslist( grid['e_vert'], ndoms )
+        ratio = aslist( grid['parent_time_step_ratio'], ndoms )
+    else:
+        grid = namelist['geogrid']
+        ndoms = namelist['share']['max_dom']
+        e_vert = [ 2 ] * ndoms
+        ratio = aslist( grid['parent_grid_ratio'], ndoms )
+
+    e_we = aslist( grid['e_we'], ndoms )
+    e_sn = aslist( grid['e_sn'], ndoms )
+    parent_id = aslist( grid['parent_id'], ndoms )
+
+    cost = [0] * ndoms
+    substeps = [1] * ndoms
+    for d in range( 0, ndoms ):
+        if d > 0:
+            p = parent_id[d] - 1 # fortran to c indexing
+            substeps[d] = substeps[p] * ratio[d]
+        cost[d] = (e_we[d] - 1) * (e_sn[d] - 1) * (e_vert[d] - 1) * substeps[d]
+
+    return cost
+
+def printcost( namelist ):
+    """Print the estimated relative compute cost per domain"""
+    cost = domaincost( namelist )
+    total = float( sum(cost) )
+
+    print
+    print "Domain          cost     fraction"
+    for d in range( 0, len(cost) ):
+        print "d{:02}      {:>10.3g} {:>11.1f}%".format( d + 1, cost[d] / float(cost[0]), 100.0 * cost[d] / total )
+    print "total    {:>10.3g}".format( total / cost[0] )
+
+def fit_nest( namelist, parent_id, parent_grid_ratio, lats, lons, margin=0.0, spacing=5, polygon=False ):
+    """Find the smallest nest on the parent grid that covers all points (lats, lons) in degrees
+    with a margin (km) around them. With polygon=True the points are the vertices of a closed polygon,
+    and the edges are densified before projecting them, as they are not straight on the lambert grid.
+    The nest must stay at least 'spacing' parent grid points away from the parent boundary.
+    Returns:
+    i_parent_start, j_parent_start, e_we, e_sn"""
+
+    west, east, north, south, dx, dy, projection = parsenl( namelist )
+    geogrid = namelist['geogrid']
+
+    p = parent_id - 1 # fortran to c indexing
+
+    lats = np.asarray( lats, dtype=float )
+    lons = np.asarray( lons, dtype=float )
+    if polygon:
+        f = np.linspace( 0.0, 1.0, 20, endpoint=False )[:,np.newaxis]
+        lats = ( lats + f * ( np.roll( lats, -1 ) - lats ) ).ravel()
+        lons = ( lons + f * ( np.roll( lons, -1 ) - lons ) ).ravel()
+
+    x, y = projection( lons, lats )
+    xs = x.min() - margin * 1000.0
+    xe = x.max() + margin * 1000.0
+    ys = y.min() - margin * 1000.0
+    ye = y.max() + margin * 1000.0
+
+    # Translate to WRF grid coordinates, including the fortran index offset,
+    # rounding outwards so all points are covered
+    starti = int( np.floor( (xs - west[p])  / dx[p] ) ) + 1
+    startj = int( np.floor( (ys - south[p]) / dy[p] ) ) + 1
+    endi   = int( np.ceil(  (xe - west[p])  / dx[p] ) ) + 1
+    endj   = int( np.ceil(  (ye - south[p]) / dy[p] ) ) + 1
+
+    if starti < 1 + spacing or startj < 1 + spacing or \
+       endi > geogrid['e_we'][p] - spacing or endj > geogrid['e_sn'][p] - spacing:
+        raise ValueError( "Nest ({}, {}) - ({}, {}) does not fit in parent domain {}".format( starti, startj, endi, endj, parent_id ) )
+
+    # WRF requirement on nested grids
+    e_we = int( (endi - starti) * parent_grid_ratio + 1 )
+    e_sn = int( (endj - startj) * parent_grid_ratio + 1 )
+
+    return starti, startj, e_we, e_sn
+
+def add_fitted_nest( namelist, parent_id, parent_grid_ratio, lats, lons, margin=0.0, polygon=False ):
+    """Add the smallest nested grid covering the points (lats, lons) in degrees, with a margin in km"""
+
+    starti, startj, e_we, e_sn = fit_nest( namelist, parent_id, parent_grid_ratio, lats, lons, margin=margin, polygon=polygon )
+
+    print "i_parent_start: ", starti
+    print "j_parent_start: ", startj
+    print "e_we:           ", e_we
+    print "e_sn:           ", e_sn
+
+    addnest( namelist, parent_id, parent_grid_ratio, starti, startj, e_we, e_sn)
+
+def write( namelist, filename ):
+    """Write the namelist, measured as the 'write' phase"""
+    with metrics.phase( 'write' ) as p:
+        namelist.write( filename, force=True )
+        p.add( written=metrics.filesize( filename ) )
+
 def main():
     parser = argparse.ArgumentParser(description="Add a nested grid to an existing WRF namelist")
-    parser.add_argument("-o", "--out", type=str, help="The output namelist, defaults to the input namelist.wps" )
+    parser.add_argument("-o", "--out", type=str, nargs=1, help="The output namelist, defaults to the input namelist.wps" )
     parser.add_argument("-c", "--center", help="Add a centered nested grid", nargs=2, metavar=('latitude','longitude'), default=False )
     parser.add_argument("-b", "--box", help="Add a nested grid defined by its corners", nargs=4, default=False,
                         metavar=('north','west','south','east' )  )
+    parser.add_argument("-f", "--fit", help="Add the smallest nested grid covering the given points", nargs='+', type=float,
+                        default=False, metavar=('latitude','longitude') )
+    parser.add_argument("-m", "--margin", type=float, help="Margin around the points to fit in km, default is 0", default=0.0 )
+    parser.add_argument("--polygon", action="store_true", help="The points to fit are the vertices of a polygon" )
+    parser.add_argument("--cost", action="store_true", help="Print the estimated relative compute cost per domain" )
     parser.add_argument("-p", "--parent_id", type=int, help="The parent_id", default=1 )
     parser.add_argument("-r", "--ratio", type=int, help="The parent_grid_ratio, default is 5", default=5 )
     parser.add_argument("-x", "--sizex", type=float, help="Size of the domain in km", default=10 )
@@ -241,7 +390,14 @@ def main():
     args = parser.parse_args()
     print args
 
-    namelist = f90nml.read( args.namelist[0] )
+    with metrics.phase( 'parse' ) as p:
+        namelist = f90nml.read( args.namelist[0] )
+        p.add( read=metrics.filesize( args.namelist[0] ) )
+    if args.cost and 'domains' in namelist:
+        # namelist.input
+        printcost( namelist )
+        sys.exit()
+
     namelist['geogrid'] = fixgeogrid( namelist['geogrid'] )
     namelist['share']   = fixshare( namelist['share'] )
 
@@ -250,15 +406,31 @@ def main():
             args.out = args.namelist
             print args.out, "update"
 
-        add_centered_nest( namelist, args.parent_id, args.ratio, args.center[0], args.center[1], args.sizex, args.sizey )
-        namelist.write( args.out[0], force=True)
+        with metrics.phase( 'compute' ):
+            add_centered_nest( namelist, args.parent_id, args.ratio, args.center[0], args.center[1], args.sizex, args.sizey )
+        write( namelist, args.out[0] )
     elif args.box:
         if not args.out:
             args.out = args.namelist
             print args.out, "update"
 
-        add_rectangular_nest( namelist, args.parent_id, args.ratio, args.box[0], args.box[1], args.box[2], args.box[3] )
-        namelist.write( args.out[0], force=True)
+        with metrics.phase( 'compute' ):
+            add_rectangular_nest( namelist, args.parent_id, args.ratio, args.box[0], args.box[1], args.box[2], args.box[3] )
+        write( namelist, args.out[0] )
+    elif args.fit:
+        if len(args.fit) % 2 != 0:
+            parser.error( "--fit needs pairs of latitude longitude" )
+        if not args.out:
+            args.out = args.namelist
+            print args.out, "update"
+
+        with metrics.phase( 'compute' ):
+            add_fitted_nest( namelist, args.parent_id, args.ratio, args.fit[0::2], args.fit[1::2], margin=args.margin, polygon=args.polygon )
+        if args.cost:
+            printcost( namelist )
+        write( namelist, args.out[0] )
+    elif args.cost:
+        printcost( namelist )
     else:
         print args.namelist[0]
         printgrids( namelist )
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+import netCDF4 as cdf
+import numpy as np
+import argparse
+import logging
+import re
+
+from multiprocessing import Pool
+
+logging.basicConfig(level=logging.INFO)
+
+HELP = """
+Edits are given as VARIABLE=operation:value[@mask]
+
+operations:
+  const:<value>             set to a constant
+  scale:<value>             multiply by a factor
+  offset:<value>            add an offset
+  file:<filename>[:<var>]   copy from another file, optionally from another variable
+
+masks:
+  @land                     only where LANDMASK = 1
+  @water                    only where LANDMASK = 0
+  @lu=<i>[,<j>,...]         only where LU_INDEX is one of the given categories
+
+Examples:
+  SST=offset:2@water        SST +2 K
+  ALBBCK=scale:1.1@lu=1     increase the background albedo of urban cells by 10%
+  LU_INDEX=file:wrfinput_d03.new
+"""
+
+EDITREGEX = r"^(\w+)=(const|scale|offset|file):([^@]+)(@(land|water|lu=[\d,]+))?$"
+
+
+def parse_edit( spec ):
+    """Parse an edit specification, see HELP.
+    Returns a tuple (variable, operation, value, mask)"""
+    match = re.match( EDITREGEX, spec.strip() )
+    if not match:
+        raise ValueError( "Cannot parse edit: {}".format( spec ) )
+
+    variable, operation, value, dummy, mask = match.groups()
+    if operation != 'file':
+        value = float( value )
+    return variable, operation, value, mask
+
+def read_edits( filename ):
+    """Read edit specifications from a file, one per line; lines starting with # are ignored"""
+    edits = []
+    for line in open( filename, 'r' ):
+        line = line.strip()
+        if line and not line.startswith( '#' ):
+            edits.append( parse_edit( line ) )
+    return edits
+
+def getmask( ncfile, mask, t, cache ):
+    """Boolean mask at time index t, or None for no mask. Masks are read once per time index."""
+    if mask is None:
+        return None
+    if (mask, t) in cache:
+        return cache[(mask, t)]
+
+    if mask in [ 'land', 'water' ]:
+        landmask = ncfile.variables['LANDMASK'][t] > 0
+        m = landmask if mask == 'land' else ~ landmask
+    else:
+        categories = [ int(c) for c in mask[3:].split(',') if c ]
+        m = np.in1d( ncfile.variables['LU_INDEX'][t], categories ).reshape( ncfile.variables['LU_INDEX'].shape[1:] )
+
+    cache[(mask, t)] = m
+    return m
+
+def patch( filename, edits ):
+    """Apply all edits to a file, opening it once. Each variable is read and written once per time index."""
+
+    ncfile = cdf.Dataset( filename, 'r+' )
+    masks = {}
+    others = {}
+
+    # group the edits per variable, keeping their order
+    variables = []
+    for e in edits:
+        if e[0] not in variables:
+            variables.append( e[0] )
+
+    for varname in variables:
+        v = ncfile.variables[varname]
+        ntimes = v.shape[0] if v.dimensions[0] == 'Time' else 1
+
+        for t in range( ntimes ):
+            data = v[t] if v.dimensions[0] == 'Time' else v[:]
+
+            for variable, operation, value, mask in edits:
+                if variable != varname:
+                    continue
+
+                if operation == 'const':
+                    new = np.ones( data.shape ) * value
+                elif operation == 'scale':
+                    new = data * value
+                elif operation == 'offset':
+                    new = data + value
+                else:
+                    otherfile, dummy, othervar = value.partition( ':' )
+                    if otherfile not in others:
+                        others[otherfile] = cdf.Dataset( otherfile, 'r' )
+                    o = others[otherfile].variables[ othervar or varname ]
+                    new = o[ min( t, o.shape[0] - 1 ) ]
+
+                m = getmask( ncfile, mask, t, masks )
+                if m is not None:
+                    if data.shape[-2:] != m.shape:
+                        raise ValueError( "Cannot mask staggered variable {} in {}".format( varname, filename ) )
+                    new = np.where( m, new, data )
+
+                data = new
+
+            if v.dimensions[0] == 'Time':
+                v[t] = data
+            else:
+                v[:] = data
+
+    for o in others.values():
+        o.close()
+    ncfile.close()
+
+    return filename
+
+def patch_star( args ):
+    """Helper for Pool.map, which only passes a single argument"""
+    filename, edits = args
+    patch( filename, edits )
+    logging.info( "%s done", filename )
+    return filename
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply a list of edits to fields in WRF netCDF files", epilog=HELP,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('files', metavar="file", type=str, nargs='+', help="wrfinput_d?? or wrfout files to patch")
+    parser.add_argument('-e', '--edit', type=str, action='append', default=[], help="Edit to apply, can be given multiple times")
+    parser.add_argument('-f', '--edits', type=str, help="File with edits, one per line")
+    parser.add_argument('-n', '--processes', type=int, help="Number of files to process concurrently, default is 4", default=4)
+    args = parser.parse_args()
+
+    edits = [ parse_edit( e ) for e in args.edit ]
+    if args.edits:
+        edits += read_edits( args.edits )
+    if not edits:
+        parser.error( "No edits given" )
+
+    for e in edits:
+        logging.info( "Edit %s %s %s %s", *e )
+
+    pool = Pool( min( args.processes, len(args.files) ) )
+    pool.map( patch_star, [ (f, edits) for f in args.files ] )
+    pool.close()
+    pool.join()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+import matplotlib
+matplotlib.use( 'Agg' )
+import matplotlib.pyplot as plt
+import netCDF4 as cdf
+import numpy as np
+import argparse
+import logging
+
+from multiprocessing import Pool
+
+import wrfdiag
+import wrfstatic
+
+try:
+    from mpl_toolkits.basemap import Basemap
+except ImportError:
+    Basemap = None
+
+logging.basicConfig(level=logging.INFO)
+
+KNOTS  = 1.94386
+
+# plots per time step of wrf_Surface1/2/3.ncl: field, contour levels (min, max, step), overlay sea level pressure
+STYLES = {
+    1: [ ( 'tc2',       ( -10., 40., 2.5 ), True ), ( 'td2', ( -10., 40., 2.5 ), False ) ],
+    2: [ ( 'tc2merged', (  10., 40., 0.5 ), True ), ( 'td2', (  10., 40., 0.5 ), False ) ],
+    3: [ ( 'tdiff',     (  -5.,  5., 0.5 ), True ), ( 'tc2merged', ( 15., 35., 0.5 ), True ) ],
+}
+
+DESCRIPTION = {
+    'tc2':       "TEMP at 2 M (C)",
+    'tc2merged': "TEMP at 2 M, urban canyon in urban cells (C)",
+    'td2':       "Dewpoint Temperature at 2 M (C)",
+    'tdiff':     "T - Tavg (C)",
+}
+
+STEP       = 2    # plot every other time step, as the NCL scripts
+BLOCK      = 4    # number of plotted time steps read at once
+NUMVECTORS = 47   # density of wind barbs
+
+
+def read_block( filename, times, style, staticdir=None ):
+    """Compute the plotted fields for a style for the time steps in the list times.
+    Returns a dictionary of arrays with time as first dimension"""
+
+    get = lambda name: wrfdiag.getdiag( filename, name, times, staticdir )
+    products = [ p[0] for p in STYLES[style] ]
+    fields = {}
+
+    fields['times'] = [ str( t ) for t in cdf.chartostring( get( 'Times' ) ) ]
+    fields['slp'] = wrfdiag.smooth2d( get( 'slp' ), 3 )
+    fields['u10'] = get( 'U10' ) * KNOTS
+    fields['v10'] = get( 'V10' ) * KNOTS
+    fields['tc2'] = get( 'tc2' )
+
+    if 'tc2merged' in products or 'tdiff' in products:
+        canyon = get( 'TC2M_URB' ) - wrfdiag.KELVIN
+        fields['tc2merged'] = np.where( get( 'UTYPE_URB' ) == 0, fields['tc2'], canyon )
+        mean = fields['tc2merged'].reshape( len( times ), -1 ).mean( axis=1 )
+        fields['tdiff'] = fields['tc2merged'] - mean[:, np.newaxis, np.newaxis]
+
+    if 'td2' in products:
+        fields['td2'] = get( 'td2' )
+
+    return fields
+
+def projection( ncfile, lats, lons ):
+    """Map coordinates of the grid; with basemap the Lambert projection of the domain, otherwise longitude and latitude.
+    Returns the basemap or None, and x and y"""
+    if Basemap is None:
+        return None, lons, lats
+
+    m = Basemap( projection='lcc', resolution='i',
+                 lat_1=ncfile.getncattr( 'TRUELAT1' ), lat_2=ncfile.getncattr( 'TRUELAT2' ),
+                 lon_0=ncfile.getncattr( 'STAND_LON' ), lat_0=ncfile.getncattr( 'CEN_LAT' ),
+                 llcrnrlon=lons[0, 0], llcrnrlat=lats[0, 0], urcrnrlon=lons[-1, -1], urcrnrlat=lats[-1, -1] )
+    x, y = m( lons, lats )
+    return m, x, y
+
+def render( filename, m, x, y, field, levels, slp, u10, v10, description, when ):
+    """Draw one plot: filled contours of a field, optionally sea level pressure contours, and 10 m wind barbs"""
+
+    fig = plt.figure( figsize=( 8, 8 ) )
+    ax = fig.add_subplot( 111 )
+
+    low, high, step = levels
+    cs = ax.contourf( x, y, field, np.arange( low, high + 0.5 * step, step ), cmap='jet', extend='both' )
+    fig.colorbar( cs, ax=ax, orientation='horizontal', pad=0.05 )
+
+    if slp is not None:
+        cl = ax.contour( x, y, slp, np.arange( 900., 1100.1, 4. ), colors='blue', linewidths=2 )
+        ax.clabel( cl, fmt='%.0f', fontsize=8 )
+
+    stride = max( 1, x.shape[1] // NUMVECTORS )
+    ax.barbs( x[::stride, ::stride], y[::stride, ::stride], u10[::stride, ::stride], v10[::stride, ::stride], length=5 )
+
+    if m is not None:
+        m.drawcoastlines( ax=ax, linewidth=2 )
+        m.drawcountries( ax=ax, linewidth=2 )
+
+    fig.suptitle( "REAL-TIME WRF" )
+    ax.set_title( description, loc='left', fontsize=10 )
+    ax.set_title( when, loc='right', fontsize=10 )
+    ax.set_xticks( [] )
+    ax.set_yticks( [] )
+
+    fig.savefig( filename, dpi=100 )
+    plt.close( fig )
+
+def plot_block( filename, output, start, stop, first, style, staticdir=None ):
+    """Plot the time steps start, start + STEP, .. up to stop of a wrfout file.
+    Plots are numbered from 'first' and written as <output>.NNNNNN.png, like the NCL png output.
+    Returns the number of plots"""
+
+    lats = wrfdiag.getdiag( filename, 'XLAT', [0], staticdir )[0]
+    lons = wrfdiag.getdiag( filename, 'XLONG', [0], staticdir )[0]
+    ncfile = cdf.Dataset( filename, 'r' )
+    m, x, y = projection( ncfile, lats, lons )
+    ncfile.close()
+
+    fields = read_block( filename, range( start, stop, STEP ), style, staticdir )
+
+    number = first
+    for t, when in enumerate( fields['times'] ):
+        for product, levels, withslp in STYLES[style]:
+            render( "{}.{:06}.png".format( output, number ), m, x, y, fields[product][t], levels,
+                    fields['slp'][t] if withslp else None, fields['u10'][t], fields['v10'][t], DESCRIPTION[product], when )
+            number += 1
+
+    logging.info( "Plotted %s %s - %s", filename, fields['times'][0], fields['times'][-1] )
+    return number - first
+
+def plot_block_star( args ):
+    """Helper for Pool.map, which only passes a single argument"""
+    return plot_block( *args )
+
+def blocks( filename, output, style, staticdir=None ):
+    """Split the plotted time steps of a file in blocks of BLOCK time steps.
+    Returns a list of arguments for plot_block"""
+    ncfile = cdf.Dataset( filename, 'r' )
+    ntimes = len( ncfile.dimensions['Time'] )
+    ncfile.close()
+
+    nplots = len( STYLES[style] )
+    jobs = []
+    for n, start in enumerate( range( 0, ntimes, STEP * BLOCK ) ):
+        stop = min( start + STEP * BLOCK, ntimes )
+        jobs.append( ( filename, output, start, stop, 1 + n * BLOCK * nplots, style, staticdir ) )
+    return jobs
+
+def main():
+    parser = argparse.ArgumentParser(description="Plot surface temperature, sea level pressure and wind from wrfout files, like wrf_Surface1/2/3.ncl")
+    parser.add_argument('files', metavar="wrfout output", type=str, nargs='+',
+                        help="Pairs of wrfout file and output name; plots are written as <output>.000001.png, ..")
+    parser.add_argument('-s', '--style', type=int, choices=sorted( STYLES.keys() ), help="Plots as wrf_SurfaceN.ncl, default is 3", default=3)
+    parser.add_argument('-n', '--processes', type=int, help="Number of processes, default is 8", default=8)
+    parser.add_argument('--static', type=str, help="Directory with static files, default is " + wrfstatic.STATICDIR, default=None)
+    args = parser.parse_args()
+
+    if len(args.files) % 2 != 0:
+        parser.error( "Files should be given as wrfout output pairs" )
+
+    # all blocks of time steps of all domains are plotted concurrently
+    jobs = []
+    for i in range( 0, len(args.files), 2 ):
+        jobs += blocks( args.files[i], args.files[i + 1], args.style, args.static )
+
+    pool = Pool( args.processes )
+    nplots = sum( pool.map( plot_block_star, jobs ) )
+    pool.close()
+    pool.join()
+
+    logging.info( "%i plots done", nplots )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+import netCDF4 as cdf
+import numpy as np
+import scipy.sparse
+import argparse
+import hashlib
+import logging
+import os
+
+from multiprocessing import Pool
+
+import f90nml
+import nestwrf
+import wrfdiag
+
+logging.basicConfig(level=logging.INFO)
+
+# location of the cached weights
+CACHEDIR = os.path.expanduser( '~/WRF/regrid' )
+
+# fields on the lat/lon grid, wrfout variables on mass points or wrfdiag diagnostics
+VARIABLES = "T2,Q2,PSFC,RAINC,RAINNC,SWDOWN,slp,tc2,rh2,wspd10,wdir10"
+
+
+def parse_grid( spec ):
+    """Parse a target grid given as south,north,west,east,step in degrees.
+    Returns the 1-D latitudes and longitudes"""
+    south, north, west, east, step = [ float( v ) for v in spec.split(',') ]
+    lats = np.arange( south, north + 0.5 * step, step )
+    lons = np.arange( west, east + 0.5 * step, step )
+    return lats, lons
+
+def domain_grid( namelist, domain ):
+    """A lat/lon grid covering a domain, with about the same resolution.
+    Returns the 1-D latitudes and longitudes"""
+    west, east, north, south, dx, dy, projection = nestwrf.parsenl( namelist )
+    d = domain - 1
+    x = np.linspace( west[d], east[d], 50 )
+    y = np.linspace( south[d], north[d], 50 )
+    lons, lats = projection( *np.meshgrid( x, y ), inverse=True )
+    step = round( dy[d] / 111200.0, 4 )
+    return ( np.arange( np.floor( lats.min() / step ) * step, lats.max() + 0.5 * step, step ),
+             np.arange( np.floor( lons.min() / step ) * step, lons.max() + 0.5 * step, step ) )
+
+def cachekey( namelist, domain, lats, lons ):
+    """Hash of the domain configuration and the target grid"""
+    west, east, north, south, dx, dy, projection = nestwrf.parsenl( namelist )
+    fi, fj, nx, ny = nestwrf.latlon_to_ij( namelist, [ 0.0 ], [ 0.0 ] )
+    d = domain - 1
+    geogrid = namelist['geogrid']
+
+    h = hashlib.sha1()
+    h.update( "{} {} {} {} {} {} {}".format( west[d], south[d], dx[d], dy[d], nx[d, 0], ny[d, 0], projection.srs ) )
+    h.update( "{} {} {} {}".format( geogrid['map_proj'], geogrid['truelat1'], geogrid['truelat2'], geogrid['stand_lon'] ) )
+    for a in [ lats, lons ]:
+        h.update( np.ascontiguousarray( a, dtype=np.float64 ).tostring() )
+    return h.hexdigest()
+
+def bilinear( namelist, domain, lats, lons ):
+    """Bilinear interpolation weights from the mass points of a domain to the lat/lon grid.
+    Returns a sparse matrix (nlat * nlon, ny * nx); rows of points outside the domain are empty"""
+
+    glons, glats = np.meshgrid( lons, lats )
+    fi, fj, nx, ny = nestwrf.latlon_to_ij( namelist, glats.ravel(), glons.ravel() )
+    fi, fj = fi[domain - 1], fj[domain - 1]
+    nx, ny = nx[domain - 1, 0], ny[domain - 1, 0]
+
+    inside = np.where( ( fi >= 1 ) & ( fi <= nx ) & ( fj >= 1 ) & ( fj <= ny ) )[0]
+    fi, fj = fi[inside] - 1, fj[inside] - 1
+    i = np.clip( np.floor( fi ).astype( int ), 0, nx - 2 )
+    j = np.clip( np.floor( fj ).astype( int ), 0, ny - 2 )
+    wi = fi - i
+    wj = fj - j
+
+    rows = np.repeat( inside, 4 )
+    columns = np.column_stack( [ j * nx + i, j * nx + i + 1, ( j + 1 ) * nx + i, ( j + 1 ) * nx + i + 1 ] ).ravel()
+    values = np.column_stack( [ ( 1 - wj ) * ( 1 - wi ), ( 1 - wj ) * wi, wj * ( 1 - wi ), wj * wi ] ).ravel()
+
+    return scipy.sparse.csr_matrix( ( values, ( rows, columns ) ), shape=( glats.size, nx * ny ) )
+
+def weights( namelist, domain, lats, lons, cachedir=CACHEDIR ):
+    """Interpolation weights from a domain to the lat/lon grid.
+    The weights are computed once per domain configuration and grid, and cached in cachedir.
+    Returns the sparse matrix, and a boolean array of the grid points inside the domain"""
+
+    key = cachekey( namelist, domain, lats, lons )
+    filename = os.path.join( cachedir, "regrid_d{:02}_{}.npz".format( domain, key ) ) if cachedir else None
+
+    if filename and os.path.isfile( filename ):
+        logging.debug( "Using cached weights %s", filename )
+        cache = np.load( filename )
+        W = scipy.sparse.csr_matrix( ( cache['data'], cache['indices'], cache['indptr'] ), shape=tuple( cache['shape'] ) )
+    else:
+        logging.info( "Computing regrid weights for domain %i to %i x %i points", domain, len(lats), len(lons) )
+        W = bilinear( namelist, domain, lats, lons )
+
+        if filename:
+            if not os.path.isdir( cachedir ):
+                os.makedirs( cachedir )
+            # write to a temporary file first, so concurrent runs never see a partial file
+            working = "{}.{}.working.npz".format( filename[:-4], os.getpid() )
+            np.savez( working, data=W.data, indices=W.indices, indptr=W.indptr, shape=W.shape )
+            os.rename( working, filename )
+
+    inside = np.diff( W.indptr ) > 0
+    return W, inside
+
+def apply( W, inside, field, shape ):
+    """Interpolate fields (..., south_north, west_east) with the weights; points outside the domain are NaN.
+    Returns the fields with shape (..., nlat, nlon)"""
+    extra = field.shape[:-2]
+    values = W.dot( field.reshape( -1, field.shape[-2] * field.shape[-1] ).T ).T
+    values[:, ~ inside] = np.nan
+    return values.reshape( extra + shape )
+
+def regrid( wrfout, output, namelist, variables, grid=None, staticdir=None, cachedir=CACHEDIR ):
+    """Interpolate variables of a wrfout file to a lat/lon grid, one time step at a time.
+    Without a grid, a grid covering the domain is used. Returns the output file name"""
+
+    ncfile = cdf.Dataset( wrfout, 'r' )
+    domain = int( ncfile.getncattr( 'GRID_ID' ) )
+    ntimes = len( ncfile.dimensions['Time'] )
+    dimensions = dict( [ ( name, v.dimensions ) for name, v in ncfile.variables.items() ] )
+    times = ncfile.variables['Times'][:]
+    ncfile.close()
+
+    lats, lons = grid if grid is not None else domain_grid( namelist, domain )
+    W, inside = weights( namelist, domain, lats, lons, cachedir )
+    shape = ( len(lats), len(lons) )
+
+    working = output + ".working"
+    dst = cdf.Dataset( working, 'w', format='NETCDF4_CLASSIC' )
+    dst.createDimension( 'Time', None )
+    dst.createDimension( 'DateStrLen', times.shape[1] )
+    dst.createDimension( 'lat', len(lats) )
+    dst.createDimension( 'lon', len(lons) )
+    dst.createVariable( 'Times', 'S1', ( 'Time', 'DateStrLen' ) )[:] = times
+    v = dst.createVariable( 'lat', 'f4', ( 'lat', ) )
+    v.units = "degrees_north"
+    v[:] = lats
+    v = dst.createVariable( 'lon', 'f4', ( 'lon', ) )
+    v.units = "degrees_east"
+    v[:] = lons
+    dst.setncattr( 'source', os.path.basename( wrfout ) )
+    dst.setncattr( 'GRID_ID', domain )
+
+    for name in variables:
+        if name not in wrfdiag.DIAGNOSTICS and dimensions.get( name, ( None, ) )[-2:] != ( 'south_north', 'west_east' ):
+            logging.warn( "Skipping %s, not a diagnostic or a variable on mass points", name )
+            continue
+
+        for t in range( ntimes ):
+            field = wrfdiag.getdiag( wrfout, name, [t], staticdir )[0]
+            values = apply( W, inside, field, shape )
+
+            if name not in dst.variables:
+                extra = [ "{}_{}".format( name, n ) for n in range( field.ndim - 2 ) ]
+                if name in dimensions:
+                    extra = list( dimensions[name][1:-2] )
+                for dim, size in zip( extra, field.shape[:-2] ):
+                    if dim not in dst.dimensions:
+                        dst.createDimension( dim, size )
+                out = dst.createVariable( name, 'f4', [ 'Time' ] + extra + [ 'lat', 'lon' ], zlib=True,
+                                          chunksizes=[1] * ( len(extra) + 1 ) + list( shape ), fill_value=np.nan )
+            out[t] = values
+
+        logging.info( "%s: %s done", output, name )
+
+    dst.close()
+    os.rename( working, output )
+    return output
+
+def regrid_star( args ):
+    """Helper for Pool.map, which only passes a single argument"""
+    return regrid( *args )
+
+def main():
+    parser = argparse.ArgumentParser(description="Interpolate wrfout fields to a regular lat/lon grid")
+    parser.add_argument('files', metavar="wrfout output", type=str, nargs='+', help="Pairs of wrfout file and output netCDF file")
+    parser.add_argument('-w', '--wps', type=str, help="namelist.wps of the domains, default is namelist.wps", default="namelist.wps")
+    parser.add_argument('-g', '--grid', type=str, help="Target grid as south,north,west,east,step in degrees, default is a grid covering the domain")
+    parser.add_argument('-v', '--variables', type=str, help="Comma separated list of variables, default is " + VARIABLES, default=VARIABLES)
+    parser.add_argument('-c', '--cache', type=str, help="Directory for the cached weights, default is " + CACHEDIR, default=CACHEDIR)
+    parser.add_argument('-n', '--processes', type=int, help="Number of files to process concurrently, default is 4", default=4)
+    parser.add_argument('--static', type=str, help="Directory with static files of deduplicated wrfout files")
+    args = parser.parse_args()
+
+    if len(args.files) % 2 != 0:
+        parser.error( "Files should be given as wrfout output pairs" )
+
+    namelist = f90nml.read( args.wps )
+    namelist['geogrid'] = nestwrf.fixgeogrid( namelist['geogrid'] )
+    namelist['share']   = nestwrf.fixshare( namelist['share'] )
+    grid = parse_grid( args.grid ) if args.grid else None
+    variables = [ v for v in args.variables.split(',') if v ]
+
+    jobs = [ (args.files[i], args.files[i + 1], namelist, variables, grid, args.static, args.cache) for i in range( 0, len(args.files), 2 ) ]
+
+    pool = Pool( min( args.processes, len(jobs) ) )
+    pool.map( regrid_star, jobs )
+    pool.close()
+    pool.join()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+# vim: set fileencoding=utf-8 :
+
+import numpy as np
+import scipy.sparse
+import hashlib
+import logging
+import os
+
+from scipy.spatial import cKDTree
+
+# number of neighbours for the inverse distance weighting, as cdo remapdis
+NEIGHBOURS = 4
+
+# number of neighbours for the fill missing pass, used where all NEIGHBOURS stations are missing
+FILLNEIGHBOURS = 16
+
+# location of the cached weights
+CACHEDIR = os.path.expanduser( '~/SST/remap' )
+
+
+def unitvectors( lats, lons ):
+    """Convert latitudes and longitudes in degrees to points on the unit sphere"""
+    lats = np.radians( np.asarray( lats, dtype=float ) )
+    lons = np.radians( np.asarray( lons, dtype=float ) )
+    return np.column_stack( [ np.cos(lats) * np.cos(lons), np.cos(lats) * np.sin(lons), np.sin(lats) ] )
+
+def cachekey( lats, lons, glats, glons, neighbours, fillneighbours ):
+    """Hash of the station locations, the grid, and the number of neighbours"""
+    h = hashlib.sha1()
+    for a in [ lats, lons, glats, glons ]:
+        h.update( np.ascontiguousarray( a, dtype=np.float64 ).tostring() )
+    h.update( "{} {}".format( neighbours, fillneighbours ) )
+    return h.hexdigest()
+
+def neighbours( lats, lons, glats, glons, k ):
+    """The k nearest stations for every grid point, and their inverse distance weights.
+    Returns arrays of shape (ngrid, k)"""
+    k = min( k, len(lats) )
+    tree = cKDTree( unitvectors( lats, lons ) )
+    distance, index = tree.query( unitvectors( np.ravel(glats), np.ravel(glons) ), k=k )
+    distance = distance.reshape( -1, k )
+    index = index.reshape( -1, k )
+
+    # a station exactly on a grid point gets (almost) all the weight
+    weight = 1.0 / np.maximum( distance, 1e-12 )
+    return index, weight
+
+def sparse( index, weight, nstations ):
+    """Sparse matrix (ngrid, nstations) from the neighbour indices and weights"""
+    ngrid, k = index.shape
+    indptr = np.arange( 0, ngrid * k + 1, k )
+    return scipy.sparse.csr_matrix( ( weight.ravel(), index.ravel(), indptr ), shape=( ngrid, nstations ) )
+
+def weights( lats, lons, glats, glons, cachedir=CACHEDIR, k=NEIGHBOURS, fillk=FILLNEIGHBOURS ):
+    """Inverse distance weights from the stations (lats, lons) to the grid (glats, glons),
+    for the first pass and the fill missing pass.
+    The weights are computed once per station set and grid, and cached in cachedir.
+    Returns two sparse matrices of shape (ngrid, nstations)"""
+
+    key = cachekey( lats, lons, glats, glons, k, fillk )
+    filename = os.path.join( cachedir, "remapdis_{}.npz".format( key ) ) if cachedir else None
+
+    if filename and os.path.isfile( filename ):
+        logging.debug( "Using cached weights %s", filename )
+        cache = np.load( filename )
+        index, weight, fillindex, fillweight = cache['index'], cache['weight'], cache['fillindex'], cache['fillweight']
+    else:
+        logging.info( "Computing remap weights for %i stations on %i grid points", len(lats), np.size(glats) )
+        index, weight = neighbours( lats, lons, glats, glons, k )
+        fillindex, fillweight = neighbours( lats, lons, glats, glons, fillk )
+
+        if filename:
+            if not os.path.isdir( cachedir ):
+                os.makedirs( cachedir )
+            # write to a temporary file first, so concurrent runs never see a partial file
+            working = "{}.{}.working.npz".format( filename[:-4], os.getpid() )
+            np.savez( working, index=index, weight=weight, fillindex=fillindex, fillweight=fillweight )
+            os.rename( working, filename )
+
+    return sparse( index, weight, len(lats) ), sparse( fillindex, fillweight, len(lats) )
+
+def apply( W, F, values, shape ):
+    """Remap station values (NaN for missing) with the weights W, and F for the fill missing pass.
+    Missing stations are left out by normalizing with the weights of the valid stations only.
+    Returns the field with the given shape"""
+
+    valid = ~ np.isnan( values )
+    if valid.sum() == 0:
+        raise ValueError( "No valid observations to interpolate" )
+    filled = np.where( valid, values, 0.0 )
+    valid = valid * 1.0
+
+    numerator = W.dot( filled )
+    denominator = W.dot( valid )
+
+    # fill missing: grid points where all nearest stations are missing
+    missing = denominator == 0.0
+    if missing.any():
+        numerator[missing] = F[missing].dot( filled )
+        denominator[missing] = F[missing].dot( valid )
+
+    # still missing, use the average of all stations
+    missing = denominator == 0.0
+    numerator[missing] = np.nanmean( values )
+    denominator[missing] = 1.0
+
+    return ( numerator / denominator ).reshape( shape )
+
+def remapdis( lats, lons, values, glats, glons, cachedir=CACHEDIR ):
+    """Inverse distance weighted average of the nearest valid stations, like cdo remapdis
+    followed by a fill missing pass. Returns the field on the grid (glats, glons)"""
+    W, F = weights( lats, lons, glats, glons, cachedir )
+    return apply( W, F, values, np.shape( glats ) )
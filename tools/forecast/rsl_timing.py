@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+"""Model throughput from the timing lines WRF writes to the rsl files of every MPI rank:
+
+    Timing for main: time 2015-06-03_00:01:00 on domain   1:    2.34567 elapsed seconds
+    Timing for Writing wrfout_d01_2015-06-03_00:00:00 for domain        1:    1.23456 elapsed seconds
+
+Reports per domain the time per step, the time spent writing, the simulated seconds per
+wallclock second, the slowest ranks, and the expected end of a running forecast.
+With --history, a summary per run is appended to a JSON lines file, and --trend prints it.
+"""
+
+import argparse
+import datetime
+import glob
+import json
+import logging
+import os
+import re
+
+from multiprocessing import Pool
+
+logging.basicConfig(level=logging.INFO)
+
+MAINREGEX = re.compile( r"Timing for main: time (\S+) on domain\s+(\d+):\s+([\d.]+) elapsed seconds" )
+IOREGEX   = re.compile( r"Timing for (Writing|processing lateral boundary|processing restart)\D.*?domain\s+(\d+):\s+([\d.]+) elapsed seconds" )
+RANKREGEX = re.compile( r"rsl\.(out|error)\.(\d+)$" )
+
+# history of the runs, on a local disk
+HISTORY = os.path.expanduser( '~/.forecast_rsl_timing.jsonl' )
+
+DATEFORMAT = '%Y-%m-%d_%H:%M:%S'
+
+
+def empty():
+    """Totals of a domain: number of steps, their time and the slowest, time in I/O and number of writes,
+    and the model time of the first, second and last step"""
+    return { 'steps': 0, 'main': 0.0, 'slowest': 0.0, 'io': 0.0, 'writes': 0, 'first': None, 'second': None, 'last': None }
+
+def parse( filename ):
+    """Read one rsl file line by line, keeping only totals per domain.
+    Returns a dictionary of domain: totals"""
+    domains = {}
+    for line in open( filename, 'r' ):
+        if 'Timing for' not in line:
+            continue
+
+        m = MAINREGEX.search( line )
+        if m:
+            d = domains.setdefault( int( m.group(2) ), empty() )
+            seconds = float( m.group(3) )
+            d['steps'] += 1
+            d['main'] += seconds
+            d['slowest'] = max( d['slowest'], seconds )
+            if d['first'] is None:
+                d['first'] = m.group(1)
+            elif d['second'] is None:
+                d['second'] = m.group(1)
+            d['last'] = m.group(1)
+            continue
+
+        m = IOREGEX.search( line )
+        if m:
+            d = domains.setdefault( int( m.group(2) ), empty() )
+            d['io'] += float( m.group(3) )
+            d['writes'] += 1
+    return domains
+
+def rank( filename ):
+    """MPI rank of an rsl file, 0 for a serial run"""
+    m = RANKREGEX.search( filename )
+    return int( m.group(2) ) if m else 0
+
+def parse_star( filename ):
+    """Helper for Pool.map; returns the file name with its totals"""
+    return filename, parse( filename )
+
+def seconds( start, end ):
+    """Seconds between two WRF dates"""
+    return ( datetime.datetime.strptime( end, DATEFORMAT ) - datetime.datetime.strptime( start, DATEFORMAT ) ).total_seconds()
+
+def summarize( results, length=None ):
+    """Combine the totals of all rsl files of a run.
+    rsl.out and rsl.error of the same rank repeat the same lines, the one with most steps is used.
+    Returns a dictionary with per domain statistics, the ranks by time, and the overall throughput"""
+
+    ranks = {}
+    for filename, domains in results:
+        r = rank( filename )
+        steps = sum( [ d['steps'] for d in domains.values() ] )
+        if r not in ranks or steps > ranks[r][0]:
+            ranks[r] = ( steps, domains )
+
+    # no timing lines on rank 0, for instance when WRF died during initialization
+    if 0 not in ranks or not ranks[0][1]:
+        return None
+
+    summary = { 'domains': {}, 'ranks': [] }
+    root = ranks[0][1]
+    wall = sum( [ d['main'] + d['io'] for d in root.values() ] )
+
+    for n, d in sorted( root.items() ):
+        entry = { 'steps': d['steps'], 'step': d['main'] / max( d['steps'], 1 ), 'slowest': d['slowest'], 'io': d['io'], 'writes': d['writes'] }
+        if d['first'] and d['second']:
+            dt = seconds( d['first'], d['second'] )
+            entry['simulated'] = seconds( d['first'], d['last'] ) + dt
+            entry['speed'] = entry['simulated'] / ( d['main'] + d['io'] ) if d['main'] + d['io'] > 0 else None
+            entry['last'] = d['last']
+        # spread of the time in this domain over the ranks
+        totals = [ rd[1][n]['main'] for rd in ranks.values() if n in rd[1] ]
+        entry['imbalance'] = max( totals ) / ( sum( totals ) / len( totals ) ) if sum( totals ) > 0 else 1.0
+        summary['domains'][n] = entry
+
+    summary['ranks'] = sorted( [ ( sum( [ d['main'] + d['io'] for d in rd[1].values() ] ), r ) for r, rd in ranks.items() ], reverse=True )
+    summary['wall'] = wall
+    summary['nranks'] = len( ranks )
+
+    # the outer domain sets the pace of the run
+    outer = summary['domains'].get( min( root.keys() ) )
+    if outer and outer.get( 'speed' ):
+        summary['speed'] = outer['simulated'] / wall
+        if length:
+            remaining = length * 3600.0 - outer['simulated']
+            summary['remaining'] = max( remaining, 0.0 ) / summary['speed']
+    return summary
+
+def report( summary, top=5 ):
+    """Print the summary of a run"""
+    print "{:>6} {:>8} {:>10} {:>10} {:>10} {:>8} {:>10} {:>10}".format( 'domain', 'steps', 'step (s)', 'slowest', 'io (s)', 'writes', 'sim/wall', 'imbalance' )
+    for n, d in sorted( summary['domains'].items() ):
+        print "{:>6} {:>8} {:>10.3f} {:>10.3f} {:>10.1f} {:>8} {:>10} {:>10.2f}".format( n, d['steps'], d['step'], d['slowest'], d['io'], d['writes'],
+                                                                                  "{:.1f}".format( d['speed'] ) if d.get( 'speed' ) else '-', d['imbalance'] )
+    print
+    print "{} ranks, {:.0f} s wallclock on rank 0".format( summary['nranks'], summary['wall'] )
+    if summary.get( 'speed' ):
+        print "{:.1f} simulated seconds per wallclock second".format( summary['speed'] )
+    if 'remaining' in summary:
+        print "Expected to finish in {:.0f} minutes".format( summary['remaining'] / 60.0 )
+    print "Slowest ranks: " + ", ".join( [ "{} ({:.0f} s)".format( r, t ) for t, r in summary['ranks'][:top] ] )
+
+def record( history, run, summary ):
+    """Append the summary of a run to the history"""
+    entry = { 'run': run, 'wall': summary['wall'], 'speed': summary.get( 'speed' ), 'nranks': summary['nranks'],
+              'domains': dict( [ ( str( n ), { 'step': d['step'], 'io': d['io'], 'imbalance': d['imbalance'] } )
+                                 for n, d in summary['domains'].items() ] ) }
+    f = open( history, 'a' )
+    f.write( json.dumps( entry, sort_keys=True ) + "\n" )
+    f.close()
+
+def trend( history, count=14 ):
+    """Print the last runs in the history"""
+    entries = [ json.loads( line ) for line in open( history, 'r' ) if line.strip() ]
+    print "{:>12} {:>10} {:>10}  {}".format( 'run', 'wall (s)', 'sim/wall', 'step per domain (s)' )
+    for e in entries[-count:]:
+        steps = " ".join( [ "d{:02}:{:.2f}".format( int( n ), e['domains'][n]['step'] ) for n in sorted( e['domains'], key=int ) ] )
+        print "{:>12} {:>10.0f} {:>10}  {}".format( e['run'], e['wall'], "{:.1f}".format( e['speed'] ) if e.get( 'speed' ) else '-', steps )
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput and load balance of a WRF run from the timing lines in the rsl files")
+    parser.add_argument('files', type=str, nargs='*', help="rsl.out.* and rsl.error.* files, default is those in the current directory")
+    parser.add_argument('-n', '--processes', type=int, help="Number of files read concurrently, default is 8", default=8)
+    parser.add_argument('-l', '--length', type=float, help="Length of the run in hours, to estimate the end of a running forecast")
+    parser.add_argument('-t', '--top', type=int, help="Number of slowest ranks to show, default is 5", default=5)
+    parser.add_argument('--history', type=str, help="Append the summary to this JSON lines file, like " + HISTORY)
+    parser.add_argument('--run', type=str, help="Name of the run in the history, default is the current directory")
+    parser.add_argument('--trend', action='store_true', help="Print the runs in the history instead")
+    args = parser.parse_args()
+
+    if args.trend:
+        trend( args.history or HISTORY )
+        return
+
+    files = args.files or sorted( glob.glob( 'rsl.out.*' ) + glob.glob( 'rsl.error.*' ) ) or [ f for f in [ 'rsl.out', 'rsl.error' ] if os.path.isfile( f ) ]
+    if not files:
+        parser.error( "No rsl files found" )
+
+    pool = Pool( min( args.processes, len(files) ) )
+    results = pool.map( parse_star, files )
+    pool.close()
+    pool.join()
+
+    summary = summarize( results, args.length )
+    if summary is None:
+        # a note in the report, which zip_log keeps with the logs
+        ranks0 = [ f for f in files if rank( f ) == 0 ]
+        logging.error( "No timing lines found for rank 0" )
+        print "No timing lines in {}, the run probably failed during initialization".format( ", ".join( ranks0 ) or "the rsl files of rank 0" )
+        return
+
+    report( summary, args.top )
+    if args.history:
+        record( args.history, args.run or os.path.basename( os.getcwd() ), summary )
+
+if __name__ == "__main__":
+    main()
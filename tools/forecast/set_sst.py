@@ -2,13 +2,17 @@
 
 import netCDF4 as cdf
 
+import metrics
+
 newval = 23.5 + 273.15  # in Kelvin
 
 files=[ 'wrfinput_d03' , 'wrfinput_d04' ]
 
 for f in files:
     print "Setting SST of ", f, " to ", newval, "K "
-    d = cdf.Dataset( f, 'r+', clobber=False )
-    v = d.variables['SST']
-    v[0,:,:] = newval
-    d.close()
+    with metrics.phase( 'write' ) as p:
+        d = cdf.Dataset( f, 'r+', clobber=False )
+        v = d.variables['SST']
+        v[0,:,:] = newval
+        p.add( written=v.shape[1] * v.shape[2] * v.dtype.itemsize )
+        d.close()
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+import netCDF4 as cdf
+import numpy as np
+import datetime
+import argparse
+import logging
+import os
+
+import remap
+
+logging.basicConfig(level=logging.INFO)
+
+# main data file, Rijkswaterstaat observations
+WATERTEMP = os.path.expanduser( '~/SST/watertemp.nc' )
+
+# reference for the time axis
+EPOCH = 'days since 1970-01-01 00:00:00'
+
+# largest window around the date, in days, to look for observations during an outage
+MAXDAYS = 14
+
+
+def read_window( filename, date, days=3, varname='temperature' ):
+    """Read the observations from 'days' days before until 'days' days after date.
+    Only the time steps in the window are read from the file.
+    Returns:
+    the times as days since EPOCH, observations as array (time, station) with NaN for missing values,
+    and the station latitudes and longitudes"""
+
+    ncfile = cdf.Dataset( filename, 'r' )
+    time = ncfile.variables['time']
+    calendar = getattr( time, 'calendar', 'standard' )
+
+    # times are sorted, find the window by bisection
+    first = cdf.date2num( date - datetime.timedelta( days=days ), time.units, calendar )
+    last  = cdf.date2num( date + datetime.timedelta( days=days + 1 ), time.units, calendar )
+    timevalues = time[:]
+    start, end = np.searchsorted( timevalues, [ first, last ] )
+
+    if end > start:
+        times = cdf.date2num( cdf.num2date( timevalues[start:end], time.units, calendar ), EPOCH, calendar )
+    else:
+        times = []
+    values = np.ma.filled( ncfile.variables[varname][start:end].astype(float), np.nan )
+    lats = ncfile.variables['lat'][:]
+    lons = ncfile.variables['lon'][:]
+
+    ncfile.close()
+
+    logging.info( "Read %i time steps for %i stations from %s", len(times), len(lats), filename )
+    return np.asarray( times, dtype=float ), values, lats, lons
+
+def daymax( times, values ):
+    """Daily maximum per station, ignoring missing values, like cdo daymax.
+    The timestamp of a daily maximum is the last time step of that day.
+    Returns:
+    times and values of the daily maxima"""
+
+    if len(times) == 0:
+        return times, values
+
+    days = np.floor( times )
+
+    # times are sorted, so each day is a contiguous block
+    starts = np.flatnonzero( np.r_[ True, days[1:] != days[:-1] ] )
+    ends = np.r_[ starts[1:], len(days) ] - 1
+
+    # fmax ignores NaN unless all values in the block are NaN
+    maxima = np.fmax.reduceat( values, starts, axis=0 )
+
+    return times[ends], maxima
+
+def interpolate( times, values, date ):
+    """Linear interpolation in time (days since EPOCH) to date per station, using the nearest valid value before and after.
+    If only one side is available, that value is used; if neither is available the result is NaN."""
+
+    seconds = ( times - cdf.date2num( date, EPOCH ) ) * 86400.0
+    valid = ~ np.isnan( values )
+
+    # index of the last valid value before, and the first valid value after date, per station
+    before = np.where( valid & ( seconds[:,np.newaxis] <= 0 ), np.arange( len(times) )[:,np.newaxis], -1 ).max( axis=0 )
+    after  = np.where( valid & ( seconds[:,np.newaxis] >= 0 ), np.arange( len(times) )[:,np.newaxis], len(times) ).min( axis=0 )
+
+    stations = np.arange( values.shape[1] )
+    hasbefore = before >= 0
+    hasafter = after < len(times)
+
+    vb = np.where( hasbefore, values[ np.clip( before, 0, len(times) - 1 ), stations ], np.nan )
+    va = np.where( hasafter,  values[ np.clip( after,  0, len(times) - 1 ), stations ], np.nan )
+    sb = np.where( hasbefore, seconds[ np.clip( before, 0, len(times) - 1 ) ], 0.0 )
+    sa = np.where( hasafter,  seconds[ np.clip( after,  0, len(times) - 1 ) ], 0.0 )
+
+    span = sa - sb
+    w = np.where( span > 0, -sb / np.where( span > 0, span, 1.0 ), 0.0 )
+
+    result = np.where( hasbefore & hasafter, vb + w * ( va - vb ), np.where( hasbefore, vb, va ) )
+    return result
+
+def read_grid( filename ):
+    """Read the grid latitudes and longitudes from a wrfinput or wrfout file"""
+    ncfile = cdf.Dataset( filename, 'r' )
+    glats = ncfile.variables['XLAT'][0]
+    glons = ncfile.variables['XLONG'][0]
+    ncfile.close()
+    return glats, glons
+
+def sst( date, glats, glons, filename=WATERTEMP, days=3, cachedir=remap.CACHEDIR ):
+    """Daily maximum water temperature at date, interpolated to the grid (glats, glons), in Kelvin.
+    Without observations in the window it is widened up to MAXDAYS; raises ValueError if there are none"""
+    times, values, lats, lons = read_window( filename, date, days )
+    while np.isnan( values ).all() and days < MAXDAYS:
+        days = min( days * 2, MAXDAYS )
+        logging.warn( "No observations around %s, widening the window to %i days", date.strftime( '%Y-%m-%d' ), days )
+        times, values, lats, lons = read_window( filename, date, days )
+    if np.isnan( values ).all():
+        raise ValueError( "No observations in {} within {} days of {}".format( filename, days, date.strftime( '%Y-%m-%d' ) ) )
+    times, values = daymax( times, values )
+    values = interpolate( times, values, date )
+    return remap.remapdis( lats, lons, values, glats, glons, cachedir ) + 273.15
+
+def write_sst( filename, date, field ):
+    """Write the SST field to a netCDF file, in the same layout as prepare_sst.sh"""
+    ncfile = cdf.Dataset( filename, 'w' )
+    ncfile.createDimension( 'time', None )
+    ncfile.createDimension( 'south_north', field.shape[0] )
+    ncfile.createDimension( 'west_east', field.shape[1] )
+
+    time = ncfile.createVariable( 'time', 'f8', ('time',) )
+    time.units = 'days since 2014-06-01 00:00:00'
+    time.calendar = 'standard'
+    time[0] = cdf.date2num( date, time.units, time.calendar )
+
+    temperature = ncfile.createVariable( 'temperature', 'f4', ('time', 'south_north', 'west_east') )
+    temperature.units = 'K'
+    temperature.long_name = 'Water temperature'
+    temperature[0] = field
+
+    ncfile.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Interpolate Rijkswaterstaat observations to a WRF grid")
+    parser.add_argument('date', type=str, help="Date for the SST as YYYY-MM-DD")
+    parser.add_argument('grid', type=str, help="wrfinput or wrfout file containing the grid (XLAT, XLONG)")
+    parser.add_argument('output', type=str, help="Output netCDF file")
+    parser.add_argument('-o', '--obs', type=str, help="Observations file, default is " + WATERTEMP, default=WATERTEMP)
+    parser.add_argument('-d', '--days', type=int, help="Number of days around date to read, default is 3", default=3)
+    parser.add_argument('-c', '--cache', type=str, help="Directory for the cached remap weights, default is " + remap.CACHEDIR, default=remap.CACHEDIR)
+    args = parser.parse_args()
+
+    date = datetime.datetime.strptime( args.date, '%Y-%m-%d' )
+    glats, glons = read_grid( args.grid )
+    field = sst( date, glats, glons, args.obs, args.days, args.cache )
+    write_sst( args.output, date, field )
+
+    logging.info( "SST for %s written to %s: %.2f - %.2f K", args.date, args.output, field.min(), field.max() )
+
+if __name__ == "__main__":
+    main()
@@ -7,6 +7,9 @@ import re
 import logging
 import argparse
 
+import archiveindex
+import metrics
+
 logging.basicConfig(level=logging.INFO)
 
 ncfile = None
@@ -40,34 +43,46 @@ def main():
     parser = argparse.ArgumentParser(description="A commandline tool to convert WRF timeseries files to netCDF4")
     parser.add_argument('netcdf', metavar="netCDF4 file", type=str, nargs=1, help="NetCDF file base name. Create it first with ts_make_ncs.sh")
     parser.add_argument('-d', '--domain', metavar="domain", type=int, nargs=1, help="WRF domain number", default=0)
+    parser.add_argument('-i', '--index', type=str, help="Add the netCDF file to this archive index, see archiveindex.py")
+    parser.add_argument('-r', '--run', type=str, help="Run date YYYY-MM-DD for the archive index, default is taken from the path")
     args = parser.parse_args()
 
     for varname in ['TS']: # ,'UU','VV','TH','QV','PH']:
         logging.info( "{}".format(varname) )
-        ncfile = cdf.Dataset( args.netcdf[0] + "." + varname + ".nc", "r+" )
+        output = args.netcdf[0] + "." + varname + ".nc"
+        ncfile = cdf.Dataset( output, "r+" )
         do_tslist()
         prefix  = ncfile.variables['prefix']
 
-        for stationi in range(nstations):
+        with metrics.phase( 'parse' ) as p:
+            for stationi in range(nstations):
 
-            filename = "{}.d{:02d}.".format( cdf.chartostring( prefix[stationi] ), args.domain[0] )
-            if not os.path.isfile( filename + "TS" ):
-                continue 
+                filename = "{}.d{:02d}.".format( cdf.chartostring( prefix[stationi] ), args.domain[0] )
+                if not os.path.isfile( filename + "TS" ):
+                    continue 
 
-            if varname in ['TS',]:
-                if not ntimes:
-                    simplecount(filename + "TS", args.domain[0])
+                if varname in ['TS',]:
+                    if not ntimes:
+                        simplecount(filename + "TS", args.domain[0])
+
+                    rows = do_tsfile ( filename + "TS", stationi )
+                    p.add( read=metrics.filesize( filename + "TS" ), rows=rows )
+                else:
+                    do_profile( filename + varname, stationi, varname )
+                    p.add( read=metrics.filesize( filename + varname ) )
 
-                do_tsfile ( filename + "TS", stationi )
+        with metrics.phase( 'write' ) as p:
+            size = metrics.filesize( output )
+            if varname in ['TS',]:
+                flush_tsfile()
             else:
-                do_profile( filename + varname, stationi, varname )
+                ncfile.variables[varname][:,:,:]     = profile   [:,:,:]
 
-        if varname in ['TS',]:
-            flush_tsfile()
-        else:
-            ncfile.variables[varname][:,:,:]     = profile   [:,:,:]
+            ncfile.close()
+            p.add( written=max( 0, metrics.filesize( output ) - size ) )
 
-        ncfile.close()
+        if args.index:
+            archiveindex.add_files( args.index, [ output ], run=args.run, domain=args.domain[0] )
 
 
 def simplecount(filename, domain=-1):
@@ -179,7 +194,7 @@ def do_tsfile(filename, stationi):
 
     if not os.path.isfile( filename):
         logging.info( "Skipping station %s : TS", cdf.chartostring( prefix[stationi] ) )
-        return
+        return 0
 
     logging.debug( "{} starting".format( filename ) )
 
@@ -237,6 +252,7 @@ def do_tsfile(filename, stationi):
 
 
     logging.info( "{} done".format( filename ) )
+    return timei + 1
 
 def flush_tsfile():
     logging.debug( "writing to netcdf file" )
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+import f90nml
+import numpy as np
+import argparse
+import sys
+
+from nestwrf import fixgeogrid, fixshare, latlon_to_ij
+
+
+def read_tslist( filename ):
+    """Parse a WRF tslist file, see the README.tslist in the WRF run directory for details
+    Returns:
+    arrays of station names, prefixes, latitudes and longitudes"""
+
+    names = []
+    prefixes = []
+    lats = []
+    lons = []
+
+    filetslist = open( filename, 'r' )
+
+    # Header
+    # #-----------------------------------------------#
+    # # 24 characters for name | pfx |  LAT  |   LON  |
+    # #-----------------------------------------------#
+
+    for i in range(3):
+        filetslist.readline()
+
+    # Body
+    # veenkampen                veenk 51.98101  5.61957
+    # The name can contain spaces, so parse the line from the right
+    for line in filetslist:
+        fields = line.split()
+        if len(fields) < 4:
+            continue
+        names.append( " ".join( fields[0:-3] ) )
+        prefixes.append( fields[-3] )
+        lats.append( float( fields[-2] ) )
+        lons.append( float( fields[-1] ) )
+
+    filetslist.close()
+
+    return np.array( names ), np.array( prefixes ), np.array( lats ), np.array( lons )
+
+def locate( namelist, lats, lons ):
+    """Find the stations (lats, lons) on all domains of a WRF namelist, typically namelist.wps
+    Returns:
+    boolean array of shape (ndoms, nstations) that is True if the station is inside the domain,
+    the grid indices i, j (nearest mass point, fortran style) of shape (ndoms, nstations),
+    and the innermost domain (starting at 1) containing the station, 0 if outside all domains"""
+
+    fi, fj, nx, ny = latlon_to_ij( namelist, lats, lons )
+
+    # nearest mass point
+    i = np.floor( fi + 0.5 ).astype(int)
+    j = np.floor( fj + 0.5 ).astype(int)
+
+    inside = ( i >= 1 ) & ( i <= nx ) & ( j >= 1 ) & ( j <= ny )
+
+    # nests have higher domain numbers than their parents, so take the last domain containing the station
+    ndoms = inside.shape[0]
+    innermost = ndoms - np.argmax( inside[::-1,:], axis=0 )
+    innermost[ ~ inside.any( axis=0 ) ] = 0
+
+    return inside, i, j, innermost
+
+def printstations( namelist, names, prefixes, lats, lons ):
+    """Print the stations per domain, with the grid indices as they will appear in the header of the .TS files"""
+
+    inside, i, j, innermost = locate( namelist, lats, lons )
+
+    for d in range( inside.shape[0] ):
+        print
+        print "--------------- Domain {:2} ({} of {} stations) ---------- ".format( d + 1, inside[d].sum(), len(names) )
+        for s in np.flatnonzero( inside[d] ):
+            print "{:<25} {:<5} {:>9.5f} {:>10.5f}  ({:4}, {:4})".format( names[s], prefixes[s], lats[s], lons[s], i[d,s], j[d,s] )
+
+    outside = np.flatnonzero( innermost == 0 )
+    if len(outside) > 0:
+        print
+        print "--------------- Outside all domains ({} stations) ---------- ".format( len(outside) )
+        for s in outside:
+            print "{:<25} {:<5} {:>9.5f} {:>10.5f}".format( names[s], prefixes[s], lats[s], lons[s] )
+
+    return len(outside)
+
+def main():
+    parser = argparse.ArgumentParser(description="Check which stations of a WRF tslist fall inside which domain")
+    parser.add_argument("-t", "--tslist", type=str, help="The tslist file, defaults to tslist in the current directory", default="tslist" )
+    parser.add_argument("-s", "--strict", action="store_true", help="Exit with an error if a station is outside all domains" )
+    parser.add_argument('namelist', metavar="namelist",  type=str, nargs=1, help="WRF namelist containing 'share' and 'geogrid' sections")
+    args = parser.parse_args()
+
+    namelist = f90nml.read( args.namelist[0] )
+    namelist['geogrid'] = fixgeogrid( namelist['geogrid'] )
+    namelist['share']   = fixshare( namelist['share'] )
+
+    names, prefixes, lats, lons = read_tslist( args.tslist )
+    nmissing = printstations( namelist, names, prefixes, lats, lons )
+
+    if args.strict and nmissing > 0:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
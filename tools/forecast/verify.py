@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+"""Verification of the TS output against station observations.
+
+Observation files have a sorted 'time' variable with units, 'lat' and 'lon' per station, and the
+observed variables as (time, station), like ~/SST/watertemp.nc. Observation stations are matched
+to the nearest TS station, and observation times to the nearest model time.
+Per cycle, domain, station, variable and lead time bin the sums of forecasts, observations,
+their squares and products are stored, so scores over any period are sums over cycles:
+
+    verify.py add -m tsk:temperature:-273.15 2015-06-03/wrf.d03.TS.nc ~/SST/watertemp.nc
+    verify.py report --first 2015-06-01 --by station,variable
+"""
+
+import netCDF4 as cdf
+import numpy as np
+import datetime
+import argparse
+import logging
+import os
+import sqlite3
+
+import archiveindex
+
+logging.basicConfig(level=logging.INFO)
+
+# scores are kept on a local disk, as the archive index
+SCOREDB = os.path.expanduser( os.environ.get( 'VERIFYDB', '~/.forecast_verify.sqlite' ) )
+
+# TS variable, observed variable, offset added to the model to get observation units;
+# default is the Rijkswaterstaat water temperature (C) against the skin temperature (K)
+MATCHES = "tsk:temperature:-273.15"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scores (
+    cycle     TEXT,
+    domain    INTEGER,
+    station   TEXT,
+    variable  TEXT,
+    lead      INTEGER,
+    n         INTEGER,
+    sf        REAL,
+    so        REAL,
+    sff       REAL,
+    soo       REAL,
+    sfo       REAL,
+    sae       REAL,
+    PRIMARY KEY ( cycle, domain, station, variable, lead )
+);
+"""
+
+HOURS = { 'days': 24.0, 'hours': 1.0, 'minutes': 1.0 / 60.0, 'seconds': 1.0 / 3600.0 }
+
+
+def hours_per_unit( units ):
+    """Hours per unit of a CF time axis like 'days since 1970-01-01'"""
+    return HOURS[ units.split()[0].lower() ]
+
+def read_ts( filename ):
+    """Model time (hours since the start of the run), station prefixes, lat and lon, and the open file.
+    Time steps after the last one written by ts_copy_ascii.py (zeros) are left out"""
+    ncfile = cdf.Dataset( filename, 'r' )
+    hours = np.ma.filled( ncfile.variables['time'][:], np.nan ).astype( float )
+
+    # the time axis is preallocated; the data ends where time stops increasing
+    steps = np.diff( hours )
+    ntimes = len( hours ) if np.all( steps > 0 ) else 1 + np.argmax( ~ ( steps > 0 ) )
+
+    prefixes = [ str( p ) for p in cdf.chartostring( ncfile.variables['prefix'][:] ) ]
+    lats = ncfile.variables['lat'][:]
+    lons = ncfile.variables['lon'][:]
+    return hours[:ntimes], prefixes, lats, lons, ncfile
+
+def match_stations( lats, lons, olats, olons, distance ):
+    """Nearest model station for each observation station, or -1 if none within distance (km)"""
+    dy = ( olats[:, np.newaxis] - lats[np.newaxis, :] ) * 111.2
+    dx = ( olons[:, np.newaxis] - lons[np.newaxis, :] ) * 111.2 * np.cos( np.radians( olats[:, np.newaxis] ) )
+    d = np.hypot( dx, dy )
+    nearest = np.argmin( d, axis=1 )
+    return np.where( d[np.arange( len( olats ) ), nearest] <= distance, nearest, -1 )
+
+def match_times( model, obs, tolerance ):
+    """Index of the nearest model time for each observation time, both sorted and in the same units,
+    or -1 if none within tolerance"""
+    right = np.clip( np.searchsorted( model, obs ), 1, len( model ) - 1 )
+    left = right - 1
+    nearest = np.where( np.abs( obs - model[left] ) <= np.abs( model[right] - obs ), left, right )
+    return np.where( np.abs( model[nearest] - obs ) <= tolerance, nearest, -1 )
+
+def statistics( forecast, observed, bins, nbins ):
+    """Sums per lead time bin and station of arrays (time, station) with NaN for missing values.
+    Returns a dictionary of arrays (bin, station) for n, sf, so, sff, soo, sfo and sae"""
+    valid = ~ ( np.isnan( forecast ) | np.isnan( observed ) )
+    nstations = forecast.shape[1]
+    key = ( bins[:, np.newaxis] * nstations + np.arange( nstations )[np.newaxis, :] )[valid]
+    f, o = forecast[valid], observed[valid]
+
+    total = lambda w: np.bincount( key, weights=w, minlength=nbins * nstations ).reshape( nbins, nstations )
+    return { 'n': total( None ), 'sf': total( f ), 'so': total( o ), 'sff': total( f * f ), 'soo': total( o * o ),
+             'sfo': total( f * o ), 'sae': total( np.abs( f - o ) ) }
+
+def verify( tsfile, obsfiles, matches, run, binsize=6, tolerance=5.0, distance=2.0 ):
+    """Sums of the TS variables against the observations, per station, variable and lead time bin (hours).
+    Observation times within tolerance (minutes) of a model time, and stations within distance (km) are used.
+    Returns a list of rows (station, variable, bin, n, sf, so, sff, soo, sfo, sae)"""
+
+    hours, prefixes, lats, lons, ts = read_ts( tsfile )
+    start = datetime.datetime.strptime( run, '%Y-%m-%d' )
+    nbins = int( np.ceil( ( hours[-1] + 1e-6 ) / binsize ) )
+    totals = {}
+
+    for obsfile in obsfiles:
+        obs = cdf.Dataset( obsfile, 'r' )
+        time = obs.variables['time']
+        calendar = getattr( time, 'calendar', 'standard' )
+
+        # model times in the units of the observations
+        factor = 1.0 / hours_per_unit( time.units )
+        model = cdf.date2num( start, time.units, calendar ) + hours * factor
+
+        # only the observations during the run are read
+        timevalues = time[:]
+        first = np.searchsorted( timevalues, model[0] - tolerance / 60.0 * factor, side='left' )
+        last = np.searchsorted( timevalues, model[-1] + tolerance / 60.0 * factor, side='right' )
+        index = match_times( model, timevalues[first:last], tolerance / 60.0 * factor )
+        steps = np.where( index >= 0 )[0]
+
+        stations = match_stations( lats, lons, obs.variables['lat'][:], obs.variables['lon'][:], distance )
+        columns = np.where( stations >= 0 )[0]
+        if len( steps ) == 0 or len( columns ) == 0:
+            logging.warn( "%s: no observations during the run at the stations of %s", obsfile, tsfile )
+            obs.close()
+            continue
+
+        for tsvar, obsvar, offset in matches:
+            if obsvar not in obs.variables or tsvar not in ts.variables:
+                continue
+
+            observed = np.ma.filled( obs.variables[obsvar][first:last].astype( float ), np.nan )[steps][:, columns]
+            forecast = np.ma.filled( ts.variables[tsvar][:len( hours )].astype( float ), np.nan )
+            forecast = forecast[index[steps]][:, stations[columns]] + offset
+            bins = np.floor( hours[index[steps]] / binsize ).astype( int )
+
+            sums = statistics( forecast, observed, bins, nbins )
+            # several observation stations or files can match the same model station
+            for b, s in zip( *np.nonzero( sums['n'] ) ):
+                key = ( prefixes[stations[columns[s]]], tsvar, int( b * binsize ) )
+                values = np.array( [ sums[k][b, s] for k in [ 'n', 'sf', 'so', 'sff', 'soo', 'sfo', 'sae' ] ] )
+                totals[key] = totals.get( key, 0.0 ) + values
+
+            logging.info( "%s: %s against %s, %i pairs", tsfile, tsvar, obsvar, int( sums['n'].sum() ) )
+        obs.close()
+
+    ts.close()
+    return [ key + ( int( v[0] ), ) + tuple( v[1:] ) for key, v in sorted( totals.items() ) ]
+
+def store( dbfile, cycle, domain, rows ):
+    """Replace the sums of a cycle and domain in the score database"""
+    db = sqlite3.connect( dbfile, timeout=60 )
+    db.executescript( SCHEMA )
+    with db:
+        db.execute( "DELETE FROM scores WHERE cycle = ? AND domain = ?", ( cycle, domain ) )
+        db.executemany( "INSERT OR REPLACE INTO scores VALUES ( ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ? )",
+                        [ ( cycle, domain ) + tuple( r ) for r in rows ] )
+    db.close()
+
+def scores( n, sf, so, sff, soo, sfo, sae ):
+    """Bias, RMSE, MAE and correlation from the sums, for arrays"""
+    bias = ( sf - so ) / n
+    rmse = np.sqrt( np.maximum( sff - 2 * sfo + soo, 0.0 ) / n )
+    mae = sae / n
+    with np.errstate( invalid='ignore', divide='ignore' ):
+        corr = ( n * sfo - sf * so ) / np.sqrt( ( n * sff - sf * sf ) * ( n * soo - so * so ) )
+    return bias, rmse, mae, corr
+
+def report( dbfile, by, first=None, last=None ):
+    """Scores over the cycles from first to last (YYYY-MM-DD), grouped by columns of the score table.
+    Returns a list of (group values, n, bias, rmse, mae, corr)"""
+    query = "SELECT {0}, SUM(n), SUM(sf), SUM(so), SUM(sff), SUM(soo), SUM(sfo), SUM(sae) FROM scores WHERE 1".format( ", ".join( by ) )
+    values = []
+    if first:
+        query += " AND cycle >= ?"
+        values.append( first )
+    if last:
+        query += " AND cycle <= ?"
+        values.append( last )
+    query += " GROUP BY {0} ORDER BY {0}".format( ", ".join( by ) )
+
+    db = sqlite3.connect( dbfile, timeout=60 )
+    db.executescript( SCHEMA )
+    rows = db.execute( query, values ).fetchall()
+    db.close()
+    if not rows:
+        return []
+
+    sums = np.array( [ r[len( by ):] for r in rows ], dtype=float ).T
+    bias, rmse, mae, corr = scores( *sums )
+    return [ ( r[:len( by )], int( r[len( by )] ), bias[i], rmse[i], mae[i], corr[i] ) for i, r in enumerate( rows ) ]
+
+def main():
+    parser = argparse.ArgumentParser(description="Verify TS output against station observations")
+    parser.add_argument('-d', '--db', type=str, help="Score database, default is " + SCOREDB, default=SCOREDB)
+    commands = parser.add_subparsers(dest='command')
+
+    p = commands.add_parser('add', help="Verify the TS file of a cycle, and store its sums")
+    p.add_argument('tsfile', type=str, help="TS netCDF file, as made by ts_copy_ascii.py")
+    p.add_argument('obs', type=str, nargs='+', help="Observation netCDF files")
+    p.add_argument('-r', '--run', type=str, help="Run date YYYY-MM-DD, default is taken from the path")
+    p.add_argument('--domain', type=int, help="Domain, default is taken from the file name, like wrf.d03.TS.nc")
+    p.add_argument('-m', '--match', type=str, action='append',
+                   help="TS variable, observed variable and offset added to the model, like tsk:temperature:-273.15; can be repeated, default is " + MATCHES)
+    p.add_argument('-b', '--bin', type=int, help="Lead time bin in hours, default is 6", default=6)
+    p.add_argument('-t', '--tolerance', type=float, help="Largest difference between model and observation time in minutes, default is 5", default=5.0)
+    p.add_argument('--distance', type=float, help="Largest distance between model and observation station in km, default is 2", default=2.0)
+
+    p = commands.add_parser('report', help="Print scores over a period")
+    p.add_argument('--first', type=str, help="First cycle, YYYY-MM-DD")
+    p.add_argument('--last', type=str, help="Last cycle, YYYY-MM-DD")
+    p.add_argument('--by', type=str, help="Comma separated grouping of cycle, domain, station, variable and lead; default is variable,lead",
+                   default="variable,lead")
+
+    args = parser.parse_args()
+
+    if args.command == 'add':
+        run = args.run or archiveindex.rundate( args.tsfile )
+        if run is None:
+            parser.error( "Give the run date, it is not in the path" )
+        domain = args.domain
+        if domain is None:
+            m = archiveindex.DOMAINREGEX.search( os.path.basename( args.tsfile ) )
+            domain = int( m.group(1) ) if m else 0
+
+        matches = []
+        for match in ( args.match or [ MATCHES ] ):
+            fields = match.split( ':' )
+            matches.append( ( fields[0], fields[1], float( fields[2] ) if len( fields ) > 2 else 0.0 ) )
+
+        rows = verify( args.tsfile, args.obs, matches, run, args.bin, args.tolerance, args.distance )
+        store( args.db, run, domain, rows )
+        logging.info( "%s: %i scores for cycle %s domain %i", args.db, len( rows ), run, domain )
+
+    elif args.command == 'report':
+        by = [ b for b in args.by.split( ',' ) if b ]
+        for b in by:
+            if b not in [ 'cycle', 'domain', 'station', 'variable', 'lead' ]:
+                parser.error( "Unknown grouping {}".format( b ) )
+        print " ".join( [ "{:>12}".format( b ) for b in by ] ), "{:>8} {:>8} {:>8} {:>8} {:>6}".format( 'n', 'bias', 'rmse', 'mae', 'corr' )
+        for group, n, bias, rmse, mae, corr in report( args.db, by, args.first, args.last ):
+            print " ".join( [ "{:>12}".format( g ) for g in group ] ), "{:8d} {:8.3f} {:8.3f} {:8.3f} {:6.3f}".format( n, bias, rmse, mae, corr )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+# vim: set fileencoding=utf-8 :
+"""Diagnostics from WRF history files, computed for blocks of time steps at once.
+
+    import wrfdiag
+    slp = wrfdiag.getdiag( 'wrfout_d01_2015-06-03_00:00:00.nc', 'slp', [ 0, 2, 4 ] )
+
+Diagnostics are listed in DIAGNOSTICS; any other name is read from the file.
+Fields that do not change during a run (terrain, base state, lat/lon) are read once per domain,
+and results are kept per (file, time step, name), so plots, verification and exports
+in the same process share the computation.
+"""
+
+import netCDF4 as cdf
+import numpy as np
+import collections
+import os
+
+import wrfstatic
+
+# constants, as in the NCL WRF routines
+G      = 9.81
+RD     = 287.04
+RCP    = 2.0 / 7.0
+GAMMA  = 0.0065
+TC     = 273.16 + 17.5
+PCONST = 10000.0
+KELVIN = 273.16
+
+# fields that do not change during a run, cached per domain
+STATICFIELDS = [ 'XLAT', 'XLONG', 'HGT', 'LANDMASK', 'LU_INDEX', 'PB', 'PHB', 'COSALPHA', 'SINALPHA' ]
+
+# memory used for results, in bytes
+MAXBYTES = 512 * 1024 * 1024
+
+_static = {}
+_results = collections.OrderedDict()
+_nbytes = [ 0 ]
+
+
+def smooth2d( field, passes ):
+    """1-2-1 smoother in both directions, the boundary is not changed; as wrf_smooth_2d"""
+    field = field.copy()
+    for n in range( passes ):
+        field[..., 1:-1, :] = 0.25 * ( field[..., :-2, :] + 2 * field[..., 1:-1, :] + field[..., 2:, :] )
+        field[..., :, 1:-1] = 0.25 * ( field[..., :, :-2] + 2 * field[..., :, 1:-1] + field[..., :, 2:] )
+    return field
+
+def sealevelpressure( p, tk, qv, z ):
+    """Sea level pressure (hPa) for arrays (time, level, south_north, west_east) of pressure (Pa),
+    temperature (K), water vapour mixing ratio and height of the mass levels (m).
+    Uses the temperature 100 hPa above the surface extrapolated with a standard lapse rate, as the NCL 'slp'"""
+
+    p0 = p[:, 0]
+    ptarget = p0 - PCONST
+
+    # the levels just below and above 100 hPa above the surface
+    above = np.argmax( p < ptarget[:, np.newaxis], axis=1 )
+    klo = np.clip( above - 1, 0, p.shape[1] - 2 )[:, np.newaxis]
+    khi = klo + 1
+
+    tv = tk * ( 1.0 + 0.608 * qv )
+    plo = np.take_along_axis( p,  klo, axis=1 )[:, 0]
+    phi = np.take_along_axis( p,  khi, axis=1 )[:, 0]
+    tlo = np.take_along_axis( tv, klo, axis=1 )[:, 0]
+    thi = np.take_along_axis( tv, khi, axis=1 )[:, 0]
+    zlo = np.take_along_axis( z,  klo, axis=1 )[:, 0]
+    zhi = np.take_along_axis( z,  khi, axis=1 )[:, 0]
+
+    weight = np.log( ptarget / phi ) / np.log( plo / phi )
+    t_target = thi - ( thi - tlo ) * weight
+    z_target = zhi - ( zhi - zlo ) * weight
+
+    t_surf = t_target * ( p0 / ptarget ) ** ( GAMMA * RD / G )
+    t_sea_level = t_target + GAMMA * z_target
+
+    # correction if the sea level temperature is too hot
+    hot = t_sea_level >= TC
+    t_sea_level = np.where( hot & ( t_surf <= TC ), TC, np.where( hot, TC - 0.005 * ( t_surf - TC ) ** 2, t_sea_level ) )
+
+    return 0.01 * p0 * np.exp( 2.0 * G * z[:, 0] / ( RD * ( t_sea_level + t_surf ) ) )
+
+def dewpoint( q, p ):
+    """Dew point temperature (C) from water vapour mixing ratio and pressure (Pa), as the NCL 'td2'"""
+    e = np.maximum( q * 0.01 * p / ( 0.622 + q ), 0.001 )
+    return ( 243.5 * np.log( e ) - 440.8 ) / ( 19.48 - np.log( e ) )
+
+def relativehumidity( q, p, t ):
+    """Relative humidity (%) from water vapour mixing ratio, pressure (Pa) and temperature (K), as the NCL 'rh2'"""
+    es = 6.112 * np.exp( 17.67 * ( t - 273.15 ) / ( t - 29.65 ) )
+    qs = 0.622 * es / ( 0.01 * p - 0.378 * es )
+    return np.clip( 100.0 * q / qs, 0.0, 100.0 )
+
+def pressure( get ):
+    """Full pressure (Pa)"""
+    return get( 'P' ) + get( 'PB' )
+
+def temperature( get ):
+    """Temperature (K) from perturbation potential temperature"""
+    return ( get( 'T' ) + 300.0 ) * ( pressure( get ) / 1.0e5 ) ** RCP
+
+def height( get ):
+    """Height of the mass levels (m)"""
+    ph = ( get( 'PH' ) + get( 'PHB' ) ) / G
+    return 0.5 * ( ph[:, :-1] + ph[:, 1:] )
+
+def earthwinds( get ):
+    """10 m wind rotated from grid to earth coordinates"""
+    u, v = get( 'U10' ), get( 'V10' )
+    cosa, sina = get( 'COSALPHA' ), get( 'SINALPHA' )
+    return u * cosa - v * sina, v * cosa + u * sina
+
+# diagnostics, each computed from a reader get( name ) returning arrays with time as first dimension
+DIAGNOSTICS = {
+    'slp':    lambda get: sealevelpressure( pressure( get ), temperature( get ), get( 'QVAPOR' ), height( get ) ),
+    'tk':     temperature,
+    'tc':     lambda get: temperature( get ) - KELVIN,
+    'pres':   pressure,
+    'z':      height,
+    'tc2':    lambda get: get( 'T2' ) - KELVIN,
+    'td2':    lambda get: dewpoint( get( 'Q2' ), get( 'PSFC' ) ),
+    'rh2':    lambda get: relativehumidity( get( 'Q2' ), get( 'PSFC' ), get( 'T2' ) ),
+    'wspd10': lambda get: np.hypot( get( 'U10' ), get( 'V10' ) ),
+    'wdir10': lambda get: np.mod( 270.0 - np.degrees( np.arctan2( *earthwinds( get )[::-1] ) ), 360.0 ),
+    'uvmet10': lambda get: np.array( earthwinds( get ) ).swapaxes( 0, 1 ),
+}
+
+
+def statickey( ncfile, name ):
+    """Cache key for a time invariant field: fields taken from the static file are the same for all runs
+    of a domain, other fields are cached per file"""
+    references = wrfstatic.references( ncfile )
+    if name in references:
+        return ( wrfstatic.domain( ncfile ), name, references[name] )
+    return ( ncfile.filepath(), name )
+
+def reader( ncfile, times, staticdir=None, window=None ):
+    """Reader for the time steps in the list times of an open file, as used by the DIAGNOSTICS.
+    Time invariant fields are read once and repeated for all time steps.
+    With a window (j0, j1, i0, i1) of the mass grid, only that part of the fields is read."""
+    def get( name ):
+        if name in STATICFIELDS:
+            key = statickey( ncfile, name )
+            if key not in _static:
+                _static[key] = wrfstatic.getvar( ncfile, name, 0, staticdir )
+            field = _static[key][ ( Ellipsis, ) + wrfstatic.region( window ) ]
+            return np.repeat( field[np.newaxis], len( times ), axis=0 )
+        return wrfstatic.getvar( ncfile, name, times, staticdir, window )
+    return get
+
+def getdiag( filename, name, times, staticdir=None, window=None ):
+    """Diagnostic or variable 'name' for the time steps in the list times of a wrfout file.
+    With a window (j0, j1, i0, i1) of the mass grid, only that part of the grid is read.
+    Only the time steps not computed before are read, all at once; the oldest results are
+    forgotten when they use more than MAXBYTES.
+    Returns an array with time as first dimension"""
+
+    filename = os.path.abspath( filename )
+    found = dict( [ ( t, _results[( filename, t, name, window )] ) for t in times if ( filename, t, name, window ) in _results ] )
+    missing = [ t for t in times if t not in found ]
+
+    if missing:
+        ncfile = cdf.Dataset( filename, 'r' )
+        get = reader( ncfile, missing, staticdir, window )
+        if name in DIAGNOSTICS:
+            data = DIAGNOSTICS[name]( get )
+        else:
+            data = get( name )
+        ncfile.close()
+
+        for t, field in zip( missing, data ):
+            found[t] = field
+            _results[( filename, t, name, window )] = field
+            _nbytes[0] += field.nbytes
+        while _nbytes[0] > MAXBYTES and _results:
+            _nbytes[0] -= _results.popitem( last=False )[1].nbytes
+
+    return np.array( [ found[t] for t in times ] )
+
+def clear():
+    """Forget all cached fields and results"""
+    _static.clear()
+    _results.clear()
+    _nbytes[0] = 0
@@ -0,0 +1,50 @@
+# Compression profile for archived wrfout files, used by convert_nc4.py
+#
+# variable: WRF variable name, 'default' applies to all variables not listed
+# digits:   least_significant_digit, number of decimals kept, '-' for lossless
+# deflate:  zlib compression level 0-9
+# shuffle:  byte shuffle filter, 1 or 0
+#
+# Run convert_nc4.py --benchmark <wrfout> to see the effect per variable.
+#
+# variable    digits  deflate  shuffle
+default       -       4        1
+T2            2       4        1
+SST           2       4        1
+TH2           2       4        1
+Q2            5       4        1
+U10           2       4        1
+V10           2       4        1
+PSFC          0       4        1
+T             2       4        1
+U             2       4        1
+V             2       4        1
+W             3       4        1
+P             0       4        1
+PH            1       4        1
+QVAPOR        6       4        1
+QCLOUD        7       4        1
+QRAIN         7       4        1
+SWDOWN        1       4        1
+GLW           1       4        1
+HFX           1       4        1
+LH            1       4        1
+GRDFLX        1       4        1
+TC2M_URB      2       4        1
+TP2M_URB      2       4        1
+#
+# state read back by cycle.py to start the next run (CYCLEFIELDS and URBANFIELDS), always lossless
+TSK           -       4        1
+TSLB          -       4        1
+SMOIS         -       4        1
+SH2O          -       4        1
+SMCREL        -       4        1
+CANWAT        -       4        1
+TC_URB        -       4        1
+TR_URB        -       4        1
+TB_URB        -       4        1
+TG_URB        -       4        1
+TS_URB        -       4        1
+TRL_URB       -       4        1
+TBL_URB       -       4        1
+TGL_URB       -       4        1
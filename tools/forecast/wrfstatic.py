@@ -0,0 +1,185 @@
+# vim: set fileencoding=utf-8 :
+"""Time invariant fields of WRF history files, stored once per domain in a static file.
+
+Fields like XLAT, XLONG, HGT and LANDMASK are repeated in every time step of every wrfout file.
+When converting, fields that do not change in time, and are identical to the field in the
+static file, are left out. The wrfout file refers to the static file in its global attributes:
+
+    static_file         name of the static file, like static_d01.nc
+    static_variables    comma separated list of fields taken from the static file
+    static_checksums    comma separated list of their checksums
+
+Use read() or frames() to read a field from a wrfout file with the static fields put back.
+"""
+
+import netCDF4 as cdf
+import numpy as np
+import hashlib
+import os
+import shutil
+
+import cycle
+
+# state read back by cycle.py from archived files, never moved to the static file,
+# even when constant (like the urban fields of a domain without urban physics)
+KEEP = set( ( cycle.URBANFIELDS + "," + cycle.CYCLEFIELDS ).split( ',' ) + [ 'Times' ] )
+
+# directory of the static files, by default next to the archived runs
+STATICDIR = os.environ.get( 'STATICDIR', os.path.join( os.environ.get( 'ARCDIR', '/projects/0/sitc/archive2' ), 'static' ) )
+
+
+def staticname( domain ):
+    """Name of the static file for a domain (1, 2, ..)"""
+    return "static_d{:02}.nc".format( domain )
+
+def domain( ncfile ):
+    """Domain number of a WRF file, from the GRID_ID attribute"""
+    return int( ncfile.getncattr( 'GRID_ID' ) )
+
+def framechecksum( frame ):
+    """Checksum of the raw data of a single time step"""
+    return hashlib.md5( np.ascontiguousarray( frame ).tostring() ).hexdigest()
+
+def constant( v ):
+    """True if all time steps of a variable are identical; stops reading at the first difference"""
+    if v.dimensions[0] != 'Time' or v.shape[0] < 2:
+        return False
+    first = v[0]
+    for t in range( 1, v.shape[0] ):
+        if not np.array_equal( v[t], first ):
+            return False
+    return True
+
+def candidates( src ):
+    """Names and checksums of the fields in an open netCDF file that do not change in time, except those in KEEP"""
+    src.set_auto_maskandscale( False )
+    return [ ( name, framechecksum( v[0] ) ) for name, v in src.variables.items()
+             if name not in KEEP and constant( v ) ]
+
+def update( src, staticdir, profile=None ):
+    """Add the time invariant fields of the open WRF file src to its static file, if they are not there yet.
+    The static file is copied to a temporary name, extended, and renamed over the original,
+    so it is never missing, not even after a crash.
+    Returns the static file name and a list of (name, checksum) of fields that match the static file;
+    fields that do not match, for instance after a change of the domain, are not returned."""
+
+    filename = os.path.join( staticdir, staticname( domain( src ) ) )
+    found = candidates( src )
+
+    existing = {}
+    if os.path.isfile( filename ):
+        old = cdf.Dataset( filename, 'r' )
+        existing = dict( [ ( name, v.getncattr( 'checksum' ) ) for name, v in old.variables.items() ] )
+        dims = dict( [ ( name, len(d) ) for name, d in old.dimensions.items() ] )
+        old.close()
+
+        # a different grid, do not use the static file
+        for name, dim in src.dimensions.items():
+            if name in dims and name != 'Time' and dims[name] != len( dim ):
+                return filename, []
+
+    new = [ ( name, checksum ) for name, checksum in found if name not in existing ]
+    if new:
+        if not os.path.isdir( staticdir ):
+            os.makedirs( staticdir )
+
+        working = filename + ".working"
+        if os.path.isfile( filename ):
+            shutil.copy2( filename, working )
+            dst = cdf.Dataset( working, 'a' )
+        else:
+            dst = cdf.Dataset( working, 'w', format='NETCDF4_CLASSIC' )
+            dst.setncatts( dict( [ (a, src.getncattr(a)) for a in src.ncattrs() ] ) )
+        dst.set_auto_maskandscale( False )
+
+        for name, checksum in new:
+            v = src.variables[name]
+            for dim in v.dimensions:
+                if dim not in dst.dimensions:
+                    dst.createDimension( dim, None if dim == 'Time' else len( src.dimensions[dim] ) )
+            kwargs = {}
+            if profile is not None:
+                kwargs = profile( name, v )
+            n = dst.createVariable( name, v.dtype, v.dimensions, **kwargs )
+            n.setncatts( dict( [ (a, v.getncattr(a)) for a in v.ncattrs() ] ) )
+            n.setncattr( 'checksum', checksum )
+            n[0] = v[0]
+            existing[name] = checksum
+
+        dst.close()
+        os.rename( working, filename )
+
+    return filename, [ ( name, checksum ) for name, checksum in found if existing[name] == checksum ]
+
+def references( ncfile ):
+    """Dictionary of field: checksum of the static fields of an open wrfout file"""
+    if 'static_variables' not in ncfile.ncattrs():
+        return {}
+    names = [ n for n in ncfile.getncattr( 'static_variables' ).split(',') if n ]
+    checksums = ncfile.getncattr( 'static_checksums' ).split(',')
+    return dict( zip( names, checksums ) )
+
+def open_static( ncfile, varname, staticdir=None ):
+    """Open the static file of an open wrfout file, and check the checksum of a field.
+    Returns the static dataset"""
+    filename = os.path.join( staticdir or STATICDIR, ncfile.getncattr( 'static_file' ) )
+    static = cdf.Dataset( filename, 'r' )
+    if static.variables[varname].getncattr( 'checksum' ) != references( ncfile )[varname]:
+        static.close()
+        raise ValueError( "Static field {} in {} does not match".format( varname, filename ) )
+    return static
+
+def frames( filename, varname, staticdir=None, maskandscale=False ):
+    """Generator over the time steps of a variable in a wrfout file, taking static fields from the static file"""
+    ncfile = cdf.Dataset( filename, 'r' )
+    ncfile.set_auto_maskandscale( maskandscale )
+
+    if varname in ncfile.variables:
+        v = ncfile.variables[varname]
+        if v.dimensions[0] == 'Time':
+            for t in range( v.shape[0] ):
+                yield v[t]
+        else:
+            yield v[:]
+    else:
+        ntimes = len( ncfile.dimensions['Time'] )
+        static = open_static( ncfile, varname, staticdir )
+        static.set_auto_maskandscale( maskandscale )
+        frame = static.variables[varname][0]
+        static.close()
+        for t in range( ntimes ):
+            yield frame
+
+    ncfile.close()
+
+def read( filename, varname, staticdir=None ):
+    """Read all time steps of a variable from a wrfout file, taking static fields from the static file"""
+    ncfile = cdf.Dataset( filename, 'r' )
+    if varname in ncfile.variables:
+        data = ncfile.variables[varname][:]
+        ncfile.close()
+        return data
+    ncfile.close()
+    return np.array( list( frames( filename, varname, staticdir, True ) ) )
+
+def region( window ):
+    """Index of the last two dimensions for a window (j0, j1, i0, i1), all of them if None"""
+    if window is None:
+        return ()
+    return ( slice( window[0], window[1] ), slice( window[2], window[3] ) )
+
+def getvar( ncfile, varname, index, staticdir=None, window=None ):
+    """Read time steps (an index, slice or list of indices) of a variable from an open wrfout file,
+    taking static fields from the static file. With a window (j0, j1, i0, i1) only that part
+    of the last two dimensions is read"""
+    if varname in ncfile.variables:
+        return ncfile.variables[varname][ ( index, Ellipsis ) + region( window ) ]
+
+    static = open_static( ncfile, varname, staticdir )
+    frame = static.variables[varname][ ( 0, Ellipsis ) + region( window ) ]
+    static.close()
+
+    times = np.arange( len( ncfile.dimensions['Time'] ) )[index]
+    if np.ndim( times ) == 0:
+        return frame
+    return np.repeat( frame[np.newaxis], len( times ), axis=0 )